@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# coding: utf8
+import re
+import threading
+from datetime import datetime, time
+from time import monotonic, sleep
+from typing import Callable, List, NamedTuple
+
+import logging
+
+log = logging.getLogger(__name__)
+
+RATE_MATCH = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:B|B/S)?\s*$", re.IGNORECASE)
+WINDOW_MATCH = re.compile(r"^\s*(.+)@\s*(\d\d?):(\d\d)\s*-\s*(\d\d?):(\d\d)\s*$")
+MULTIPLIERS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+class BandwidthWindow(NamedTuple):
+    start: time
+    end: time
+    rate: int
+
+
+def parse_rate(value: str) -> int:
+    """ convert a rate such as '500K' or '5M' into bytes per second.
+    0 means unlimited """
+    matches = RATE_MATCH.match(value)
+    if not matches:
+        raise ValueError("invalid bandwidth '{}'".format(value))
+    return int(float(matches[1]) * MULTIPLIERS[matches[2].upper()])
+
+
+def parse_schedule(value: str) -> List[BandwidthWindow]:
+    """ convert a schedule such as '5M@08:00-18:00,1M@18:00-23:00' into a
+    list of BandwidthWindow. A window may span midnight e.g. 22:00-06:00 """
+    windows = []
+    for window in value.split(","):
+        if not window.strip():
+            continue
+        matches = WINDOW_MATCH.match(window)
+        if not matches:
+            raise ValueError("invalid bandwidth schedule '{}'".format(window))
+        rate = parse_rate(matches[1])
+        start = time(int(matches[2]), int(matches[3]))
+        end = time(int(matches[4]), int(matches[5]))
+        windows.append(BandwidthWindow(start, end, rate))
+    return windows
+
+
+class BandwidthLimiter:
+    """ Limits the combined download rate of all download threads.
+
+    Each thread calls consume() with the number of bytes it has just read.
+    Bytes are given consecutive time slots at the current rate and a thread
+    sleeps until the end of its slot. Unused time is not saved up beyond the
+    current read, so there are no bursts after an idle period. Threads should
+    read in chunks of at most chunk_size() bytes to keep the flow smooth.
+    """
+
+    # the longest time worth of data to read in a single chunk
+    CHUNK_SECONDS: float = 0.1
+    # how often to re-evaluate the schedule
+    SCHEDULE_CHECK_SECONDS: float = 1.0
+
+    def __init__(
+        self,
+        rate: int = 0,
+        schedule: List[BandwidthWindow] = None,
+        clock: Callable[[], float] = monotonic,
+        wait: Callable[[float], None] = sleep,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        """
+        Parameters:
+            rate: bytes per second outside of the schedule, 0 for unlimited
+            schedule: time of day windows with their own rate
+            clock, wait, now: time functions (replaced in tests)
+        """
+        self.default_rate = rate
+        self.schedule = schedule or []
+        self._clock = clock
+        self._wait = wait
+        self._now = now
+        self._lock = threading.Lock()
+        self._next_slot: float = 0.0
+        self._rate: int = rate
+        self._rate_checked: float = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.default_rate or self.schedule)
+
+    def scheduled_rate(self, when: datetime) -> int:
+        t = when.time()
+        for window in self.schedule:
+            if window.start <= window.end:
+                inside = window.start <= t < window.end
+            else:
+                inside = t >= window.start or t < window.end
+            if inside:
+                return window.rate
+        return self.default_rate
+
+    def rate(self) -> int:
+        """ the current limit in bytes per second, 0 for unlimited """
+        if self.schedule:
+            tick = self._clock()
+            if (
+                self._rate_checked is None
+                or tick - self._rate_checked > self.SCHEDULE_CHECK_SECONDS
+            ):
+                rate = self.scheduled_rate(self._now())
+                if rate != self._rate:
+                    log.info("bandwidth limit now %d bytes/sec", rate)
+                self._rate = rate
+                self._rate_checked = tick
+        return self._rate
+
+    def chunk_size(self, maximum: int) -> int:
+        rate = self.rate()
+        if not rate:
+            return maximum
+        return max(1, min(maximum, int(rate * self.CHUNK_SECONDS)))
+
+    def consume(self, count: int):
+        rate = self.rate()
+        if not rate:
+            return
+        duration = count / rate
+        with self._lock:
+            now = self._clock()
+            # the bytes were read over (at least) the time leading up to now
+            start = max(now - duration, self._next_slot)
+            self._next_slot = start + duration
+            delay = self._next_slot - now
+        if delay > 0:
+            self._wait(delay)
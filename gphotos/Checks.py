@@ -6,7 +6,9 @@ import random
 import shutil
 import subprocess
 from pathlib import Path
-from psutil import disk_partitions
+from typing import Any, Dict
+
+from gphotos import Utils
 
 log = logging.getLogger(__name__)
 
@@ -27,8 +29,11 @@ def checkFilesystem(mypath):
     global FILESYSTEM_TYPE, FILESYSTEM_IS_LINUX
 
     if not FILESYSTEM_TYPE:
+        # psutil is slow to import and only needed here
+        import psutil
+
         FILESYSTEM_TYPE = ""
-        for part in disk_partitions():
+        for part in psutil.disk_partitions():
             if part.mountpoint == "/":
                 FILESYSTEM_TYPE = part.fstype
                 continue
@@ -40,11 +45,50 @@ def checkFilesystem(mypath):
         FILESYSTEM_IS_LINUX = not (
             "fat" in FILESYSTEM_TYPE or "ntfs" in FILESYSTEM_TYPE
         )
-        log.info(f"Target filesystem {mypath} is {FILESYSTEM_TYPE}")
+        log.info("Target filesystem %s is %s", mypath, FILESYSTEM_TYPE)
 
     return FILESYSTEM_TYPE
 
 
+def filesystem_id(root_folder: Path) -> str:
+    """ identifies the filesystem holding root_folder by its device ID and
+    mount point, so that cached check results can be invalidated when
+    something else is mounted there """
+    path = os.path.realpath(str(root_folder))
+    mount = path
+    while not os.path.ismount(mount):
+        mount = os.path.dirname(mount)
+    return "{}:{}".format(os.stat(path).st_dev, mount)
+
+
+def probe_filesystem(root_folder: Path) -> Dict[str, Any]:
+    """ run all of the checks on the filesystem holding root_folder and
+    return the results in a form that can be saved and passed to
+    restore_filesystem on a later run """
+    return {
+        "minimum_date": Utils.date_to_string(Utils.minimum_date(root_folder)),
+        "filesystem_type": checkFilesystem(root_folder),
+        "max_path_length": get_max_path_length(root_folder),
+        "max_filename_length": get_max_filename_length(root_folder),
+        "unicode_filenames": unicode_filenames(root_folder),
+        "symlinks": symlinks_supported(root_folder),
+        "case_sensitive": is_case_sensitive(root_folder),
+    }
+
+
+def restore_filesystem(probes: Dict[str, Any]):
+    """ apply the results of an earlier probe_filesystem """
+    global FILESYSTEM_TYPE, FILESYSTEM_IS_LINUX, MAX_PATH_LENGTH
+    global MAX_FILENAME_LENGTH, UNICODE_FILENAMES
+
+    Utils.MINIMUM_DATE = Utils.string_to_date(probes["minimum_date"])
+    FILESYSTEM_TYPE = probes["filesystem_type"]
+    FILESYSTEM_IS_LINUX = not ("fat" in FILESYSTEM_TYPE or "ntfs" in FILESYSTEM_TYPE)
+    MAX_PATH_LENGTH = probes["max_path_length"]
+    MAX_FILENAME_LENGTH = probes["max_filename_length"]
+    UNICODE_FILENAMES = probes["unicode_filenames"]
+
+
 def symlinks_supported(root_folder: Path) -> bool:
     log.debug("Checking if is filesystem supports symbolic links...")
     dst = "test_dst_%s" % random.getrandbits(32)
@@ -59,7 +103,6 @@ def symlinks_supported(root_folder: Path) -> bool:
     except (OSError, FileNotFoundError):
         src_file.unlink()
         log.error("Symbolic links not supported")
-        log.error("Albums are not going to be synced - requires symlinks")
         return False
     return True
 
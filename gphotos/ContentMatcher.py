@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# coding: utf8
+import concurrent.futures as futures
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .LocalData import LocalData
+import logging
+
+log = logging.getLogger(__name__)
+
+# read files in blocks of this size when hashing
+HASH_BLOCK = 1024 * 1024
+# hashing is mostly IO, hashlib releases the GIL for large updates
+HASH_THREADS = 8
+
+
+def file_digest(path: str) -> Optional[str]:
+    """ a hash of the contents of a file or None if it cannot be read """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+    except OSError:
+        log.debug("cannot hash file %s", path)
+        return None
+    return digest.hexdigest()
+
+
+class ContentMatcher:
+    """ Finds the local files (LocalFiles) whose contents are identical to
+    a downloaded library file (SyncFiles).
+
+    Only files with the same size as a file on the other side can match, so
+    only those are hashed. Hashes are cached in the FileHashes table along
+    with the size and modification time of the file.
+    """
+
+    def __init__(self, root_folder: Path, db: LocalData):
+        self._root_folder = root_folder
+        self._db = db
+
+    def find_matches(self) -> Dict[int, str]:
+        """ returns {LocalFiles Id: RemoteId} for every local file with the
+        same contents as a library file. Identical local files all match the
+        same library item, where the library holds several identical items
+        the one indexed first is used """
+        local = [
+            (local_id, str(Path(path) / file_name), size, mtime)
+            for local_id, path, file_name, size, mtime in self._db.get_local_file_sizes()
+        ]
+        sizes = {size for _, _, size, _ in local}
+        library = []
+        for remote_id, path, file_name in self._db.get_downloaded_files():
+            full_path = self._root_folder / path / file_name
+            try:
+                stat = full_path.stat()
+            except OSError:
+                continue
+            if stat.st_size in sizes:
+                library.append(
+                    (remote_id, str(full_path), stat.st_size, stat.st_mtime_ns)
+                )
+        sizes = {size for _, _, size, _ in library}
+        local = [item for item in local if item[2] in sizes]
+
+        digests = self.get_digests(
+            {path: (size, mtime) for _, path, size, mtime in local + library}
+        )
+        by_digest: Dict[str, str] = {}
+        for remote_id, path, _, _ in library:
+            if path in digests:
+                by_digest.setdefault(digests[path], remote_id)
+        return {
+            local_id: by_digest[digests[path]]
+            for local_id, path, _, _ in local
+            if digests.get(path) in by_digest
+        }
+
+    def get_digests(self, files: Dict[str, Tuple[int, int]]) -> Dict[str, str]:
+        """ the hashes of {path: (size, mtime)}, from the cache or calculated
+        in a thread pool. Files that cannot be read are left out """
+        cached = self._db.get_file_hashes()
+        digests: Dict[str, str] = {}
+        todo: List[str] = []
+        for path, key in files.items():
+            if cached.get(path, (None, None, None))[:2] == key:
+                digests[path] = cached[path][2]
+            else:
+                todo.append(path)
+        if not todo:
+            return digests
+
+        log.warning("hashing %d files with matching sizes ...", len(todo))
+        with futures.ThreadPoolExecutor(max_workers=HASH_THREADS) as pool:
+            rows = [
+                (path,) + files[path] + (digest,)
+                for path, digest in zip(todo, pool.map(file_digest, todo))
+                if digest is not None
+            ]
+        self._db.put_file_hashes(rows)
+        digests.update((row[0], row[3]) for row in rows)
+        return digests
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 # coding: utf8
+from hashlib import blake2b
+from typing import Iterable
+
 from .BaseMedia import BaseMedia
 
 
@@ -31,6 +34,20 @@ class GoogleAlbumMedia(BaseMedia):
         except KeyError:
             return "none"
 
+    @property
+    def cover_id(self) -> str:
+        return self.__media_json.get("coverPhotoMediaItemId", "")
+
+    def fingerprint(self, first_page_ids: Iterable[str]) -> str:
+        """ a digest that changes when the album is edited. Covers the item
+        count, cover item, title and the ids of the first page of contents """
+        digest = blake2b(digest_size=16)
+        for field in (str(self.size), self.cover_id, self.orig_name):
+            digest.update(field.encode("utf8") + b"\0")
+        for media_id in first_page_ids:
+            digest.update(media_id.encode("utf8") + b"\0")
+        return digest.hexdigest()
+
     @property
     def create_date(self):
         return None
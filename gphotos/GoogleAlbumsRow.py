@@ -29,6 +29,7 @@ class GoogleAlbumsRow(DbRow):
         "EndDate": datetime,
         "SyncDate": datetime,
         "Downloaded": bool,
+        "Fingerprint": str,
     }
 
     def to_media(self) -> DatabaseMedia:
@@ -45,7 +46,7 @@ class GoogleAlbumsRow(DbRow):
         pass
 
     @classmethod
-    def from_parm(cls, album_id, filename, size, start, end) -> G:
+    def from_parm(cls, album_id, filename, size, start, end, fingerprint=None) -> G:
         new_row = cls.make(
             RemoteId=album_id,
             AlbumName=filename,
@@ -54,5 +55,6 @@ class GoogleAlbumsRow(DbRow):
             EndDate=end,
             SyncDate=Utils.date_to_string(datetime.now()),
             Downloaded=0,
+            Fingerprint=fingerprint,
         )
         return new_row
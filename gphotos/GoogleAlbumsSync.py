@@ -1,16 +1,18 @@
+import concurrent.futures as futures
 import logging
-import os.path
-import shutil
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Callable
+from typing import Callable, Deque, Dict, Iterator, List, Tuple
 
 from . import Checks
 from . import Utils
+from .DatabaseMedia import DatabaseMedia
 from .GoogleAlbumMedia import GoogleAlbumMedia
 from .GoogleAlbumsRow import GoogleAlbumsRow
 from .GooglePhotosMedia import GooglePhotosMedia
 from .GooglePhotosRow import GooglePhotosRow
+from .LinkTree import LinkTree, LinkSpec
 from .LocalData import LocalData
 from .Settings import Settings
 from .restclient import RestClient
@@ -61,23 +63,35 @@ class GoogleAlbumsSync(object):
         self._use_flat_path = settings.use_flat_path
         self._omit_album_date = settings.omit_album_date
         self._use_hardlinks = settings.use_hardlinks
+        # number of albums whose contents are fetched concurrently
+        self.max_threads = settings.max_threads
 
     @classmethod
     def make_search_parameters(cls, album_id: str, page_token: str = None) -> Dict:
         body = {"pageToken": page_token, "albumId": album_id, "pageSize": PAGE_SIZE}
         return body
 
-    def fetch_album_contents(
-        self, album_id: str, add_media_items: bool
-    ) -> (datetime, datetime):
-        first_date = Utils.maximum_date()
-        last_date = Utils.MINIMUM_DATE
-        body = self.make_search_parameters(album_id=album_id)
+    def fetch_album_media(
+        self, album: GoogleAlbumMedia, fingerprint: str
+    ) -> (str, List[Dict]):
+        """ page through the media items in an album and return the album's
+        current fingerprint and the media json. Stops after the first page
+        and returns None for the media if the fingerprint matches the one
+        passed in. Makes API calls only so it is safe to run in a worker
+        thread """
+        album_media = []
+        new_fingerprint = None
+        body = self.make_search_parameters(album_id=album.id)
         response = self._api.mediaItems.search.execute(body)
-        position = -1
         while response:
             items_json = response.json()
             media_json = items_json.get("mediaItems")
+            if new_fingerprint is None:
+                new_fingerprint = album.fingerprint(
+                    media_item_json["id"] for media_item_json in media_json or []
+                )
+                if new_fingerprint == fingerprint:
+                    return new_fingerprint, None
             # cope with empty albums
             if not media_json:
                 if not items_json.get("nextPageToken"):
@@ -85,56 +99,71 @@ class GoogleAlbumsSync(object):
                 else:
                     media_json = []
                     log.warning("*** Empty Media JSON with a Next Page Token")
-
-            for media_item_json in media_json:
-                position += 1
-                media_item = GooglePhotosMedia(media_item_json)
-
-                if (not self.include_video) and media_item.is_video():
-                    log.debug("---- skipping %s (--skip-video)", media_item.filename)
-                    continue
-
-                log.debug("----%s", media_item.filename)
-                self._db.put_album_file(album_id, media_item.id, position)
-                last_date = max(media_item.create_date, last_date)
-                first_date = min(media_item.create_date, first_date)
-
-                # this adds other users photos from shared albums
-                # Todo - This will cause two copies of a file to appear for
-                #  those shared items you have imported into your own library.
-                #  They will have different RemoteIds, one will point to your
-                #  library copy (you own) and one to the shared item in the
-                #  the folder. Currently with the meta data available it would
-                #  be impossible to eliminate these without eliminating other
-                #  cases where date and filename (TITLE) match
-                if add_media_items:
-                    media_item.set_path_by_date(
-                        self._photos_folder, self._use_flat_path
-                    )
-                    (num, _) = self._db.file_duplicate_no(
-                        str(media_item.filename),
-                        str(media_item.relative_folder),
-                        media_item.id,
-                    )
-                    # we just learned if there were any duplicates in the db
-                    media_item.duplicate_number = num
-
-                    log.debug(
-                        "Adding album media item %s %s %s",
-                        media_item.relative_path,
-                        media_item.filename,
-                        media_item.duplicate_number,
-                    )
-                    self._db.put_row(GooglePhotosRow.from_media(media_item), False)
+            album_media.extend(media_json)
 
             next_page = items_json.get("nextPageToken")
             if next_page:
                 body = self.make_search_parameters(
-                    album_id=album_id, page_token=next_page
+                    album_id=album.id, page_token=next_page
                 )
                 response = self._api.mediaItems.search.execute(body)
             else:
                 break
+        return new_fingerprint, album_media
+
+    def put_album_contents(
+        self, album_id: str, album_media: List[Dict], add_media_items: bool
+    ) -> (datetime, datetime):
+        """ record the contents of an album in the db and return its date
+        range. Must run in the main thread, the only db writer. Shared items
+        are added one at a time because each one's duplicate number depends
+        on the items added before it """
+        first_date = Utils.maximum_date()
+        last_date = Utils.MINIMUM_DATE
+        album_files = []
+        for position, media_item_json in enumerate(album_media):
+            media_item = GooglePhotosMedia(media_item_json)
+
+            if (not self.include_video) and media_item.is_video():
+                log.debug("---- skipping %s (--skip-video)", media_item.filename)
+                continue
+
+            log.debug("----%s", media_item.filename)
+            album_files.append((media_item.id, position))
+            # write the album files a page at a time
+            if len(album_files) >= PAGE_SIZE:
+                self._db.put_album_files(album_id, album_files)
+                album_files = []
+            last_date = max(media_item.create_date, last_date)
+            first_date = min(media_item.create_date, first_date)
+
+            # this adds other users photos from shared albums
+            # Todo - This will cause two copies of a file to appear for
+            #  those shared items you have imported into your own library.
+            #  They will have different RemoteIds, one will point to your
+            #  library copy (you own) and one to the shared item in the
+            #  the folder. Currently with the meta data available it would
+            #  be impossible to eliminate these without eliminating other
+            #  cases where date and filename (TITLE) match
+            if add_media_items:
+                media_item.set_path_by_date(self._photos_folder, self._use_flat_path)
+                (num, _) = self._db.file_duplicate_no(
+                    str(media_item.filename),
+                    str(media_item.relative_folder),
+                    media_item.id,
+                )
+                # we just learned if there were any duplicates in the db
+                media_item.duplicate_number = num
+
+                log.debug(
+                    "Adding album media item %s %s %s",
+                    media_item.relative_path,
+                    media_item.filename,
+                    media_item.duplicate_number,
+                )
+                self._db.put_row(GooglePhotosRow.from_media(media_item), False)
+        if album_files:
+            self._db.put_album_files(album_id, album_files)
         return first_date, last_date
 
     def index_album_media(self):
@@ -173,54 +202,78 @@ class GoogleAlbumsSync(object):
         # there are no filters in album listing at present so it always a
         # full rescan - it's quite quick
         count = 0
-        response = api_function(pageSize=ALBUM_ITEMS)
-        while response:
-            results = response.json()
-            for album_json in results.get(item_key, []):
-                count += 1
-
-                album = GoogleAlbumMedia(album_json)
-                indexed_album = self._db.get_album(album_id=album.id)
-                already_indexed = (
-                    indexed_album.size == album.size if indexed_album else False
-                )
+        # (future, album, indexed_album, add_media_items) in listing order
+        pending: Deque[Tuple] = deque()
+        with futures.ThreadPoolExecutor(max_workers=self.max_threads) as pool:
+            response = api_function(pageSize=ALBUM_ITEMS)
+            while response:
+                results = response.json()
+                for album_json in results.get(item_key, []):
+                    count += 1
 
-                if self.album and self.album != album.orig_name:
-                    log.debug(
-                        "Skipping Album: %s, photos: %d " "(does not match --album)",
-                        album.filename,
-                        album.size,
+                    album = GoogleAlbumMedia(album_json)
+                    indexed_album = self._db.get_album(album_id=album.id)
+                    # with --flush-index all albums are fetched again
+                    fingerprint = (
+                        None
+                        if self.flush
+                        else self._db.get_album_fingerprint(album_id=album.id)
                     )
-                elif not allow_null_title and album.description == "none":
-                    log.debug("Skipping no-title album, photos: %d", album.size)
-                elif already_indexed and not self.flush:
-                    log.debug(
-                        "Skipping Album: %s, photos: %d", album.filename, album.size
-                    )
-                else:
-                    log.info(
-                        "Indexing Album: %s, photos: %d", album.filename, album.size
-                    )
-                    first_date, last_date = self.fetch_album_contents(
-                        album.id, add_media_items
-                    )
-                    # write the album data down now we know the contents'
-                    # date range
-                    gar = GoogleAlbumsRow.from_parm(
-                        album.id, album.filename, album.size, first_date, last_date
-                    )
-                    self._db.put_row(gar, update=indexed_album)
-
-                if self.settings.progress and count % 10 == 0:
-                    log.warning(f"Listed {count} {description} ...\033[F")
 
-            next_page = results.get("nextPageToken")
-            if next_page:
-                response = api_function(pageSize=ALBUM_ITEMS, pageToken=next_page)
-            else:
-                break
+                    if self.album and self.album != album.orig_name:
+                        log.debug(
+                            "Skipping Album: %s, photos: %d "
+                            "(does not match --album)",
+                            album.filename,
+                            album.size,
+                        )
+                    elif not allow_null_title and album.description == "none":
+                        log.debug("Skipping no-title album, photos: %d", album.size)
+                    else:
+                        future = pool.submit(self.fetch_album_media, album, fingerprint)
+                        pending.append((future, album, indexed_album, add_media_items))
+                        # complete albums in the order they were listed so that
+                        # the db is written exactly as by a serial scan
+                        while len(pending) > self.max_threads:
+                            self.put_album(*pending.popleft())
+
+                    if self.settings.progress and count % 10 == 0:
+                        log.warning(f"Listed {count} {description} ...\033[F")
+
+                next_page = results.get("nextPageToken")
+                if next_page:
+                    response = api_function(pageSize=ALBUM_ITEMS, pageToken=next_page)
+                else:
+                    break
+            while pending:
+                self.put_album(*pending.popleft())
         log.warning("Indexed %d %s", count, description)
 
+    def put_album(
+        self,
+        future: futures.Future,
+        album: GoogleAlbumMedia,
+        indexed_album: DatabaseMedia,
+        add_media_items: bool,
+    ):
+        """ write down an album's contents once its worker has fetched them """
+        fingerprint, album_media = future.result()
+        if album_media is None:
+            log.debug("Skipping Album: %s, photos: %d", album.filename, album.size)
+            return
+        log.info("Indexing Album: %s, photos: %d", album.filename, album.size)
+        # replace the album's previous contents in a single savepoint
+        with self._db.replace_album_files(album.id):
+            first_date, last_date = self.put_album_contents(
+                album.id, album_media, add_media_items
+            )
+            # write the album data down now we know the contents'
+            # date range
+            gar = GoogleAlbumsRow.from_parm(
+                album.id, album.filename, album.size, first_date, last_date, fingerprint
+            )
+            self._db.put_row(gar, update=indexed_album)
+
     def album_folder_name(
         self, album_name: str, start_date: datetime, end_date: datetime
     ) -> Path:
@@ -245,18 +298,23 @@ class GoogleAlbumsSync(object):
 
     def create_album_content_links(self):
         log.warning("Creating album folder links to media ...")
-        count = 0
+        tree = LinkTree(self._links_root, self._use_hardlinks)
+        # reconcile the existing links with the full list of album contents
+        # so that only the links that changed are touched
+        tree.reconcile(self.album_links())
+        log.warning(
+            "Album folder links: %d created, %d renamed, %d removed, %d unchanged",
+            tree.created,
+            tree.renamed,
+            tree.removed,
+            tree.unchanged,
+        )
+
+    def album_links(self) -> Iterator[LinkSpec]:
+        """ generate the links that the albums folder should contain """
         album_item = 0
         current_rid = ""
 
-        # always re-create all album links - it is quite fast and a good way
-        # to ensure consistency
-        # especially now that we have --album-date-by-first-photo
-        if self._links_root.exists():
-            log.debug("removing previous album links tree")
-            shutil.rmtree(self._links_root)
-        re_download = not self._links_root.exists()
-
         for (
             path,
             file_name,
@@ -265,7 +323,7 @@ class GoogleAlbumsSync(object):
             end_date_str,
             rid,
             created,
-        ) in self._db.get_album_files(download_again=re_download):
+        ) in self._db.get_album_files(download_again=True):
             if current_rid == rid:
                 album_item += 1
             else:
@@ -290,40 +348,4 @@ class GoogleAlbumsSync(object):
             link_folder: Path = self.album_folder_name(album_name, start_date, end_date)
 
             link_file = link_folder / "{:04d}_{}".format(album_item, file_name)
-            # incredibly, pathlib.Path.relative_to cannot handle
-            # '../' in a relative path !!! reverting to os.path
-            relative_filename = os.path.relpath(full_file_name, str(link_folder))
-            log.debug("adding album link %s -> %s", relative_filename, link_file)
-            try:
-                if not link_folder.is_dir():
-                    log.debug("new album folder %s", link_folder)
-                    link_folder.mkdir(parents=True)
-
-                created_date = Utils.string_to_date(created)
-                if self._use_hardlinks:
-                    if full_file_name.exists():
-                        os.link(full_file_name, link_file)
-                    else:
-                        log.debug("skip hardlink for %s, not downloaded", file_name)
-                else:
-                    link_file.symlink_to(relative_filename)
-
-                if link_file.exists():
-                    count += 1
-                    # Windows tries to follow symlinks even though we specify
-                    # follow_symlinks=False. So disable setting of link date
-                    # if follow not supported
-                    if os.utime in os.supports_follow_symlinks:
-                        os.utime(
-                            str(link_file),
-                            (
-                                Utils.safe_timestamp(created_date).timestamp(),
-                                Utils.safe_timestamp(created_date).timestamp(),
-                            ),
-                            follow_symlinks=False,
-                        )
-
-            except (FileExistsError, UnicodeEncodeError):
-                log.error("bad link to %s", full_file_name)
-
-        log.warning("Created %d new album folder links", count)
+            yield LinkSpec(link_file, full_file_name, Utils.string_to_date(created))
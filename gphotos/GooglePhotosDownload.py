@@ -2,19 +2,21 @@
 # coding: utf8
 from pathlib import Path
 import os
+from gphotos import Metrics
 from gphotos import Utils
 from gphotos.LocalData import LocalData
 from .Settings import Settings
 from gphotos.restclient import RestClient
 from gphotos.DatabaseMedia import DatabaseMedia
-from gphotos.GooglePhotosRow import GooglePhotosRow
+from gphotos.BandwidthLimiter import BandwidthLimiter
 
 from itertools import zip_longest
-from typing import Iterable, Mapping, Union, List
+from typing import Iterable, Mapping, Union, List, Tuple
 from datetime import datetime
+from time import perf_counter, time
 import logging
-import shutil
 import tempfile
+import threading
 import concurrent.futures as futures
 
 import requests
@@ -31,6 +33,8 @@ except ImportError:
     win32file, win32con = None, None
     _use_win_32 = False
 
+_use_fallocate = hasattr(os, "posix_fallocate")
+
 log = logging.getLogger(__name__)
 
 
@@ -40,6 +44,14 @@ class GooglePhotosDownload(object):
 
     PAGE_SIZE: int = 100
     BATCH_SIZE: int = 40
+    # size of the per thread buffer used to stream downloads to disk
+    CHUNK_SIZE: int = 1024 * 1024
+    # number of completed downloads to flush to disk together in durable mode
+    DURABLE_BATCH_SIZE: int = 100
+    # base urls expire after 60 minutes, allow some leeway for slow downloads
+    URL_LIFETIME: int = 50 * 60
+    # number of BATCH_SIZE blocks between commits of the download queue
+    STORE_BLOCKS: int = 25
 
     def __init__(
         self, api: RestClient, root_folder: Path, db: LocalData, settings: Settings
@@ -66,12 +78,22 @@ class GooglePhotosDownload(object):
         self.end_date: datetime = settings.end_date
         self.retry_download: bool = settings.retry_download
         self.case_insensitive_fs: bool = settings.case_insensitive_fs
+        self.durable_downloads: bool = settings.durable_downloads
+        self.download_order: List[str] = settings.download_order
         self.video_timeout: int = 2000
         self.image_timeout: int = 60
 
         # attributes related to multi-threaded download
         self.download_pool = futures.ThreadPoolExecutor(max_workers=self.max_threads)
         self.pool_future_to_media = {}
+        # each download thread reuses its own copy buffer
+        self._thread_data = threading.local()
+        # (temporary file, media item) for downloads awaiting a durable commit
+        self.durable_batch = []
+        # shared by all download threads
+        self.bandwidth = BandwidthLimiter(
+            settings.max_bandwidth, settings.bandwidth_schedule
+        )
 
         self.current_umask = os.umask(7)
         os.umask(self.current_umask)
@@ -93,11 +115,16 @@ class GooglePhotosDownload(object):
         here we batch up our requests to get base url for downloading media.
         This avoids the overhead of one REST call per file. A REST call
         takes longer than downloading an image
+
+        The work is driven from the DownloadQueue table which persists
+        resolved base urls and failures between runs. Entries with a base url
+        that has not yet expired are downloaded without calling the API
+        again, failed entries are retried with exponential backoff.
         """
 
         def grouper(
-            iterable: Iterable[DatabaseMedia],
-        ) -> Iterable[Iterable[DatabaseMedia]]:
+            iterable: Iterable[Tuple[DatabaseMedia, str, int]],
+        ) -> Iterable[Iterable[Tuple[DatabaseMedia, str, int]]]:
             """Collect data into chunks size BATCH_SIZE"""
             return zip_longest(*[iter(iterable)] * self.BATCH_SIZE, fillvalue=None)
 
@@ -105,48 +132,60 @@ class GooglePhotosDownload(object):
             self.files_download_skipped = self._db.downloaded_count()
 
         log.warning("Downloading Photos ...")
+        self._db.queue_downloads(
+            start_date=self.start_date,
+            end_date=self.end_date,
+            retry_download=self.retry_download,
+        )
         try:
-            for media_items_block in grouper(
-                self._db.get_rows_by_search(
-                    GooglePhotosRow,
-                    start_date=self.start_date,
-                    end_date=self.end_date,
-                    skip_downloaded=not self.retry_download,
+            for block_no, queue_block in enumerate(
+                grouper(
+                    self._db.get_download_queue(
+                        int(time()),
+                        start_date=self.start_date,
+                        end_date=self.end_date,
+                        order=self.download_order,
+                    )
                 )
             ):
                 batch = {}
 
-                items = (mi for mi in media_items_block if mi)
-                for media_item in items:
-                    if self.case_insensitive_fs:
-                        relative_folder = str(media_item.relative_folder).lower()
-                        filename = str(media_item.filename).lower()
-                    else:
-                        relative_folder = media_item.relative_folder
-                        filename = media_item.filename
-                    local_folder = self._root_folder / relative_folder
-                    local_full_path = local_folder / filename
+                items = (qi for qi in queue_block if qi)
+                for media_item, base_url, url_expiry in items:
+                    local_full_path = self.local_path(media_item)
+                    local_folder = local_full_path.parent
 
                     if local_full_path.exists():
                         self.files_download_skipped += 1
+                        Metrics.DOWNLOADS.inc("skipped")
                         log.debug(
                             "SKIPPED download (file exists) %d %s",
                             self.files_download_skipped,
                             media_item.relative_path,
                         )
                         self._db.put_downloaded(media_item.id)
-
+                        self._db.queue_done(media_item.id)
+                        continue
+
+                    if not local_folder.is_dir():
+                        local_folder.mkdir(parents=True)
+                    if base_url and url_expiry > time():
+                        # resolved by a previous batchGet and still valid
+                        self.download_file(media_item, base_url)
                     else:
                         batch[media_item.id] = media_item
-                        if not local_folder.is_dir():
-                            local_folder.mkdir(parents=True)
 
                 if len(batch) > 0:
                     self.download_batch(batch)
+                # commit queue progress so that a restart can resume here
+                if (block_no + 1) % self.STORE_BLOCKS == 0:
+                    self._db.store()
         finally:
             # allow any remaining background downloads to complete
             futures_left = list(self.pool_future_to_media.keys())
             self.do_download_complete(futures_left)
+            if self.durable_batch:
+                self.commit_durable_batch()
             log.warning(
                 "Downloaded %d Items, Failed %d, Already Downloaded %d",
                 self.files_downloaded,
@@ -159,7 +198,8 @@ class GooglePhotosDownload(object):
 
         A fresh 'base_url' is required since they have limited lifespan and
         these are obtained by a single call to the service function
-        mediaItems.batchGet.
+        mediaItems.batchGet. The base urls are recorded in the DownloadQueue
+        so that they can be reused after a restart.
         """
         try:
             response = self._api.mediaItems.batchGet.execute(mediaItemIds=batch.keys())
@@ -167,6 +207,7 @@ class GooglePhotosDownload(object):
             if r_json.get("pageToken"):
                 log.error("Ops - Batch size too big, some items dropped!")
 
+            batch_ids = list(batch.keys())
             for i, result in enumerate(r_json["mediaItemResults"]):
                 media_item_json = result.get("mediaItem")
                 if not media_item_json:
@@ -175,12 +216,20 @@ class GooglePhotosDownload(object):
                         "Null response in mediaItems.batchGet"
                         "for item %d in\n\n %s \n\n which is \n%s",
                         i,
-                        str(r_json),
-                        str(result),
+                        r_json,
+                        result,
                     )
+                    if i < len(batch_ids):
+                        self._db.queue_failed(
+                            batch_ids[i], str(result.get("status")), int(time())
+                        )
                 else:
                     media_item = batch.get(media_item_json["id"])
-                    self.download_file(media_item, media_item_json)
+                    base_url = media_item_json["baseUrl"]
+                    self._db.queue_resolved(
+                        media_item.id, base_url, int(time()) + self.URL_LIFETIME
+                    )
+                    self.download_file(media_item, base_url)
 
         except KeyboardInterrupt:
             log.warning("Cancelling download threads ...")
@@ -192,7 +241,7 @@ class GooglePhotosDownload(object):
         except RequestException:
             self.find_bad_items(batch)
 
-    def download_file(self, media_item: DatabaseMedia, media_json: dict):
+    def download_file(self, media_item: DatabaseMedia, base_url: str):
         """ farms a single media download off to the thread pool.
 
         Uses a dictionary of Futures -> mediaItem to track downloads that are
@@ -200,8 +249,6 @@ class GooglePhotosDownload(object):
         do_download_complete to remove the Future from the dictionary and
         complete processing of the media item.
         """
-        base_url = media_json["baseUrl"]
-
         # we dont want a massive queue so wait until at least one thread is free
         while len(self.pool_future_to_media) >= self.max_threads:
             # check which futures are done, complete the main thread work
@@ -218,68 +265,183 @@ class GooglePhotosDownload(object):
         log.info(
             "downloading %d %s", self.files_download_started, media_item.relative_path
         )
+        self._db.queue_in_flight(media_item.id)
         future = self.download_pool.submit(self.do_download_file, base_url, media_item)
         self.pool_future_to_media[future] = media_item
+        Metrics.DOWNLOADS_IN_FLIGHT.set(len(self.pool_future_to_media))
 
-    def do_download_file(self, base_url: str, media_item: DatabaseMedia):
-        """ Runs in a process pool and does a download of a single media item.
-        """
+    def local_path(self, media_item: DatabaseMedia) -> Path:
+        """ the full path that media_item downloads to """
         if self.case_insensitive_fs:
             relative_folder = str(media_item.relative_folder).lower()
             filename = str(media_item.filename).lower()
         else:
             relative_folder = media_item.relative_folder
             filename = media_item.filename
-        local_folder = self._root_folder / relative_folder
-        local_full_path = local_folder / filename
+        return self._root_folder / relative_folder / filename
+
+    def do_download_file(self, base_url: str, media_item: DatabaseMedia):
+        """ Runs in a process pool and does a download of a single media item.
+
+        In durable mode the downloaded temporary file is returned and the
+        rename to its final name is deferred to commit_durable_batch.
+        """
+        local_full_path = self.local_path(media_item)
+        local_folder = local_full_path.parent
 
         if media_item.is_video():
             download_url = "{}=dv".format(base_url)
             timeout = self.video_timeout
+            media_type = "video"
         else:
             download_url = "{}=d".format(base_url)
             timeout = self.image_timeout
+            media_type = "photo"
         temp_file = tempfile.NamedTemporaryFile(dir=local_folder, delete=False)
         t_path = Path(temp_file.name)
 
         try:
+            start = perf_counter()
             response = self._session.get(download_url, stream=True, timeout=timeout)
             response.raise_for_status()
-            shutil.copyfileobj(response.raw, temp_file)
+            self.copy_response(response, temp_file)
             temp_file.close()
             temp_file = None
             response.close()
-            t_path.rename(local_full_path)
-            create_date = Utils.safe_timestamp(media_item.create_date)
-            os.utime(
-                str(local_full_path),
-                (
-                    Utils.safe_timestamp(media_item.modify_date).timestamp(),
-                    create_date.timestamp(),
-                ),
-            )
-            if _use_win_32:
-                file_handle = win32file.CreateFile(
-                    str(local_full_path),
-                    win32file.GENERIC_WRITE,
-                    0,
-                    None,
-                    win32con.OPEN_EXISTING,
-                    0,
-                    None,
-                )
-                win32file.SetFileTime(file_handle, *(create_date,) * 3)
-                file_handle.close()
-            os.chmod(str(local_full_path), 0o666 & ~self.current_umask)
+            Metrics.DOWNLOAD_SECONDS.observe(perf_counter() - start, media_type)
+            if self.durable_downloads:
+                done_path, t_path = t_path, None
+                return done_path
+            self.finish_file(t_path, local_full_path, media_item)
         except KeyboardInterrupt:
             log.debug("User cancelled download thread")
             raise
         finally:
             if temp_file:
                 temp_file.close()
-            if t_path.exists():
+            if t_path and t_path.exists():
                 t_path.unlink()
 
+    def finish_file(
+        self, t_path: Path, local_full_path: Path, media_item: DatabaseMedia
+    ):
+        """ move a completed download into place and set its dates and mode
+        """
+        t_path.rename(local_full_path)
+        create_date = Utils.safe_timestamp(media_item.create_date)
+        os.utime(
+            str(local_full_path),
+            (
+                Utils.safe_timestamp(media_item.modify_date).timestamp(),
+                create_date.timestamp(),
+            ),
+        )
+        if _use_win_32:
+            file_handle = win32file.CreateFile(
+                str(local_full_path),
+                win32file.GENERIC_WRITE,
+                0,
+                None,
+                win32con.OPEN_EXISTING,
+                0,
+                None,
+            )
+            win32file.SetFileTime(file_handle, *(create_date,) * 3)
+            file_handle.close()
+        os.chmod(str(local_full_path), 0o666 & ~self.current_umask)
+
+    def commit_durable_batch(self):
+        """ runs in the main thread in durable mode to complete a batch of
+        downloads.
+
+        The data of every file in the batch is flushed to disk, then the
+        files are renamed into place and their folders are flushed. Only
+        after that are the Downloaded flags committed to the DB, so that a
+        file marked as downloaded always survives a power loss.
+        """
+        committed = []
+        folders = set()
+        for t_path, media_item in self.durable_batch:
+            local_full_path = self.local_path(media_item)
+            try:
+                fd = os.open(str(t_path), os.O_RDWR)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self.finish_file(t_path, local_full_path, media_item)
+                folders.add(local_full_path.parent)
+                committed.append(media_item)
+            except OSError:
+                self.files_download_failed += 1
+                Metrics.DOWNLOADS.inc("failed")
+                log.error(
+                    "FAILURE %d committing %s",
+                    self.files_download_failed,
+                    media_item.relative_path,
+                    exc_info=True,
+                )
+                self._db.queue_failed(media_item.id, "commit failed", int(time()))
+                if t_path.exists():
+                    t_path.unlink()
+        self.durable_batch = []
+
+        # directories cannot be opened for fsync on Windows
+        if os.name != "nt":
+            for folder in folders:
+                fd = os.open(str(folder), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+        for media_item in committed:
+            self._db.put_downloaded(media_item.id)
+            self._db.queue_done(media_item.id)
+            self.download_done(media_item)
+        self._db.store()
+
+    def copy_response(self, response: requests.Response, temp_file):
+        """ Streams the body of response into temp_file.
+
+        Reads go into a reusable per thread buffer with readinto and are
+        written out in CHUNK_SIZE blocks, which avoids allocating a new bytes
+        object for every read. Where the server supplies Content-Length the
+        file is preallocated first to reduce fragmentation. When a bandwidth
+        limit applies the reads are smaller and paced by self.bandwidth.
+        """
+        length = int(response.headers.get("Content-Length", 0) or 0)
+        if length and _use_fallocate:
+            try:
+                os.posix_fallocate(temp_file.fileno(), 0, length)
+            except OSError:
+                # not supported by all filesystems (e.g. some network mounts)
+                log.debug("posix_fallocate not supported in %s", temp_file.name)
+
+        buffer = getattr(self._thread_data, "buffer", None)
+        if buffer is None:
+            buffer = memoryview(bytearray(self.CHUNK_SIZE))
+            self._thread_data.buffer = buffer
+
+        raw = response.raw
+        written = 0
+        while True:
+            if self.bandwidth.enabled:
+                count = raw.readinto(buffer[: self.bandwidth.chunk_size(len(buffer))])
+                self.bandwidth.consume(count)
+            else:
+                count = raw.readinto(buffer)
+            if not count:
+                break
+            temp_file.write(buffer[:count])
+            written += count
+            Metrics.DOWNLOAD_BYTES.inc(amount=count)
+
+        if written < length:
+            # drop any unused preallocation
+            temp_file.truncate(written)
+        return written
+
     def do_download_complete(
         self,
         futures_list: Union[
@@ -297,24 +459,36 @@ class GooglePhotosDownload(object):
             e = future.exception(timeout=timeout)
             if e:
                 self.files_download_failed += 1
+                Metrics.DOWNLOADS.inc("failed")
                 log.error(
                     "FAILURE %d downloading %s",
                     self.files_download_failed,
                     media_item.relative_path,
                 )
+                self._db.queue_failed(media_item.id, str(e), int(time()))
                 if not isinstance(e, RequestException):
                     raise e
+            elif self.durable_downloads:
+                self.durable_batch.append((future.result(), media_item))
+                if len(self.durable_batch) >= self.DURABLE_BATCH_SIZE:
+                    self.commit_durable_batch()
             else:
                 self._db.put_downloaded(media_item.id)
-                self.files_downloaded += 1
-                log.debug(
-                    "COMPLETED %d downloading %s",
-                    self.files_downloaded,
-                    media_item.relative_path,
-                )
-                if self.settings.progress and self.files_downloaded % 10 == 0:
-                    log.warning(f"Downloaded {self.files_downloaded} items ...\033[F")
+                self._db.queue_done(media_item.id)
+                self.download_done(media_item)
             del self.pool_future_to_media[future]
+            Metrics.DOWNLOADS_IN_FLIGHT.set(len(self.pool_future_to_media))
+
+    def download_done(self, media_item: DatabaseMedia):
+        self.files_downloaded += 1
+        Metrics.DOWNLOADS.inc("ok")
+        log.debug(
+            "COMPLETED %d downloading %s",
+            self.files_downloaded,
+            media_item.relative_path,
+        )
+        if self.settings.progress and self.files_downloaded % 10 == 0:
+            log.warning(f"Downloaded {self.files_downloaded} items ...\033[F")
 
     def find_bad_items(self, batch: Mapping[str, DatabaseMedia]):
         """
@@ -326,9 +500,11 @@ class GooglePhotosDownload(object):
                 log.debug("BAD ID Retry on %s (%s)", item_id, media_item.relative_path)
                 response = self._api.mediaItems.get.execute(mediaItemId=item_id)
                 media_item_json = response.json()
-                self.download_file(media_item, media_item_json)
-            except RequestException:
+                self.download_file(media_item, media_item_json["baseUrl"])
+            except RequestException as e:
+                self._db.queue_failed(item_id, str(e), int(time()))
                 self.files_download_failed += 1
+                Metrics.DOWNLOADS.inc("failed")
                 log.error(
                     "FAILURE %d in get of %s",
                     self.files_download_failed,
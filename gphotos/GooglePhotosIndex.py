@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 # coding: utf8
+import os
+from fnmatch import fnmatch
+from mimetypes import guess_type
 from pathlib import Path
 from datetime import datetime
+from typing import Iterator, List, Tuple
 
+from gphotos import Logging
+from gphotos import Metrics
 from gphotos import Utils
+from gphotos import VideoMetadata
 from gphotos.GooglePhotosMedia import GooglePhotosMedia
 from gphotos.GooglePhotosRow import GooglePhotosRow
 from gphotos.LocalFilesMedia import LocalFilesMedia
@@ -16,6 +23,32 @@ import logging
 log = logging.getLogger(__name__)
 
 
+# number of files passed to a metadata worker process at a time
+EXTRA_META_CHUNK = 64
+# chunks queued per worker process
+EXTRA_META_PENDING = 4
+# save the database after this many files
+STORE_FILES = 2000
+
+
+def extra_meta(files: List[Tuple[str, Path]]) -> List[Tuple[str, datetime, int, str]]:
+    """ extract (Uid, CreateDate, FileSize, RemoteId) from a chunk of
+    downloaded files, runs in a worker process """
+    # probe the videos in this chunk concurrently
+    VideoMetadata.prefetch(
+        path
+        for _, path in files
+        if (guess_type(str(path))[0] or "").startswith("video")
+    )
+    rows = []
+    for remote_id, file_path in files:
+        local_file = LocalFilesMedia(file_path)
+        rows.append(
+            (local_file.uid, local_file.create_date, local_file.size, remote_id)
+        )
+    return rows
+
+
 class GooglePhotosIndex(object):
     PAGE_SIZE = 100
 
@@ -43,30 +76,48 @@ class GooglePhotosIndex(object):
         self._use_flat_path: bool = settings.use_flat_path
         self._media_folder: Path = settings.photos_path
 
-    def check_for_removed_in_folder(self, folder: Path):
-        for pth in folder.iterdir():
-            if pth.is_dir():
-                self.check_for_removed_in_folder(pth)
-            else:
-                local_path = pth.relative_to(self._root_folder).parent
-                if pth.match(".*") or pth.match("gphotos*"):
-                    continue
-                file_row = self._db.get_file_by_path(
-                    GooglePhotosRow, local_path, pth.name
-                )
-                if not file_row:
-                    pth.unlink()
-                    log.warning("%s deleted", pth)
-
-    def check_for_removed(self):
+    def check_for_removed(self, dry_run: bool = False) -> List[Path]:
         """ Removes local files that are no longer represented in the Photos
         Library - presumably because they were deleted.
 
         note for partial scans using date filters this is still OK because
         for a file to exist it must have been indexed in a previous scan
+
+        Parameters:
+            dry_run: only list the files that would be removed
+        Returns:
+            the files removed (or that would be removed)
         """
         log.warning("Finding and removing deleted media ...")
-        self.check_for_removed_in_folder(self._root_folder / self._media_folder)
+        indexed = self._db.get_sync_file_paths()
+        found = set(self.media_files(self._root_folder / self._media_folder))
+        removed = sorted(found - indexed)
+        for relative_path in removed:
+            pth = self._root_folder / relative_path
+            if dry_run:
+                log.warning("%s would be deleted", pth)
+            else:
+                pth.unlink()
+                log.warning("%s deleted", pth)
+        return [self._root_folder / relative_path for relative_path in removed]
+
+    def media_files(self, folder: Path) -> Iterator[str]:
+        """ walk a folder tree once with os.scandir yielding the path of
+        each file relative to the root folder, in the same form as
+        os.path.join(SyncFiles.Path, SyncFiles.FileName) """
+        root = str(self._root_folder)
+        folders = [str(folder)] if folder.is_dir() else []
+        while folders:
+            folder = folders.pop()
+            relative_folder = os.path.relpath(folder, root)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folders.append(entry.path)
+                    elif not (
+                        entry.name.startswith(".") or fnmatch(entry.name, "gphotos*")
+                    ):
+                        yield os.path.join(relative_folder, entry.name)
 
     def write_media_index(self, media: GooglePhotosMedia, update: bool = True):
         self._db.put_row(GooglePhotosRow.from_media(media), update)
@@ -133,7 +184,7 @@ class GooglePhotosIndex(object):
                     "includeArchivedMedia": self.archived,
                 },
             }
-            log.debug("mediaItems.search with body:\n{}".format(body))
+            log.debug("mediaItems.search with body:\n%s", body)
             return self._api.mediaItems.search.execute(body).json()
 
     def index_photos_media(self) -> bool:
@@ -176,6 +227,7 @@ class GooglePhotosIndex(object):
                     log.warning(f"Listed {total_listed} items ...\033[F")
                 if not row:
                     self.files_indexed += 1
+                    Metrics.ITEMS_INDEXED.inc("new")
                     log.info(
                         "Indexed %d %s", self.files_indexed, media_item.relative_path
                     )
@@ -184,6 +236,7 @@ class GooglePhotosIndex(object):
                         self._db.store()
                 elif media_item.modify_date > row.modify_date:
                     self.files_indexed += 1
+                    Metrics.ITEMS_INDEXED.inc("updated")
                     # todo at present there is no modify date in the API
                     #  so updates cannot be monitored - this won't get called
                     log.info(
@@ -194,6 +247,7 @@ class GooglePhotosIndex(object):
                     self.write_media_index(media_item, True)
                 else:
                     self.files_index_skipped += 1
+                    Metrics.ITEMS_INDEXED.inc("skipped")
                     log.debug(
                         "Skipped Index (already indexed) %d %s",
                         self.files_index_skipped,
@@ -228,29 +282,54 @@ class GooglePhotosIndex(object):
         log.warning(f"indexed {self.files_indexed} items")
         return self.files_indexed > 0
 
+    def index_favourites(self):
+        """ flag the files in the index that are marked as favourites so that
+        they can be prioritised for download """
+        log.warning("Indexing favourites ...")
+        favourites = []
+        items_json = self.search_media(do_video=self.include_video, favourites=True)
+        while items_json:
+            favourites.extend(m["id"] for m in items_json.get("mediaItems", []))
+            next_page = items_json.get("nextPageToken")
+            if next_page:
+                items_json = self.search_media(
+                    page_token=next_page, do_video=self.include_video, favourites=True
+                )
+            else:
+                break
+        self._db.put_favourites(favourites)
+        log.warning("indexed %d favourites", len(favourites))
+
     def get_extra_meta(self):
         count = 0
         log.warning(
             "updating index with extra metadata for comparison "
             "(may take some time) ..."
         )
+        workers = os.cpu_count() or 1
+        with Logging.process_pool(workers) as pool:
+            for rows in Utils.pool_map(
+                pool,
+                extra_meta,
+                Utils.chunks(self.extra_meta_files(), EXTRA_META_CHUNK),
+                workers * EXTRA_META_PENDING,
+            ):
+                self._db.put_extra_meta(rows)
+                previous = count
+                count += len(rows)
+                log.info("updated metadata on %d files", count)
+                if count // STORE_FILES > previous // STORE_FILES:
+                    self._db.store()
+        log.warning("updating index with extra metadata complete (%d files)", count)
+
+    def extra_meta_files(self) -> Iterator[Tuple[str, Path]]:
+        """ yield (RemoteId, path) of the downloaded files that have not had
+        their metadata extracted """
         media_items = self._db.get_rows_by_search(GooglePhotosRow, uid="ISNULL")
         for item in media_items:
             file_path = self._root_folder / item.relative_path
             # if this item has a uid it has been scanned before
             if file_path.exists():
-                local_file = LocalFilesMedia(file_path)
-                count += 1
-                log.info("updating metadata %d on %s", count, file_path)
-                item.update_extra_meta(
-                    local_file.uid, local_file.create_date, local_file.size
-                )
-                # erm lets try some duck typing then !
-                # todo is the DbRow class model rubbish or brilliant Python?
-                # noinspection PyTypeChecker
-                self._db.put_row(GooglePhotosRow.from_media(item), update=True)
-                if count % 2000 == 0:
-                    self._db.store()
+                yield item.id, file_path
             else:
-                log.debug("skipping metadata (already scanned) on %s", file_path)
-        log.warning("updating index with extra metadata complete")
+                log.debug("skipping metadata (not downloaded) on %s", file_path)
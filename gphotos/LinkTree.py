@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# coding: utf8
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple, Union
+
+from . import Utils
+import logging
+
+log = logging.getLogger(__name__)
+
+# identifies what a link points at: the text of a symlink or the inode
+# of a hard link
+LinkKey = Union[str, int]
+
+
+class LinkSpec(NamedTuple):
+    link: Path
+    target: Path
+    date: datetime = None
+
+
+class LinkTree:
+    """ Reconciles a folder tree of symbolic or hard links with the links that
+    it should contain.
+
+    The existing tree is read once with os.scandir and compared with the
+    desired links. Only the differences are applied to the file system:
+    stale links are removed, links that point at the right file under the
+    wrong name are renamed and missing links are created.
+
+    Symbolic links are relative to the folder that contains them unless
+    absolute_links is set.
+    """
+
+    TEMP_SUFFIX = ".gphotos-tmp"
+
+    def __init__(
+        self, root: Path, use_hardlinks: bool = False, absolute_links: bool = False
+    ):
+        self.root: Path = root
+        self.use_hardlinks: bool = use_hardlinks
+        self.absolute_links: bool = absolute_links
+        self.links: Dict[str, LinkKey] = {}
+        self.folders: Set[str] = set()
+
+        self.created: int = 0
+        self.renamed: int = 0
+        self.removed: int = 0
+        self.unchanged: int = 0
+        self.failed: int = 0
+
+    def scan(self):
+        """ read the existing tree of links """
+        self.links = {}
+        self.folders = set()
+        if not self.root.is_dir():
+            return
+        folders = [str(self.root)]
+        while folders:
+            folder = folders.pop()
+            self.folders.add(folder)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        self.links[entry.path] = os.readlink(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    else:
+                        self.links[entry.path] = entry.inode()
+
+    def link_key(self, spec: LinkSpec) -> LinkKey:
+        """ the key that a correct link for spec would have, or None if the
+        target of a hard link does not exist """
+        if self.use_hardlinks:
+            try:
+                return os.stat(str(spec.target)).st_ino
+            except FileNotFoundError:
+                return None
+        if self.absolute_links:
+            return str(spec.target)
+        # incredibly, pathlib.Path.relative_to cannot handle
+        # '../' in a relative path !!! reverting to os.path
+        return os.path.relpath(str(spec.target), str(spec.link.parent))
+
+    def reconcile(self, desired: Iterable[LinkSpec]):
+        """ make the tree contain exactly the links in desired """
+        self.scan()
+        leftovers = dict(self.links)
+        wanted: Dict[str, Tuple[LinkSpec, LinkKey]] = {}
+
+        for spec in desired:
+            link = str(spec.link)
+            if link in wanted:
+                self.failed += 1
+                log.error("bad link to %s (duplicate link %s)", spec.target, link)
+                continue
+            key = self.link_key(spec)
+            if key is None:
+                log.debug("skip hardlink for %s, not downloaded", spec.target)
+                continue
+            if leftovers.get(link) == key:
+                del leftovers[link]
+                self.unchanged += 1
+            else:
+                wanted[link] = (spec, key)
+
+        # links that point at the right file under another name are renamed
+        by_key: Dict[Tuple[str, LinkKey], List[str]] = {}
+        for link, key in leftovers.items():
+            by_key.setdefault((os.path.dirname(link), key), []).append(link)
+        moves: Dict[str, str] = {}
+        to_create: List[Tuple[LinkSpec, LinkKey]] = []
+        for link, (spec, key) in wanted.items():
+            candidates = by_key.get((os.path.dirname(link), key))
+            if candidates:
+                old = candidates.pop()
+                del leftovers[old]
+                moves[old] = link
+            else:
+                to_create.append((spec, key))
+
+        for link in leftovers:
+            log.debug("removing stale link %s", link)
+            os.unlink(link)
+            self.removed += 1
+        self.apply_moves(moves)
+        for spec, key in to_create:
+            self.create_link(spec, key)
+        self.remove_empty_folders(wanted)
+
+    def apply_moves(self, moves: Dict[str, str]):
+        """ rename links, ordering the renames so that none overwrites a
+        link that has not yet moved out of the way """
+        while moves:
+            first, new = moves.popitem()
+            chain = [(first, new)]
+            while new in moves:
+                following = moves.pop(new)
+                chain.append((new, following))
+                new = following
+            if new == first:
+                # a cycle of renames - move the first link out of the way
+                temp = first + self.TEMP_SUFFIX
+                os.rename(first, temp)
+                chain[0] = (temp, chain[0][1])
+            for old, new in reversed(chain):
+                log.debug("renaming link %s -> %s", old, new)
+                os.rename(old, new)
+                self.renamed += 1
+
+    def create_link(self, spec: LinkSpec, key: LinkKey):
+        link_folder = str(spec.link.parent)
+        log.debug("adding link %s -> %s", key, spec.link)
+        try:
+            if link_folder not in self.folders:
+                if not os.path.isdir(link_folder):
+                    log.debug("new link folder %s", link_folder)
+                    os.makedirs(link_folder)
+                self.folders.add(link_folder)
+
+            if self.use_hardlinks:
+                os.link(str(spec.target), str(spec.link))
+            else:
+                os.symlink(key, str(spec.link))
+            self.created += 1
+
+            # Windows tries to follow symlinks even though we specify
+            # follow_symlinks=False. So disable setting of link date
+            # if follow not supported
+            if spec.date and os.utime in os.supports_follow_symlinks:
+                timestamp = Utils.safe_timestamp(spec.date).timestamp()
+                os.utime(str(spec.link), (timestamp, timestamp), follow_symlinks=False)
+        except (FileExistsError, UnicodeEncodeError):
+            self.failed += 1
+            log.error("bad link to %s", spec.target)
+
+    def remove_empty_folders(self, wanted: Dict):
+        """ remove folders that no longer contain links, deepest first """
+        needed = {os.path.dirname(link) for link in wanted}
+        root = str(self.root)
+        for folder in sorted(self.folders, key=len, reverse=True):
+            if folder != root and folder not in needed:
+                try:
+                    os.rmdir(folder)
+                    log.debug("removed empty link folder %s", folder)
+                except OSError:
+                    # not empty
+                    pass
@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
 # coding: utf8
+from contextlib import contextmanager
+import json
+import os
 from pathlib import Path
 import platform
 import sqlite3 as lite
 from sqlite3.dbapi2 import Connection, Cursor
 from datetime import datetime
-from typing import Iterator, Type
+from typing import Any, Dict, Iterator, Optional, Set, Type, Tuple, List, Iterable
 
 # todo this module could be tidied quite a bit
 #  too much application logic at this level in some cases
 #  also the generic functions seem a bit ugly and could do with rework
 import gphotos.Queries as Queries
+from gphotos import Metrics
 from gphotos import Utils
 from gphotos.GoogleAlbumsRow import GoogleAlbumsRow
 from gphotos.LocalFilesRow import LocalFilesRow
@@ -23,10 +27,31 @@ import logging
 log = logging.getLogger(__name__)
 
 
+class QueueState:
+    """ values for the State column of the DownloadQueue table """
+
+    PENDING: int = 0
+    RESOLVED: int = 1
+    IN_FLIGHT: int = 2
+    DONE: int = 3
+    FAILED: int = 4
+
+
 class LocalData:
     DB_FILE_NAME: str = "gphotos.sqlite"
     BLOCK_SIZE: int = 10000
-    VERSION: float = 5.7
+    VERSION: float = 6.5
+    # seconds before retrying a failed download, doubled on each failure
+    RETRY_BACKOFF: int = 600
+    RETRY_MAX_DOUBLINGS: int = 8
+    # download priorities, each selects a tier of files to download first.
+    # 'newest' orders the files within each tier by creation date
+    DOWNLOAD_TIERS = {
+        "favourites": "SyncFiles.Favourite = 1",
+        "albums": "EXISTS (SELECT 1 FROM AlbumFiles "
+        "WHERE AlbumFiles.DriveRec = SyncFiles.RemoteId)",
+    }
+    DOWNLOAD_ORDERS = ("favourites", "albums", "newest")
 
     def __init__(self, root_folder: Path, flush_index: bool = False):
         """ Initialize a connection to the DB and create some cursors.
@@ -68,7 +93,8 @@ class LocalData:
 
     def store(self):
         log.info("Saving Database ...")
-        self.con.commit()
+        with Metrics.DB_COMMIT_SECONDS.time():
+            self.con.commit()
         log.info("Database Saved.")
 
     def check_schema_version(self):
@@ -125,6 +151,21 @@ class LocalData:
 
         return last_date
 
+    def get_fs_probes(self, fs_id: str) -> Optional[Dict[str, Any]]:
+        """ the saved results of the filesystem checks if they were made on
+        the filesystem fs_id """
+        self.cur.execute(
+            "SELECT FsProbes FROM Globals WHERE Id IS 1 AND FsId IS ?", (fs_id,)
+        )
+        res = self.cur.fetchone()
+        return json.loads(res["FsProbes"]) if res and res["FsProbes"] else None
+
+    def put_fs_probes(self, fs_id: str, probes: Dict[str, Any]):
+        self.cur.execute(
+            "UPDATE Globals SET FsId=?, FsProbes=? WHERE Id IS 1",
+            (fs_id, json.dumps(probes)),
+        )
+
     # functions for managing the (any) Media Tables ###########################
     # noinspection SqlResolve
     def put_row(self, row: DbRow, update=False, album=False):
@@ -157,6 +198,25 @@ class LocalData:
             raise
         return row_id
 
+    @staticmethod
+    def date_clauses(
+        start_date: datetime = None, end_date: datetime = None
+    ) -> Tuple[str, tuple]:
+        """ generate the SQL clauses and parameters for filtering SyncFiles
+        by date """
+        clauses = ""
+        params = ()
+        if start_date:
+            # look for create date too since an photo recently uploaded will
+            # keep its original modified date (since that is in the exif)
+            # this clause is specifically to assist in incremental download
+            clauses += "AND (ModifyDate >= ? OR CreateDate >= ?)"
+            params += (start_date, start_date)
+        if end_date:
+            clauses += "AND ModifyDate <= ?"
+            params += (end_date,)
+        return clauses, params
+
     # noinspection SqlResolve
     def get_rows_by_search(
         self,
@@ -186,16 +246,8 @@ class LocalData:
             An iterator over query results
         """
         params = (remote_id, file_name, path)
-        extra_clauses = ""
-        if start_date:
-            # look for create date too since an photo recently uploaded will
-            # keep its original modified date (since that is in the exif)
-            # this clause is specifically to assist in incremental download
-            extra_clauses += "AND (ModifyDate >= ? OR CreateDate >= ?)"
-            params += (start_date, start_date)
-        if end_date:
-            extra_clauses += "AND ModifyDate <= ?"
-            params += (end_date,)
+        extra_clauses, date_params = self.date_clauses(start_date, end_date)
+        params += date_params
         if skip_downloaded:
             extra_clauses += "AND Downloaded IS 0"
         if uid:
@@ -220,23 +272,20 @@ class LocalData:
             log.error("query: %s\nparams: %s", query, params)
             raise
 
-    # noinspection SqlResolve
-    def get_file_by_path(
-        self, row_type: Type[DbRow], folder: Path, name: str
-    ) -> DatabaseMedia:
-        """
-        Search for a media item by filename, this applies to any of the
-        BaseMedia/DbRow derived class pairs
-        """
-        query = "SELECT {0} FROM {1} WHERE Path = ?" " AND FileName = ?;".format(
-            row_type.columns, row_type.table
-        )
-        self.cur.execute(query, (str(folder), name))
-        record = self.cur.fetchone()
-        return row_type(record).to_media()
-
     # functions for managing the SyncFiles Table ##############################
 
+    def get_sync_file_paths(self) -> Set[str]:
+        """ the path of every SyncFiles entry relative to the root folder,
+        as os.path.join(Path, FileName) """
+        paths = set()
+        self.cur2.execute("SELECT Path, FileName FROM SyncFiles;")
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            paths.update(os.path.join(path, name) for path, name in records)
+        return paths
+
     # todo this could be generic and support Albums and LocalFiles too
     def file_duplicate_no(
         self, name: str, path: str, remote_id: str
@@ -282,6 +331,15 @@ class LocalData:
             # the file is new and has no duplicates
             return 0, None
 
+    def put_extra_meta(self, rows: Iterable[Tuple[str, datetime, int, str]]):
+        """ update SyncFiles with a list of (Uid, CreateDate, FileSize,
+        RemoteId) extracted from the downloaded files """
+        self.cur.executemany(
+            "UPDATE SyncFiles SET Uid=?, CreateDate=?, FileSize=? "
+            "WHERE RemoteId IS ?;",
+            rows,
+        )
+
     def put_location(self, sync_file_id: str, location: str):
         self.cur.execute(
             "UPDATE SyncFiles SET Location=? " "WHERE RemoteId IS ?;",
@@ -294,6 +352,14 @@ class LocalData:
             (downloaded, sync_file_id),
         )
 
+    def put_favourites(self, remote_ids: Iterable[str]):
+        """ replace the set of files flagged as favourites """
+        self.cur.execute("UPDATE SyncFiles SET Favourite=0 WHERE Favourite=1;")
+        self.cur.executemany(
+            "UPDATE SyncFiles SET Favourite=1 WHERE RemoteId IS ?;",
+            ((remote_id,) for remote_id in remote_ids),
+        )
+
     def downloaded_count(self, downloaded: bool = True) -> int:
         self.cur.execute(
             "Select Count(Downloaded) from main.SyncFiles WHERE Downloaded=? ",
@@ -302,6 +368,157 @@ class LocalData:
         result = self.cur.fetchone()[0]
         return result
 
+    # functions for managing the DownloadQueue Table ##########################
+    def queue_downloads(
+        self,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        retry_download: bool = False,
+    ):
+        """ Bring the download queue up to date with the index.
+
+        Adds an entry for each file that is not yet downloaded, returns
+        entries that were in flight when a previous run stopped to the queue
+        and re-queues entries whose file has been flagged for download again.
+        With retry_download every file is re-queued and failure backoff is
+        cleared.
+        """
+        date_clauses, params = self.date_clauses(start_date, end_date)
+        self.cur.execute(
+            "UPDATE DownloadQueue SET State=CASE WHEN Url ISNULL THEN ? "
+            "ELSE ? END WHERE State=?;",
+            (QueueState.PENDING, QueueState.RESOLVED, QueueState.IN_FLIGHT),
+        )
+        if retry_download:
+            self.cur.execute(
+                "UPDATE DownloadQueue SET State=?, Attempts=0, NextAttempt=0 "
+                "WHERE State IN (?, ?);",
+                (QueueState.PENDING, QueueState.DONE, QueueState.FAILED),
+            )
+        else:
+            self.cur.execute(
+                "UPDATE DownloadQueue SET State=? WHERE State=? AND RemoteId IN "
+                "(SELECT RemoteId FROM SyncFiles WHERE Downloaded IS 0);",
+                (QueueState.PENDING, QueueState.DONE),
+            )
+            date_clauses += " AND Downloaded IS 0"
+        self.cur.execute(
+            "INSERT OR IGNORE INTO DownloadQueue(RemoteId, State) "
+            "SELECT RemoteId, ? FROM SyncFiles WHERE 1 {};".format(date_clauses),
+            (QueueState.PENDING,) + params,
+        )
+
+    def get_download_queue(
+        self,
+        now: int,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        order: List[str] = None,
+    ) -> Iterator[Tuple[DatabaseMedia, str, int]]:
+        """
+        Iterate over the files in the download queue that are waiting for
+        download, skipping failures whose retry time has not yet come.
+
+        Parameters:
+            now: the current time in seconds since the epoch
+            start_date: start day for search
+            end_date: end day for search
+            order: a list of DOWNLOAD_ORDERS. Each tier in DOWNLOAD_TIERS is
+              returned in turn before the remaining files, with 'newest' the
+              files in each tier are returned most recent first.
+        Returns:
+            An iterator over tuples of media item, resolved download URL
+            (or None) and URL expiry time
+        """
+        order = order or []
+        date_clauses, date_params = self.date_clauses(start_date, end_date)
+        columns = ",".join(
+            "SyncFiles." + col for col in GooglePhotosRow.cols_def.keys()
+        )
+        params = (
+            QueueState.PENDING,
+            QueueState.RESOLVED,
+            QueueState.FAILED,
+            now,
+        ) + date_params
+
+        tiers = [self.DOWNLOAD_TIERS[o] for o in order if o in self.DOWNLOAD_TIERS]
+        if "newest" in order:
+            order_by = "ORDER BY SyncFiles.CreateDate DESC"
+        else:
+            order_by = ""
+        if tiers or order_by:
+            # drive the query from SyncFiles so that its indexes deliver
+            # rows in order, rather than sorting the whole queue
+            join = "SyncFiles CROSS JOIN DownloadQueue"
+        else:
+            join = "DownloadQueue INNER JOIN SyncFiles"
+
+        tier_clauses = []
+        for i in range(len(tiers) + 1):
+            clause = "".join(" AND NOT {}".format(t) for t in tiers[:i])
+            if i < len(tiers):
+                clause += " AND {}".format(tiers[i])
+            tier_clauses.append(clause)
+
+        for tier_clause in tier_clauses:
+            query = (
+                "SELECT {0}, DownloadQueue.Url AS QueueUrl, "
+                "DownloadQueue.UrlExpiry FROM {1} "
+                "ON DownloadQueue.RemoteId=SyncFiles.RemoteId "
+                "WHERE (DownloadQueue.State IN (?, ?) OR "
+                "(DownloadQueue.State=? AND DownloadQueue.NextAttempt <= ?)) "
+                "{2}{3} {4};".format(columns, join, date_clauses, tier_clause, order_by)
+            )
+            self.cur2.execute(query, params)
+            while True:
+                records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+                if not records:
+                    break
+                for record in records:
+                    yield (
+                        GooglePhotosRow(record).to_media(),
+                        record["QueueUrl"],
+                        record["UrlExpiry"],
+                    )
+
+    def queue_resolved(self, remote_id: str, url: str, expiry: int):
+        self.cur.execute(
+            "UPDATE DownloadQueue SET State=?, Url=?, UrlExpiry=? "
+            "WHERE RemoteId IS ?;",
+            (QueueState.RESOLVED, url, expiry, remote_id),
+        )
+
+    def queue_in_flight(self, remote_id: str):
+        self.cur.execute(
+            "UPDATE DownloadQueue SET State=? WHERE RemoteId IS ?;",
+            (QueueState.IN_FLIGHT, remote_id),
+        )
+
+    def queue_done(self, remote_id: str):
+        self.cur.execute(
+            "UPDATE DownloadQueue SET State=?, Url=NULL, Attempts=0, "
+            "LastError=NULL WHERE RemoteId IS ?;",
+            (QueueState.DONE, remote_id),
+        )
+
+    def queue_failed(self, remote_id: str, error: str, now: int):
+        """ record a failed download attempt and schedule its retry with
+        exponential backoff """
+        self.cur.execute(
+            "UPDATE DownloadQueue SET State=?, Url=NULL, LastError=?, "
+            "NextAttempt=? + ? * (1 << min(Attempts, ?)), "
+            "Attempts=Attempts + 1 WHERE RemoteId IS ?;",
+            (
+                QueueState.FAILED,
+                error,
+                now,
+                self.RETRY_BACKOFF,
+                self.RETRY_MAX_DOUBLINGS,
+                remote_id,
+            ),
+        )
+
     # functions for managing Albums ###########################################
     def get_album(self, album_id: str) -> DatabaseMedia:
         query = "SELECT {0} FROM Albums WHERE RemoteId = ?;".format(
@@ -311,6 +528,14 @@ class LocalData:
         res = self.cur.fetchone()
         return GoogleAlbumsRow(res).to_media()
 
+    def get_album_fingerprint(self, album_id: str) -> str:
+        """ the fingerprint recorded when the album was last indexed """
+        self.cur.execute(
+            "SELECT Fingerprint FROM Albums WHERE RemoteId = ?;", (album_id,)
+        )
+        res = self.cur.fetchone()
+        return res[0] if res else None
+
     def put_album_downloaded(self, album_id: str, downloaded: bool = True):
         self.cur.execute(
             "UPDATE Albums SET Downloaded=? " "WHERE RemoteId IS ?;",
@@ -338,29 +563,47 @@ class LocalData:
         FROM AlbumFiles
         INNER JOIN SyncFiles ON AlbumFiles.DriveRec=SyncFiles.RemoteId
         INNER JOIN Albums ON AlbumFiles.AlbumRec=Albums.RemoteId
-        WHERE Albums.RemoteId LIKE ?
+        WHERE AlbumFiles.AlbumRec LIKE ?
         {}
-        ORDER BY Albums.RemoteId, AlbumFiles.Position,
-        SyncFiles.CreateDate;""".format(
+        ORDER BY AlbumFiles.AlbumRec, AlbumFiles.Position;""".format(
             extra_clauses
         )
 
-        self.cur.execute(query, (album_id,))
-        results = self.cur.fetchall()
-        # fetchall does not need to use cur2
-        for result in results:
-            yield tuple(result)
+        # stream the results in blocks on a cursor of our own so that callers
+        # may use the other cursors while iterating
+        cur = self.con.cursor()
+        cur.execute(query, (album_id,))
+        while True:
+            records = cur.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
 
-    def put_album_file(self, album_rec: str, file_rec: str, position: int):
-        """ Record in the DB a relationship between an album and a media item
-        """
-        self.cur.execute(
+    def put_album_files(self, album_rec: str, files: Iterable[Tuple[str, int]]):
+        """ Record in the DB the relationships between an album and a list
+        of (media item, position) """
+        self.cur.executemany(
             "INSERT OR REPLACE INTO AlbumFiles(AlbumRec, DriveRec, Position) "
-            "VALUES(?,"
-            "?,?) ;",
-            (album_rec, file_rec, position),
+            "VALUES(?,?,?) ;",
+            ((album_rec, file_rec, position) for file_rec, position in files),
         )
 
+    @contextmanager
+    def replace_album_files(self, album_rec: str):
+        """ A savepoint for rewriting the contents of an album. The album's
+        previous AlbumFiles rows are removed on entry and the whole change
+        is rolled back if the block raises """
+        self.cur.execute("SAVEPOINT album_files;")
+        try:
+            self.cur.execute("DELETE FROM AlbumFiles WHERE AlbumRec=?;", (album_rec,))
+            yield
+        except BaseException:
+            self.cur.execute("ROLLBACK TO album_files;")
+            raise
+        finally:
+            self.cur.execute("RELEASE album_files;")
+
     def remove_all_album_files(self):
         # noinspection SqlWithoutWhere
         self.cur.execute("DELETE FROM AlbumFiles")
@@ -390,7 +633,6 @@ class LocalData:
                 yield r.id, pth
 
     def get_extra_paths(self):
-        self.cur2.execute(Queries.pre_extra_files)
         self.cur2.execute(Queries.extra_files)
         while True:
             records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
@@ -399,22 +641,180 @@ class LocalData:
             for record in records:
                 r = GooglePhotosRow(record).to_media()
                 pth = r.relative_path.parent / r.filename
-                yield pth
+                yield r.id, pth
 
-    def local_exists(self, file_name: str, path: str):
-        self.cur.execute(
-            "SELECT COUNT() FROM main.LocalFiles WHERE FileName = ?" "AND PATH = ?;",
-            (file_name, path),
+    def put_local_files(self, rows: List[LocalFilesRow]):
+        """ bulk insert rows into LocalFiles, replacing any previous row for
+        the same file """
+        if rows:
+            query = "INSERT OR REPLACE INTO LocalFiles ({0}) VALUES ({1});".format(
+                LocalFilesRow.columns, LocalFilesRow.params
+            )
+            self.cur.executemany(query, (row.dict for row in rows))
+
+    def get_local_file_stats(self) -> Dict[str, Dict[str, Tuple[int, int]]]:
+        """ the size and modification time of every scanned local file,
+        recorded when it was last scanned, as {Path: {FileName: stat}} """
+        stats = {}
+        self.cur2.execute("SELECT Path, FileName, FileSize, FileMTime FROM LocalFiles;")
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for path, file_name, size, mtime in records:
+                stats.setdefault(path, {})[file_name] = (size, mtime)
+        return stats
+
+    def remove_local_files(self, names: Iterable[Tuple[str, str]]):
+        """ remove the LocalFiles rows for a list of (Path, FileName) """
+        self.cur.executemany(
+            "DELETE FROM LocalFiles WHERE Path = ? AND FileName = ?;", names
         )
-        result = int(self.cur.fetchone()[0])
-        return result
 
     def local_erase(self):
         # noinspection SqlWithoutWhere
         self.cur.execute("DELETE FROM main.LocalFiles")
 
-    def find_local_matches(self):
+    def clear_local_matches(self):
         # noinspection SqlWithoutWhere
-        for i, q in enumerate(Queries.match):
-            log.info("Executing local match query {}".format(i))
-            self.cur.execute(q)
+        self.cur.execute("UPDATE LocalFiles SET RemoteId = NULL;")
+
+    def get_sync_match_keys(self) -> Iterator[Tuple[str, str, str, str]]:
+        """ (RemoteId, OrigFileName, Uid, CreateDate) of every library item
+        in the order they were indexed """
+        self.cur2.execute(
+            "SELECT RemoteId, OrigFileName, Uid, CreateDate FROM SyncFiles "
+            "ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def get_local_match_keys(self) -> Iterator[Tuple[int, str, str, str]]:
+        """ (Id, OriginalFileName, Uid, CreateDate) of every local file """
+        self.cur2.execute(
+            "SELECT Id, OriginalFileName, Uid, CreateDate FROM LocalFiles "
+            "ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def put_local_matches(self, matches: Iterable[Tuple[str, int]]):
+        """ record a list of (RemoteId, LocalFiles Id) matches """
+        self.cur.executemany(
+            "UPDATE LocalFiles SET RemoteId = ? WHERE Id = ?;", matches
+        )
+
+    def get_local_file_sizes(self) -> Iterator[Tuple[int, str, str, int, int]]:
+        """ (Id, Path, FileName, FileSize, FileMTime) of every local file """
+        self.cur2.execute(
+            "SELECT Id, Path, FileName, FileSize, FileMTime FROM LocalFiles "
+            "ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def get_downloaded_files(self) -> Iterator[Tuple[str, str, str]]:
+        """ (RemoteId, Path, FileName) of the downloaded library files in the
+        order they were indexed """
+        self.cur2.execute(
+            "SELECT RemoteId, Path, FileName FROM SyncFiles WHERE Downloaded "
+            "ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def get_file_hashes(self) -> Dict[str, Tuple[int, int, str]]:
+        """ the cached content hashes as {FullPath: (size, mtime, hash)} """
+        hashes = {}
+        self.cur2.execute("SELECT FullPath, FileSize, FileMTime, Hash FROM FileHashes;")
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for path, size, mtime, file_hash in records:
+                hashes[path] = (size, mtime, file_hash)
+        return hashes
+
+    def put_file_hashes(self, rows: Iterable[Tuple[str, int, int, str]]):
+        """ cache a list of (FullPath, size, mtime, hash) """
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO FileHashes "
+            "(FullPath, FileSize, FileMTime, Hash) VALUES (?, ?, ?, ?);",
+            rows,
+        )
+
+    def get_unmatched_local_images(self) -> Iterator[Tuple[int, str, str]]:
+        """ (Id, Path, FileName) of the local images with no match """
+        self.cur2.execute(
+            "SELECT Id, Path, FileName FROM LocalFiles "
+            "WHERE RemoteId ISNULL AND MimeType LIKE 'image/%' ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def get_unmatched_library_images(self) -> Iterator[Tuple[str, str, str]]:
+        """ (RemoteId, Path, FileName) of the downloaded library images that
+        no local file matches, in the order they were indexed """
+        self.cur2.execute(
+            "SELECT RemoteId, Path, FileName FROM SyncFiles "
+            "WHERE Downloaded AND MimeType LIKE 'image/%' AND RemoteId NOT IN "
+            "(SELECT RemoteId FROM LocalFiles WHERE RemoteId NOTNULL) "
+            "ORDER BY Id;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for record in records:
+                yield tuple(record)
+
+    def get_image_hashes(self) -> Dict[str, Tuple[int, int, Optional[int]]]:
+        """ the cached perceptual hashes as {FullPath: (size, mtime, hash)}.
+        The hash is None for files that could not be read as images """
+        hashes = {}
+        self.cur2.execute(
+            "SELECT FullPath, FileSize, FileMTime, Hash FROM ImageHashes;"
+        )
+        while True:
+            records = self.cur2.fetchmany(LocalData.BLOCK_SIZE)
+            if not records:
+                break
+            for path, size, mtime, image_hash in records:
+                hashes[path] = (
+                    size,
+                    mtime,
+                    None if image_hash is None else int(image_hash, 16),
+                )
+        return hashes
+
+    def put_image_hashes(self, rows: Iterable[Tuple[str, int, int, Optional[int]]]):
+        """ cache a list of (FullPath, size, mtime, hash). The 64 bit hashes
+        are stored as hex as they do not fit in an sqlite INTEGER """
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO ImageHashes "
+            "(FullPath, FileSize, FileMTime, Hash) VALUES (?, ?, ?, ?);",
+            (
+                (path, size, mtime, None if h is None else "{:016x}".format(h))
+                for path, size, mtime, h in rows
+            ),
+        )
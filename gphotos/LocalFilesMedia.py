@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 # coding: utf8
 
+from io import BytesIO
 from pathlib import Path
-from json import loads
-from subprocess import run, CalledProcessError, PIPE
 from . import Utils
+from . import VideoMetadata
 from .BaseMedia import BaseMedia
-from typing import Dict, List, Union, Any, Optional
+from typing import BinaryIO, Dict, List, Union, Any, Optional
 from datetime import datetime
 from mimetypes import guess_type
 import exif
@@ -15,17 +15,6 @@ import re
 JSONValue = Union[str, int, float, bool, None, Dict[str, Any], List[Any]]
 JSONType = Union[Dict[str, JSONValue], List[JSONValue]]
 
-# command to extract creation date from video files
-FF_PROBE = [
-    "ffprobe",
-    "-v",
-    "quiet",
-    "-print_format",
-    "json",
-    "-show_entries",
-    "stream=index,codec_type:stream_tags=creation_time:format_" "tags=creation_time",
-]
-
 # Huawei adds these camera modes to description but Google Photos seems wise to
 # it and does not report this in its description metadata
 # noinspection SpellCheckingInspection
@@ -59,6 +48,36 @@ HUAWEI_JUNK = [
 # but 'demo (2).jpg' to 'demo (999).jpg' are
 DUPLICATE_MATCH = re.compile(r"(.*) \(([2-9]|\d{2,3})\)\.(.*)")
 
+# JPEG markers used to locate the EXIF segment
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+EXIF_HEADER = b"Exif\x00\x00"
+# give up looking for the EXIF segment after this many bytes of other segments
+EXIF_SEARCH_LIMIT = 256 * 1024
+
+
+def exif_header(image_file: BinaryIO) -> bytes:
+    """ read just the EXIF APP1 segment of a JPEG, skipping over any other
+    segments before it, and return it wrapped as a minimal JPEG that
+    exif.Image can parse. Returns empty bytes if there is no EXIF segment
+    (or the file is not a JPEG), which exif.Image treats as having no EXIF """
+    if image_file.read(2) != JPEG_SOI:
+        return b""
+    while image_file.tell() < EXIF_SEARCH_LIMIT:
+        marker = image_file.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF or marker[1] == JPEG_SOS:
+            break
+        length = int.from_bytes(marker[2:], "big")
+        if marker[1] == JPEG_APP1:
+            segment = image_file.read(length - 2)
+            if segment.startswith(EXIF_HEADER):
+                return JPEG_SOI + marker + segment + JPEG_EOI
+        else:
+            image_file.seek(length - 2, 1)
+    return b""
+
 
 class LocalFilesMedia(BaseMedia):
     def __init__(self, full_path: Path):
@@ -68,7 +87,6 @@ class LocalFilesMedia(BaseMedia):
         self.is_video: bool = self.__mime_type.startswith("video")
         self.__full_path: Path = full_path
         self.__original_name: str = full_path.name
-        self.__ffprobe_installed = True
         self.__createDate: datetime = None
 
         self.got_meta: bool = False
@@ -90,25 +108,10 @@ class LocalFilesMedia(BaseMedia):
             self.get_image_date()
 
     def get_video_meta(self):
-        if self.__ffprobe_installed:
-            try:
-                command = FF_PROBE + [str(self.__full_path)]
-                result = run(command, stdout=PIPE, check=True)
-                out = str(result.stdout.decode("utf-8"))
-                json = loads(out)
-                t = json["format"]["tags"]["creation_time"]
-                self.__createDate = Utils.string_to_date(t)
-                self.got_meta = True
-            except FileNotFoundError:
-                # this means there is no ffprobe installed
-                self.__ffprobe_installed = False
-            except CalledProcessError:
-                pass
-            except KeyError:
-                # ffprobe worked but there is no creation time in the JSON
-                pass
-
-        if not self.__createDate:
+        self.__createDate = VideoMetadata.creation_time(self.__full_path)
+        if self.__createDate:
+            self.got_meta = True
+        else:
             # just use file date
             self.__createDate = datetime.utcfromtimestamp(
                 self.__full_path.stat().st_mtime
@@ -134,7 +137,7 @@ class LocalFilesMedia(BaseMedia):
     def get_exif(self):
         try:
             with open(str(self.relative_folder / self.filename), "rb") as image_file:
-                self.__exif = exif.Image(image_file)
+                self.__exif = exif.Image(BytesIO(exif_header(image_file)))
             self.got_meta = True
         except (IOError, AssertionError):
             self.got_meta = False
@@ -163,6 +166,11 @@ class LocalFilesMedia(BaseMedia):
         s = self.__full_path.stat().st_size
         return s
 
+    @property
+    def mtime(self) -> int:
+        """ modification time in nanoseconds, used to detect changed files """
+        return self.__full_path.stat().st_mtime_ns
+
     @property
     def id(self) -> Optional[str]:
         return None
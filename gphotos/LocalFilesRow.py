@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 # coding: utf8
-from typing import TypeVar
+from typing import TypeVar, TYPE_CHECKING
 from pathlib import Path
 from datetime import datetime
 from gphotos.DbRow import DbRow
 from gphotos.BaseMedia import BaseMedia
 from gphotos.DatabaseMedia import DatabaseMedia
-from gphotos.LocalFilesMedia import LocalFilesMedia
 import logging
 
+if TYPE_CHECKING:
+    # only needed by from_media, importing it loads exif
+    from gphotos.LocalFilesMedia import LocalFilesMedia
+
 log = logging.getLogger(__name__)
 
 # this allows self reference to this class in its factory methods
@@ -35,6 +38,7 @@ class LocalFilesRow(DbRow):
         "MimeType": str,
         "Description": str,
         "FileSize": int,
+        "FileMTime": int,
         "ModifyDate": datetime,
         "CreateDate": datetime,
         "SyncDate": datetime,
@@ -58,7 +62,7 @@ class LocalFilesRow(DbRow):
         return db_media
 
     @classmethod
-    def from_media(cls, media: LocalFilesMedia) -> G:
+    def from_media(cls, media: "LocalFilesMedia") -> G:
         now_time = datetime.now().strftime(BaseMedia.TIME_FORMAT)
         new_row = cls.make(
             Path=str(media.relative_folder),
@@ -67,6 +71,7 @@ class LocalFilesRow(DbRow):
             OriginalFileName=media.orig_name,
             DuplicateNo=media.duplicate_number,
             FileSize=media.size,
+            FileMTime=media.mtime,
             MimeType=media.mime_type,
             Description=media.description,
             ModifyDate=media.modify_date,
@@ -1,17 +1,52 @@
 #!/usr/bin/env python3
 # coding: utf8
 
+import csv
+import json
+import os
 from pathlib import Path
-import shutil
-from typing import Callable
+from typing import Dict, Iterator, List, Optional, Tuple
+from mimetypes import guess_type
+from . import Logging
+from . import Utils
+from . import VideoMetadata
+from .ContentMatcher import ContentMatcher
+from .LinkTree import LinkTree, LinkSpec
 from .LocalData import LocalData
 import logging
 from .LocalFilesMedia import LocalFilesMedia
 from .LocalFilesRow import LocalFilesRow
+from .LocalMatcher import LocalMatcher
+from .SimilarImages import SimilarImages
 
 log = logging.getLogger(__name__)
 
 IGNORE_FOLDERS = ["albums", "comparison", "gphotos-code"]
+# number of files passed to a metadata worker process at a time
+SCAN_CHUNK = 64
+# chunks queued per worker process
+SCAN_PENDING = 4
+# save the database after this many files
+STORE_FILES = 20000
+# columns of the comparison report
+REPORT_FIELDS = ["type", "group", "remote_id", "path"]
+
+
+def local_file_rows(paths: List[Path]) -> List[LocalFilesRow]:
+    """ extract the metadata for a chunk of files, runs in a worker process
+    so that EXIF parsing and ffprobe calls are spread over all cores """
+    # probe the videos in this chunk concurrently
+    VideoMetadata.prefetch(
+        path for path in paths if (guess_type(str(path))[0] or "").startswith("video")
+    )
+    rows = []
+    for path in paths:
+        try:
+            rows.append(LocalFilesRow.from_media(LocalFilesMedia(path)))
+        except Exception:
+            log.error("file %s could not be made into a media obj", path, exc_info=True)
+            raise
+    return rows
 
 
 class LocalFilesScan(object):
@@ -19,11 +54,25 @@ class LocalFilesScan(object):
     Google Photos Library
     """
 
-    def __init__(self, root_folder: Path, scan_folder: Path, db: LocalData):
+    def __init__(
+        self,
+        root_folder: Path,
+        scan_folder: Path,
+        db: LocalData,
+        match_similar: bool = False,
+        match_content: bool = False,
+        report: Path = None,
+    ):
         """
         Parameters:
             scan_folder: path to the root of local files to scan
             db: local database for indexing
+            match_similar: also match images that look the same as a library
+                image (by perceptual hash)
+            match_content: first match files with identical contents to a
+                downloaded library file
+            report: write the results to this file instead of creating the
+                comparison folder
         """
         self._scan_folder: Path = scan_folder
         self._root_folder: Path = root_folder
@@ -31,104 +80,186 @@ class LocalFilesScan(object):
         self._ignore_files: str = str(root_folder / "*gphotos*")
         self._ignore_folders = [root_folder / path for path in IGNORE_FOLDERS]
         self._db: LocalData = db
+        self._match_similar = match_similar
+        self._match_content = match_content
+        self._report = report
         self.count = 0
+        self.unchanged = 0
 
     def scan_local_files(self):
         if not self._scan_folder.exists():
             raise FileNotFoundError(
                 "Compare folder {} does not exist".format(self._scan_folder)
             )
-        # for self-comparison, make sure there is no comparison folder
-        # or we'll get recursive entries
-        if self._comparison_folder.exists():
-            log.debug("removing previous comparison tree")
-            shutil.rmtree(self._comparison_folder)
-        log.warning("removing previous local scan data")
-        self._db.local_erase()
         log.warning("Indexing comparison folder %s", self._scan_folder)
-        self.scan_folder(self._scan_folder, self.index_local_item)
+        # files that are unchanged since the last scan keep their metadata.
+        # files are removed from known as they are found, leaving those that
+        # have vanished
+        known = self._db.get_local_file_stats()
+        workers = os.cpu_count() or 1
+        with Logging.process_pool(workers) as pool:
+            for rows in Utils.pool_map(
+                pool,
+                local_file_rows,
+                Utils.chunks(self.changed_files(known), SCAN_CHUNK),
+                workers * SCAN_PENDING,
+            ):
+                self.index_local_rows(rows)
+
+        removed = [
+            (path, file_name) for path, files in known.items() for file_name in files
+        ]
+        self._db.remove_local_files(removed)
         log.warning(
-            "Indexed %d files in comparison folder %s", self.count, self._scan_folder
+            "Indexed %d new or changed files in comparison folder %s "
+            "(%d unchanged, %d removed)",
+            self.count,
+            self._scan_folder,
+            self.unchanged,
+            len(removed),
         )
 
-    def scan_folder(self, folder: Path, index: Callable):
-        if folder.exists():
+    def changed_files(
+        self, known: Dict[str, Dict[str, Tuple[int, int]]]
+    ) -> Iterator[Path]:
+        """ yield the files that are new or have a different size or
+        modification time since the last scan, removing every file found
+        from known """
+        for pth, stat in self.scan_folder(self._scan_folder):
+            folder = known.get(str(pth.parent))
+            previous = folder.pop(pth.name, None) if folder else None
+            if previous == (stat.st_size, stat.st_mtime_ns):
+                self.unchanged += 1
+            else:
+                yield pth
+
+    def scan_folder(self, folder: Path) -> Iterator[Tuple[Path, os.stat_result]]:
+        """ walk a folder tree yielding the files to index and their stat.
+        Uses os.scandir so that the type of most entries is known without a
+        stat call """
+        folders = [folder] if folder.exists() else []
+        while folders:
+            folder = folders.pop()
             log.debug("scanning %s", folder)
-            for pth in folder.iterdir():
-                if pth.is_dir():
-                    # IGNORE_FOLDERS for comparing against 'self'
-                    if pth not in self._ignore_folders:
-                        self.scan_folder(pth, index)
-                elif not pth.is_symlink():
-                    if not pth.match(self._ignore_files):
-                        self.count += index(pth)
-                        if self.count and self.count % 20000 == 0:
-                            self._db.store()
-
-    def index_local_item(self, path: Path) -> int:
-        if self._db.local_exists(file_name=path.name, path=str(path.parent)):
-            result = 0
-            log.debug("already indexed local file: %s", path)
-        else:
-            result = 1
-            try:
-                lf = LocalFilesMedia(path)
-                log.info(
-                    "indexed local file: %s %s %s %s",
-                    lf.relative_folder,
-                    lf.filename,
-                    lf.create_date,
-                    lf.uid,
-                )
-                self._db.put_row(LocalFilesRow.from_media(lf))
-            except Exception:
-                log.error(
-                    "file %s could not be made into a media obj", path, exc_info=True
-                )
-                raise
-        return result
+            with os.scandir(str(folder)) as entries:
+                for entry in entries:
+                    pth = Path(entry.path)
+                    if entry.is_dir():
+                        # IGNORE_FOLDERS for comparing against 'self'
+                        if pth not in self._ignore_folders:
+                            folders.append(pth)
+                    elif not entry.is_symlink():
+                        if not pth.match(self._ignore_files):
+                            yield pth, entry.stat()
+
+    def index_local_rows(self, rows: List[LocalFilesRow]):
+        for row in rows:
+            log.info(
+                "indexed local file: %s %s %s %s",
+                row.Path,
+                row.FileName,
+                row.CreateDate,
+                row.Uid,
+            )
+        self._db.put_local_files(rows)
+        previous = self.count
+        self.count += len(rows)
+        if self.count // STORE_FILES > previous // STORE_FILES:
+            self._db.store()
 
     def find_missing_gphotos(self):
         log.warning("matching local files and photos library ...")
-        self._db.find_local_matches()
-        log.warning("creating comparison folder ...")
-        folders_missing = self._comparison_folder / "missing_files"
-        if self._comparison_folder.exists():
-            log.debug("removing previous comparison tree")
-            shutil.rmtree(self._comparison_folder)
-
-        for i, orig_path in enumerate(self._db.get_missing_paths()):
-            link_path = folders_missing / orig_path.relative_to(self._scan_folder)
-            log.debug("adding missing file %d link %s", i, link_path)
-            if not link_path.parent.exists():
-                link_path.parent.mkdir(parents=True)
-            if not link_path.exists():
-                link_path.symlink_to(orig_path)
-
-        folders_extras = self._comparison_folder / "extra_files"
-        for i, orig_path in enumerate(self._db.get_extra_paths()):
-            link_path = folders_extras / orig_path
-            log.debug("adding extra file %d link %s", i, link_path)
-            if not link_path.parent.exists():
-                link_path.parent.mkdir(parents=True)
-            if not link_path.exists():
-                link_path.symlink_to(self._root_folder / orig_path)
-
-        flat_duplicates = self._comparison_folder / "duplicates"
-        flat_duplicates.mkdir(parents=True)
+        content = None
+        if self._match_content:
+            content = ContentMatcher(self._root_folder, self._db)
+        counts = LocalMatcher(self._db, content).match()
+        if self._match_similar:
+            counts["similar"] = SimilarImages(self._root_folder, self._db).match()
+        log.warning(
+            "matched %d local files: %s",
+            sum(counts.values()),
+            ", ".join("{} {}".format(count, stage) for stage, count in counts.items()),
+        )
+        if self._report:
+            self.write_report(self._report)
+        else:
+            self.create_comparison_links()
+
+    def comparison_items(self) -> Iterator[Tuple[str, Optional[int], str, Path]]:
+        """ yield (type, duplicate group, RemoteId, path) for each missing,
+        extra and duplicate file, streamed from the database """
+        for orig_path in self._db.get_missing_paths():
+            yield "missing", None, None, orig_path
+        for rid, orig_path in self._db.get_extra_paths():
+            yield "extra", None, rid, self._root_folder / orig_path
         duplicate_group = 0
         prev_id = ""
-        for i, (rid, orig_path) in enumerate(self._db.get_duplicates()):
+        for rid, orig_path in self._db.get_duplicates():
             if rid != prev_id:
                 duplicate_group += 1
             prev_id = rid
-            log.debug(
-                "adding duplicate group %d file %d link %s",
-                duplicate_group,
-                i,
-                orig_path,
-            )
-            flat_link = flat_duplicates / "{:05d}_{:03d}_{}".format(
-                i, duplicate_group, orig_path.name
-            )
-            flat_link.symlink_to(self._root_folder / orig_path)
+            yield "duplicate", duplicate_group, rid, self._root_folder / orig_path
+
+    def comparison_links(self) -> Iterator[LinkSpec]:
+        """ generate the links that the comparison folder should contain """
+        duplicate = 0
+        for kind, duplicate_group, _, orig_path in self.comparison_items():
+            if kind == "missing":
+                link_path = (
+                    self._comparison_folder
+                    / "missing_files"
+                    / orig_path.relative_to(self._scan_folder)
+                )
+            elif kind == "extra":
+                link_path = (
+                    self._comparison_folder
+                    / "extra_files"
+                    / orig_path.relative_to(self._root_folder)
+                )
+            else:
+                link_path = (
+                    self._comparison_folder
+                    / "duplicates"
+                    / "{:05d}_{:03d}_{}".format(
+                        duplicate, duplicate_group, orig_path.name
+                    )
+                )
+                duplicate += 1
+            yield LinkSpec(link_path, orig_path)
+
+    def create_comparison_links(self):
+        log.warning("creating comparison folder ...")
+        # only the links that changed since the last comparison are touched.
+        # Earlier versions wrote absolute links so keep doing that
+        tree = LinkTree(self._comparison_folder, absolute_links=True)
+        tree.reconcile(self.comparison_links())
+        log.warning(
+            "Comparison folder links: %d created, %d renamed, %d removed, "
+            "%d unchanged",
+            tree.created,
+            tree.renamed,
+            tree.removed,
+            tree.unchanged,
+        )
+
+    def write_report(self, report: Path):
+        """ write the comparison results to report as CSV if its suffix is
+        .csv or as JSON lines otherwise """
+        log.warning("writing comparison report %s ...", report)
+        rows = (
+            (kind, duplicate_group, rid, str(orig_path))
+            for kind, duplicate_group, rid, orig_path in self.comparison_items()
+        )
+        count = 0
+        with report.open("w", newline="", encoding="utf-8") as f:
+            if report.suffix.lower() == ".csv":
+                writer = csv.writer(f)
+                writer.writerow(REPORT_FIELDS)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(REPORT_FIELDS, row))) + "\n")
+                    count += 1
+        log.warning("wrote %d comparison results to %s", count, report)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# coding: utf8
+from typing import Dict, List, Optional, Set, Tuple
+
+from .ContentMatcher import ContentMatcher
+from .LocalData import LocalData
+import logging
+
+log = logging.getLogger(__name__)
+
+# a library item, Id ordering is the order in which items were indexed
+Candidate = Tuple[int, str]
+
+
+class LocalMatcher:
+    """ Matches the files in a local comparison folder (LocalFiles) with the
+    items in the photos library (SyncFiles).
+
+    The library is loaded once into dictionaries keyed on the match fields
+    so that each local file is matched with a few lookups. The matching
+    rules are applied in stages, each stage only considering the local files
+    that earlier stages did not match:
+
+        content: identical contents to a downloaded library file, only if a
+            ContentMatcher is supplied
+        uid: same OrigFileName, Uid and CreateDate, or the same Uid when it
+            is a (unique) 32 character id
+        name_and_date: same OrigFileName and CreateDate
+        name: same OrigFileName
+
+    The last two stages only consider library items that had not already
+    been matched when the stage started. Where there are several candidates
+    for the same key the library item indexed first wins.
+    """
+
+    STAGES = ["content", "uid", "name_and_date", "name"]
+
+    def __init__(self, db: LocalData, content: Optional[ContentMatcher] = None):
+        self._db = db
+        self._content = content
+        self._by_uid_key: Dict[Tuple[str, str, str], Candidate] = {}
+        self._by_long_uid: Dict[str, Candidate] = {}
+        self._by_name_and_date: Dict[Tuple[str, str], List[Candidate]] = {}
+        self._by_name: Dict[str, List[Candidate]] = {}
+        # LocalFiles Id -> matched RemoteId
+        self.matches: Dict[int, str] = {}
+        self.counts: Dict[str, int] = {}
+
+    def load_library(self):
+        for index, (remote_id, name, uid, date) in enumerate(
+            self._db.get_sync_match_keys()
+        ):
+            candidate = (index, remote_id)
+            if uid is not None:
+                if name is not None and date is not None:
+                    self._by_uid_key.setdefault((name, uid, date), candidate)
+                if len(uid) == 32:
+                    self._by_long_uid.setdefault(uid, candidate)
+            if name is not None:
+                if date is not None:
+                    self._by_name_and_date.setdefault((name, date), []).append(
+                        candidate
+                    )
+                self._by_name.setdefault(name, []).append(candidate)
+
+    def match(self) -> Dict[str, int]:
+        """ match all local files and record the results in LocalFiles.
+        Returns the number of matches made by each stage """
+        self.load_library()
+        local_files = list(self._db.get_local_match_keys())
+
+        if self._content:
+            found = self._content.find_matches()
+            self.run_stage(
+                "content", local_files, lambda local_id, *_: found.get(local_id)
+            )
+        self.run_stage("uid", local_files, self.match_uid)
+        # the later stages exclude library items matched by earlier stages
+        match_name_and_date = self.first_unmatched(
+            self._by_name_and_date,
+            lambda name, date: None if date is None else (name, date),
+        )
+        self.run_stage("name_and_date", local_files, match_name_and_date)
+        match_name = self.first_unmatched(self._by_name, lambda name, _: name)
+        self.run_stage("name", local_files, match_name)
+
+        self._db.clear_local_matches()
+        self._db.put_local_matches(
+            (remote_id, local_id) for local_id, remote_id in self.matches.items()
+        )
+        return self.counts
+
+    def run_stage(self, stage: str, local_files: List[Tuple], match_one):
+        count = 0
+        for local_id, name, uid, date in local_files:
+            if local_id in self.matches:
+                continue
+            remote_id = match_one(local_id, name, uid, date)
+            if remote_id is not None:
+                self.matches[local_id] = remote_id
+                count += 1
+        self.counts[stage] = count
+        log.info("local match stage %s matched %d files", stage, count)
+
+    def match_uid(
+        self, _local_id: int, name: str, uid: str, date: str
+    ) -> Optional[str]:
+        if uid is None or uid == "not_supported":
+            return None
+        # an item with the same name and date is preferred over one that
+        # only shares the long uid
+        candidate = None
+        if name is not None and date is not None:
+            candidate = self._by_uid_key.get((name, uid, date))
+        if candidate is None and len(uid) == 32:
+            candidate = self._by_long_uid.get(uid)
+        return candidate[1] if candidate else None
+
+    def first_unmatched(self, index: Dict, make_key):
+        """ returns a match function that looks up local files in index and
+        selects the first library item not matched by the stages so far """
+        excluded: Set[str] = set(self.matches.values())
+        # the answer for a key cannot change during the stage
+        found: Dict = {}
+
+        def match_one(_local_id: int, name: str, _uid: str, date: str) -> Optional[str]:
+            if name is None:
+                return None
+            key = make_key(name, date)
+            if key is None:
+                return None
+            if key not in found:
+                found[key] = next(
+                    (
+                        remote_id
+                        for _, remote_id in index.get(key, [])
+                        if remote_id not in excluded
+                    ),
+                    None,
+                )
+            return found[key]
+
+        return match_one
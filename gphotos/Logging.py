@@ -1,12 +1,23 @@
+import copy
 import sys
 import logging
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import Queue
 
 # add a trace level for logging all API calls to Google
 # this will be filtered into a separate file
 TRACE_API_NUM = 9
 TRACE_API = "TRACE"
+# maximum number of log records waiting to be written. When the queue is full
+# records below WARNING are dropped rather than holding up the caller
+LOG_QUEUE_SIZE = 10000
 
 
 class MaxLevelFilter(logging.Filter):
@@ -30,16 +41,114 @@ def trace(self, message, *args, **kwargs):
 setattr(logging.Logger, "trace", trace)
 
 
-def setup_logging(log_level: str, log_filename: Path, folder: Path):
-    # add out custom trace level logging
-    logging.addLevelName(TRACE_API_NUM, TRACE_API)
+class DroppingQueueHandler(QueueHandler):
+    """Passes records to a bounded queue for writing on the listener thread.
+    If the queue is full records below WARNING are dropped and counted,
+    WARNING and above wait for space so that they are never lost"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # resolve the message now, the caller may change mutable args before
+        # the listener thread writes the record. This also makes the record
+        # picklable for the queue from process pool workers. The rest of the
+        # formatting (time stamps, level names) is left to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+            else:
+                self.queue.put(record)
+
+
+class LogQueueListener(QueueListener):
+    """Writes the queued log records to the real handlers on a background
+    thread. stop() removes the queue handler from the root logger, then
+    writes any records still queued"""
+
+    def __init__(self, handler: DroppingQueueHandler, *handlers: logging.Handler):
+        super().__init__(handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = handler
+        self.worker_listener: QueueListener = None
+
+    def worker_queue(self) -> "Queue":
+        """ the queue that process pool workers send their records to. They
+        are written to the same handlers by a second listener thread """
+        if self.worker_listener is None:
+            from multiprocessing import Queue
+
+            self.worker_listener = QueueListener(
+                Queue(self.queue.maxsize),
+                *self.handlers,
+                respect_handler_level=True,
+            )
+            self.worker_listener.start()
+        return self.worker_listener.queue
+
+    def stop(self):
+        global _listener
+        if self.worker_listener:
+            self.worker_listener.stop()
+            self.worker_listener.queue.close()
+            self.worker_listener = None
+        if self.queue_handler.dropped:
+            logging.getLogger(__name__).warning(
+                "%d log messages were dropped because logging could not keep up",
+                self.queue_handler.dropped,
+            )
+        logging.getLogger().removeHandler(self.queue_handler)
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+        if _listener is self:
+            _listener = None
+
+
+# formats the exceptions of queued records
+_exception_formatter = logging.Formatter()
+# the listener started by setup_logging, None until then
+_listener: LogQueueListener = None
+
+
+def worker_logging(log_queue: "Queue", level: int):
+    """ initializer for process pool workers. Replaces the queue handler
+    inherited from the parent process (whose queue is not read by anything
+    in the worker) with one that sends records to the parent's listener """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+
+
+def process_pool(max_workers: int) -> "ProcessPoolExecutor":
+    """ a process pool whose workers log through the listener started by
+    setup_logging. A plain process pool if logging has not been set up """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if _listener is None:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=worker_logging,
+        initargs=(_listener.worker_queue(), logging.getLogger().level),
+    )
 
-    # if we are debugging requests library is too noisy
-    logging.getLogger("requests").setLevel(logging.WARNING)
-    logging.getLogger("requests_oauthlib").setLevel(logging.WARNING)
-    logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-    # determine the numeric log level from the string argument
+def level_number(log_level: str) -> int:
+    """ determine the numeric log level from the string argument """
     if log_level.upper() == TRACE_API.upper():
         # todo - i would expect addLevelName to do this for us?
         numeric_level = TRACE_API_NUM
@@ -47,6 +156,30 @@ def setup_logging(log_level: str, log_filename: Path, folder: Path):
         numeric_level = getattr(logging, log_level.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError("Invalid log level: %s" % log_level)
+    return numeric_level
+
+
+def setup_logging(
+    log_level: str,
+    log_filename: Path,
+    folder: Path,
+    logfile_level: str = "debug",
+    queue_size: int = LOG_QUEUE_SIZE,
+) -> LogQueueListener:
+    """ send all logging through a queue to the console, log file and trace
+    file handlers so that the calling threads never wait on log I/O.
+    Returns the started listener, call its stop() method before exiting """
+    global _listener
+    # add out custom trace level logging
+    logging.addLevelName(TRACE_API_NUM, TRACE_API)
+
+    # if we are debugging requests library is too noisy
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("requests_oauthlib").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    numeric_level = level_number(log_level)
+    file_level = level_number(logfile_level)
 
     # configure the log files locations
     if log_filename:
@@ -59,9 +192,9 @@ def setup_logging(log_level: str, log_filename: Path, folder: Path):
         log_file = folder / "gphotos.log"
     trace_file = log_file.with_suffix(".trace")
 
-    # define handler for the trace file
+    # define handler for the log file
     log_handler = logging.FileHandler(log_file, mode="w")
-    log_handler.setLevel(logging.DEBUG)
+    log_handler.setLevel(file_level)
 
     # define handler for the trace file
     trace_handler = logging.FileHandler(trace_file, mode="w")
@@ -92,11 +225,16 @@ def setup_logging(log_level: str, log_filename: Path, folder: Path):
     stdout_handler.setFormatter(formatter)
     stderr_handler.setFormatter(formatter)
 
-    # add the handlers to the root logger
-    logging.getLogger().addHandler(stdout_handler)
-    logging.getLogger().addHandler(stderr_handler)
-    logging.getLogger().addHandler(log_handler)
-    logging.getLogger().addHandler(trace_handler)
-    # set logging level for root logger
-    # always do debug for the log file, drop to trace if requested
-    logging.getLogger().setLevel(min(numeric_level, logging.DEBUG))
+    # the root logger only feeds the queue, the listener thread writes
+    # to the real handlers
+    handlers = [stdout_handler, stderr_handler, log_handler, trace_handler]
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    listener = LogQueueListener(queue_handler, *handlers)
+    logging.getLogger().addHandler(queue_handler)
+    # set logging level for root logger to the most verbose of the console
+    # and the log file so that other records are discarded by the caller
+    # without being formatted
+    logging.getLogger().setLevel(min(numeric_level, file_level))
+    listener.start()
+    _listener = listener
+    return listener
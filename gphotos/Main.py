@@ -2,27 +2,28 @@
 import logging
 import os
 import sys
-from argparse import Namespace, ArgumentParser
+from argparse import Namespace, ArgumentParser, ArgumentTypeError
 from datetime import datetime
 from pathlib import Path
-
-import pkg_resources
-from appdirs import AppDirs
-from pkg_resources import DistributionNotFound
+from typing import List, Optional, TYPE_CHECKING
 
 from gphotos import Checks
+from gphotos import BandwidthLimiter
 from gphotos import Utils
-from gphotos.GoogleAlbumsSync import GoogleAlbumsSync
-from gphotos.GooglePhotosDownload import GooglePhotosDownload
-from gphotos.GooglePhotosIndex import GooglePhotosIndex
 from gphotos.LocalData import LocalData
-from gphotos.LocalFilesScan import LocalFilesScan
-from gphotos.Settings import Settings
-from gphotos.authorize import Authorize
-from gphotos.restclient import RestClient
 from gphotos.Logging import setup_logging
 
-__version__ = pkg_resources.require("gphotos-sync")[0].version
+# the sync subsystems and their dependencies (requests, exif etc.) are
+# imported in setup() so that --help and argument errors are quick
+if TYPE_CHECKING:
+    from gphotos.GoogleAlbumsSync import GoogleAlbumsSync
+    from gphotos.GooglePhotosDownload import GooglePhotosDownload
+    from gphotos.GooglePhotosIndex import GooglePhotosIndex
+    from gphotos.LocalFilesScan import LocalFilesScan
+    from gphotos.Logging import LogQueueListener
+    from gphotos.MetricsServer import MetricsServer
+    from gphotos.authorize import Authorize
+    from gphotos.restclient import RestClient
 
 if os.name != "nt":
     import fcntl
@@ -31,26 +32,72 @@ APP_NAME = "gphotos-sync"
 log = logging.getLogger(__name__)
 
 
+def get_version() -> Optional[str]:
+    """ the installed version of gphotos-sync or None if it is not
+    installed (e.g. under unit tests) """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # python < 3.8, fall back to the much slower pkg_resources
+        import pkg_resources
+
+        try:
+            return pkg_resources.require(APP_NAME)[0].version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return version(APP_NAME)
+    except PackageNotFoundError:
+        return None
+
+
+__version__ = get_version()
+
+
+def download_order(value: str) -> List[str]:
+    order = [o.strip() for o in value.split(",") if o.strip()]
+    for o in order:
+        if o not in LocalData.DOWNLOAD_ORDERS:
+            raise ArgumentTypeError(
+                "invalid download order '{}', choose from {}".format(
+                    o, ", ".join(LocalData.DOWNLOAD_ORDERS)
+                )
+            )
+    return order
+
+
+def bandwidth(value: str) -> int:
+    try:
+        return BandwidthLimiter.parse_rate(value)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def bandwidth_schedule(value: str) -> List[BandwidthLimiter.BandwidthWindow]:
+    try:
+        return BandwidthLimiter.parse_schedule(value)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
 class GooglePhotosSyncMain:
     def __init__(self):
         self.data_store: LocalData = None
-        self.google_photos_client: RestClient = None
-        self.google_photos_idx: GooglePhotosIndex = None
-        self.google_photos_down: GooglePhotosDownload = None
-        self.google_albums_sync: GoogleAlbumsSync = None
-        self.local_files_scan: LocalFilesScan = None
+        self.google_photos_client: "RestClient" = None
+        self.google_photos_idx: "GooglePhotosIndex" = None
+        self.google_photos_down: "GooglePhotosDownload" = None
+        self.google_albums_sync: "GoogleAlbumsSync" = None
+        self.local_files_scan: "LocalFilesScan" = None
         self._start_date = None
         self._end_date = None
 
-        self.auth: Authorize = None
+        self.auth: "Authorize" = None
 
-    try:
+    if __version__:
         version_string = "version: {}, database schema version {}".format(
             __version__, LocalData.VERSION
         )
-    except TypeError:
-        version_string = "(version not available)"
-    except DistributionNotFound:
+    else:
         version_string = "(version not available under unit tests)"
 
     parser = ArgumentParser(
@@ -78,11 +125,38 @@ class GooglePhotosSyncMain:
         "If a directory is specified then a unique filename will be"
         "generated.",
     )
+    parser.add_argument(
+        "--logfile-level",
+        help="Set the log level for the logfile. Same options as --log-level, "
+        "default: debug",
+        default="debug",
+    )
     parser.add_argument(
         "--compare-folder",
         action="store",
         help="root of the local folders to compare to the Photos Library",
     )
+    parser.add_argument(
+        "--compare-similar",
+        action="store_true",
+        help="when comparing, also match local images that look the same as "
+        "a downloaded library image, e.g. resized or re-encoded copies. "
+        "Requires Pillow and numpy",
+    )
+    parser.add_argument(
+        "--compare-content",
+        action="store_true",
+        help="when comparing, first match local files whose contents are "
+        "identical to a downloaded library file. Only files that are the same "
+        "size as a file in the library are read",
+    )
+    parser.add_argument(
+        "--compare-report",
+        action="store",
+        help="write the results of the comparison to this file instead of "
+        "creating the comparison folder. The file is CSV if its name ends "
+        "in .csv, otherwise one JSON object per line",
+    )
     parser.add_argument(
         "--favourites-only",
         action="store_true",
@@ -179,6 +253,12 @@ class GooglePhotosSyncMain:
         Must be used with --flush-index since the deleted items must be removed
         from the index""",
     )
+    parser.add_argument(
+        "--list-deleted",
+        action="store_true",
+        help="list the local copies of files that were deleted, i.e. the files "
+        "that --do-delete would remove, without removing them",
+    )
     parser.add_argument(
         "--skip-files",
         action="store_true",
@@ -212,10 +292,41 @@ class GooglePhotosSyncMain:
     parser.add_argument(
         "--max-threads",
         help="Set the number of concurrent threads to use for parallel "
-        "download of media - reduce this number if network load is "
-        "excessive",
+        "download of media and indexing of albums - reduce this number if "
+        "network load is excessive",
         default=20,
     )
+    parser.add_argument(
+        "--durable-downloads",
+        action="store_true",
+        help="flush downloaded files to disk (in batches) before marking them "
+        "as downloaded in the index. Protects the index against power loss "
+        "at a small cost in download speed",
+    )
+    parser.add_argument(
+        "--download-order",
+        type=download_order,
+        default=[],
+        help="comma separated priorities for the order of downloads. "
+        "'favourites' and 'albums' download favourites or files in albums "
+        "first, 'newest' downloads the most recent files first. "
+        "e.g. --download-order favourites,newest",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        type=bandwidth,
+        default=0,
+        help="limit the total download rate in bytes per second, K, M and G "
+        "suffixes are allowed e.g. 5M. Default is unlimited",
+    )
+    parser.add_argument(
+        "--bandwidth-schedule",
+        type=bandwidth_schedule,
+        default=[],
+        help="comma separated download rate limits for times of day, outside "
+        "of these times --max-bandwidth applies. "
+        "e.g. 5M@08:00-18:00,20M@18:00-23:00",
+    )
     parser.add_argument(
         "--secret",
         help="Path to client secret file (by default this is in the "
@@ -231,9 +342,33 @@ class GooglePhotosSyncMain:
         action="store_true",
         help="show progress of indexing and downloading in warning log",
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics for the run on "
+        "http://<metrics-address>:PORT/metrics",
+    )
+    parser.add_argument(
+        "--metrics-address",
+        default="127.0.0.1",
+        help="address to serve metrics on, default: 127.0.0.1",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        action="store",
+        help="write Prometheus metrics to this file at the end of the run, "
+        "for the node exporter textfile collector (use a .prom suffix)",
+    )
     parser.add_help = True
 
     def setup(self, args: Namespace, db_path: Path):
+        from appdirs import AppDirs
+        from gphotos.GoogleAlbumsSync import GoogleAlbumsSync
+        from gphotos.GooglePhotosIndex import GooglePhotosIndex
+        from gphotos.Settings import Settings
+        from gphotos.authorize import Authorize
+        from gphotos.restclient import RestClient
+
         root_folder = Path(args.root_folder).absolute()
 
         compare_folder = None
@@ -242,6 +377,7 @@ class GooglePhotosSyncMain:
         app_dirs = AppDirs(APP_NAME)
 
         self.data_store = LocalData(db_path, args.flush_index)
+        args = self.fs_checks(root_folder, args)
 
         credentials_file = db_path / ".gphotos.token"
         if args.secret:
@@ -282,6 +418,10 @@ class GooglePhotosSyncMain:
             use_flat_path=args.use_flat_path,
             max_retries=int(args.max_retries),
             max_threads=int(args.max_threads),
+            durable_downloads=args.durable_downloads,
+            download_order=args.download_order,
+            max_bandwidth=args.max_bandwidth,
+            bandwidth_schedule=args.bandwidth_schedule,
             omit_album_date=args.omit_album_date,
             use_hardlinks=args.use_hardlinks,
             progress=args.progress,
@@ -291,9 +431,12 @@ class GooglePhotosSyncMain:
         self.google_photos_idx = GooglePhotosIndex(
             self.google_photos_client, root_folder, self.data_store, settings
         )
-        self.google_photos_down = GooglePhotosDownload(
-            self.google_photos_client, root_folder, self.data_store, settings
-        )
+        if not args.index_only:
+            from gphotos.GooglePhotosDownload import GooglePhotosDownload
+
+            self.google_photos_down = GooglePhotosDownload(
+                self.google_photos_client, root_folder, self.data_store, settings
+            )
         self.google_albums_sync = GoogleAlbumsSync(
             self.google_photos_client,
             root_folder,
@@ -302,8 +445,18 @@ class GooglePhotosSyncMain:
             settings,
         )
         if args.compare_folder:
+            from gphotos.LocalFilesScan import LocalFilesScan
+
+            compare_report = None
+            if args.compare_report:
+                compare_report = Path(args.compare_report).absolute()
             self.local_files_scan = LocalFilesScan(
-                root_folder, compare_folder, self.data_store
+                root_folder,
+                compare_folder,
+                self.data_store,
+                match_similar=args.compare_similar,
+                match_content=args.compare_content,
+                report=compare_report,
             )
 
     def do_sync(self, args: Namespace):
@@ -312,6 +465,8 @@ class GooglePhotosSyncMain:
             if not args.skip_index:
                 if not args.skip_files and not args.album:
                     new_files = self.google_photos_idx.index_photos_media()
+                    if "favourites" in args.download_order and not args.favourites_only:
+                        self.google_photos_idx.index_favourites()
             # if there are no new files and no arguments that specify specific
             # scan requirements, then we have done all we need to do
             if (
@@ -328,8 +483,10 @@ class GooglePhotosSyncMain:
                         self.google_photos_down.download_photo_media()
                     if not args.skip_albums:
                         self.google_albums_sync.create_album_content_links()
-                    if args.do_delete:
-                        self.google_photos_idx.check_for_removed()
+                    if args.do_delete or args.list_deleted:
+                        self.google_photos_idx.check_for_removed(
+                            dry_run=not args.do_delete
+                        )
 
             if args.compare_folder:
                 if not args.skip_index:
@@ -340,25 +497,76 @@ class GooglePhotosSyncMain:
     def start(self, args: Namespace):
         self.do_sync(args)
 
-    @staticmethod
-    def fs_checks(root_folder: Path, args: dict):
-        Utils.minimum_date(root_folder)
-        Checks.checkFilesystem(root_folder)
-        Checks.get_max_path_length(root_folder)
-        Checks.get_max_filename_length(root_folder)
-        Checks.unicode_filenames(root_folder)
+    def fs_checks(self, root_folder: Path, args: Namespace) -> Namespace:
+        # the results of probing the filesystem are kept in the database and
+        # only probed again if a different filesystem is mounted
+        fs_id = Checks.filesystem_id(root_folder)
+        probes = self.data_store.get_fs_probes(fs_id)
+        if probes:
+            log.debug("using saved filesystem checks for %s", fs_id)
+            Checks.restore_filesystem(probes)
+        else:
+            probes = Checks.probe_filesystem(root_folder)
+            self.data_store.put_fs_probes(fs_id, probes)
 
         # check if symlinks are supported
-        if not Checks.symlinks_supported(root_folder):
+        if not probes["symlinks"]:
+            log.error("Albums are not going to be synced - requires symlinks")
             args.skip_albums = True
 
         # check if file system is case sensitive
         if not args.case_insensitive_fs:
-            if not Checks.is_case_sensitive(root_folder):
+            if not probes["case_sensitive"]:
                 args.case_insensitive_fs = True
 
         return args
 
+    @staticmethod
+    def start_metrics(
+        args: Namespace, log_listener: "LogQueueListener"
+    ) -> Optional["MetricsServer"]:
+        """ start the metrics endpoint if requested """
+        if args.metrics_port is None and not args.metrics_textfile:
+            return None
+        from gphotos import Metrics
+        from gphotos.MetricsServer import MetricsServer
+
+        Metrics.LOG_QUEUE.set_function(log_listener.queue.qsize)
+        if args.metrics_port is None:
+            return None
+        try:
+            return MetricsServer(args.metrics_address, args.metrics_port).start()
+        except OSError:
+            log.error("Could not serve metrics on port %d", args.metrics_port)
+            log.debug("Traceback", exc_info=True)
+            return None
+
+    @staticmethod
+    def stop_metrics(
+        args: Namespace,
+        metrics_server: Optional["MetricsServer"],
+        start_time: datetime,
+        success: bool,
+    ):
+        """ record the run summary, write the metrics textfile if requested
+        and stop the metrics endpoint """
+        if args.metrics_port is None and not args.metrics_textfile:
+            return
+        from gphotos import Metrics
+
+        end_time = datetime.now()
+        Metrics.RUN_SECONDS.set((end_time - start_time).total_seconds())
+        Metrics.LAST_RUN.set(end_time.timestamp())
+        Metrics.LAST_RUN_SUCCESS.set(int(success))
+        if args.metrics_textfile:
+            try:
+                Metrics.REGISTRY.write_textfile(Path(args.metrics_textfile))
+            except OSError:
+                log.error("Could not write metrics to %s", args.metrics_textfile)
+                log.debug("Traceback", exc_info=True)
+        if metrics_server:
+            metrics_server.shutdown()
+
     def main(self, test_args: dict = None):
         start_time = datetime.now()
         args = self.parser.parse_args(test_args)
@@ -368,37 +576,44 @@ class GooglePhotosSyncMain:
         if not root_folder.exists():
             root_folder.mkdir(parents=True, mode=0o700)
 
-        setup_logging(args.log_level, args.logfile, root_folder)
-
-        args = self.fs_checks(root_folder, args)
-
-        lock_file = db_path / "gphotos.lock"
-        fp = lock_file.open("w")
-        with fp:
-            try:
-                if os.name != "nt":
-                    fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            except IOError:
-                log.warning("EXITING: database is locked")
-                sys.exit(0)
-
-            log.info(self.version_string)
-
-            # configure and launch
-            # noinspection PyBroadException
-            try:
-                self.setup(args, db_path)
-                self.start(args)
-            except KeyboardInterrupt:
-                log.error("User cancelled download")
-                log.debug("Traceback", exc_info=True)
-            except BaseException:
-                log.error("\nProcess failed.", exc_info=True)
-            finally:
-                log.warning("Done.")
-
-        elapsed_time = datetime.now() - start_time
-        log.info("Elapsed time = %s", elapsed_time)
+        log_listener = setup_logging(
+            args.log_level, args.logfile, root_folder, args.logfile_level
+        )
+        try:
+            lock_file = db_path / "gphotos.lock"
+            fp = lock_file.open("w")
+            with fp:
+                try:
+                    if os.name != "nt":
+                        fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    log.warning("EXITING: database is locked")
+                    sys.exit(0)
+
+                log.info(self.version_string)
+                metrics_server = self.start_metrics(args, log_listener)
+
+                # configure and launch
+                # noinspection PyBroadException
+                success = False
+                try:
+                    self.setup(args, db_path)
+                    self.start(args)
+                    success = True
+                except KeyboardInterrupt:
+                    log.error("User cancelled download")
+                    log.debug("Traceback", exc_info=True)
+                except BaseException:
+                    log.error("\nProcess failed.", exc_info=True)
+                finally:
+                    log.warning("Done.")
+                    self.stop_metrics(args, metrics_server, start_time, success)
+
+            elapsed_time = datetime.now() - start_time
+            log.info("Elapsed time = %s", elapsed_time)
+        finally:
+            # write out any queued log messages
+            log_listener.stop()
 
 
 def main():
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""
+Counters, gauges and histograms describing a sync run, rendered in the
+Prometheus text exposition format. They can be scraped from a local HTTP
+endpoint while gphotos-sync runs (see MetricsServer) or written to a file
+for the node exporter textfile collector at the end of a run.
+"""
+
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", r"\\").replace("\n", r"\n")
+        pairs.append('{}="{}"'.format(name, value.replace('"', r"\"")))
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """ base class for a family of samples that share a name and label
+    names. Updates are thread safe """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def check_labels(self, labels: LabelValues):
+        if len(labels) != len(self.label_names):
+            raise ValueError(
+                "{} expects labels {}, got {}".format(
+                    self.name, self.label_names, labels
+                )
+            )
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """ yield (name, labels, value) for every sample of this metric """
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, format_labels(self.label_names, labels), value
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """ a total that only goes up """
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.check_labels(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """ a value that can go up and down. Unlabelled gauges can instead take
+    their value from a function that is called whenever they are rendered """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._function: Callable[[], float] = None
+
+    def set(self, value: float, *labels: str):
+        self.check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, function: Callable[[], float]):
+        self.check_labels(())
+        self._function = function
+
+    def reset(self):
+        super().reset()
+        self._function = None
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        if self._function:
+            self.set(self._function())
+        return super().samples()
+
+
+class Histogram(Metric):
+    """ counts observations (e.g. durations) in buckets and keeps their sum """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # bucket counts (not cumulative), the sum and count of observations
+        self._observations: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        self.check_labels(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._observations.get(labels)
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 2)
+                self._observations[labels] = counts
+            counts[bucket] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        """ observe the time taken by the body of a with statement """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def reset(self):
+        with self._lock:
+            self._observations.clear()
+
+    def get(self, *labels: str) -> float:
+        """ the number of observations """
+        return self._observations.get(labels, [0])[-1]
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            observations = sorted(
+                (labels, list(counts)) for labels, counts in self._observations.items()
+            )
+        names = self.label_names + ("le",)
+        for labels, counts in observations:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(names, labels + (format_value(bound),))
+                yield self.name + "_bucket", bucket_labels, cumulative
+            label_text = format_labels(self.label_names, labels)
+            yield self.name + "_sum", label_text, counts[-2]
+            yield self.name + "_count", label_text, counts[-1]
+
+
+class Registry:
+    """ the set of metrics that are exported together """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str, labels=()) -> Counter:
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels=()) -> Gauge:
+        return self.register(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels=(), **kwargs) -> Histogram:
+        return self.register(Histogram(name, description, labels, **kwargs))
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path):
+        """ write the metrics to path for the node exporter textfile
+        collector. The file is replaced atomically so that the collector
+        never reads a partial file """
+        fd, temp_name = tempfile.mkstemp(dir=str(path.parent), prefix=".gphotos")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.chmod(temp_name, 0o644)
+            os.replace(temp_name, str(path))
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+
+REGISTRY = Registry()
+
+API_SECONDS = REGISTRY.histogram(
+    "gphotos_api_request_seconds", "Google Photos API call latency", ["method"]
+)
+API_REQUESTS = REGISTRY.counter(
+    "gphotos_api_requests_total",
+    "Google Photos API calls by HTTP status ('error' if no response)",
+    ["method", "status"],
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "gphotos_download_bytes_total", "Bytes of media downloaded"
+)
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    "gphotos_download_seconds",
+    "Time to download a single media item",
+    ["type"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+DOWNLOADS = REGISTRY.counter(
+    "gphotos_downloads_total", "Media items by download result", ["result"]
+)
+DOWNLOADS_IN_FLIGHT = REGISTRY.gauge(
+    "gphotos_downloads_in_flight", "Downloads queued or running in the thread pool"
+)
+LOG_QUEUE = REGISTRY.gauge(
+    "gphotos_log_queue_depth", "Log records waiting to be written"
+)
+DB_COMMIT_SECONDS = REGISTRY.histogram(
+    "gphotos_db_commit_seconds", "Time to commit the SQLite database"
+)
+ITEMS_INDEXED = REGISTRY.counter(
+    "gphotos_items_indexed_total", "Library items listed by the index", ["result"]
+)
+RUN_SECONDS = REGISTRY.gauge(
+    "gphotos_run_seconds", "Duration of the last gphotos-sync run"
+)
+LAST_RUN = REGISTRY.gauge(
+    "gphotos_last_run_timestamp_seconds", "Time the last gphotos-sync run ended"
+)
+LAST_RUN_SUCCESS = REGISTRY.gauge(
+    "gphotos_last_run_success", "1 if the last gphotos-sync run completed"
+)
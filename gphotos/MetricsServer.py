@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""
+A local HTTP endpoint for scraping the metrics. Kept apart from Metrics so
+that http.server is only imported when the endpoint is requested.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .Metrics import REGISTRY, Registry
+import logging
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_string, *args):
+        log.debug(
+            "metrics request from %s: " + format_string, self.address_string(), *args
+        )
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """ serves the metrics on http://address:port/metrics from a daemon
+    thread until shutdown() is called """
+
+    daemon_threads = True
+
+    def __init__(self, address: str, port: int, registry: Registry = REGISTRY):
+        handler = type("Handler", (MetricsHandler,), {"registry": registry})
+        super().__init__((address, port), handler)
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="metrics", daemon=True
+        )
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        log.info("serving metrics on http://%s:%d/metrics", *self.server_address[:2])
+        return self
+
+    def shutdown(self):
+        super().shutdown()
+        self.server_close()
@@ -1,5 +1,7 @@
 from datetime import datetime
 from pathlib import Path
+from typing import List
+from gphotos.BandwidthLimiter import BandwidthWindow
 from attr import dataclass
 
 
@@ -27,5 +29,9 @@ class Settings:
     rescan: bool
     max_retries: int
     max_threads: int
+    durable_downloads: bool
+    download_order: List[str]
+    max_bandwidth: int
+    bandwidth_schedule: List[BandwidthWindow]
     case_insensitive_fs: bool
     progress: bool
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""
+Perceptual hashing of images, used to find local files that are resized or
+re-encoded copies of photos in the library. The hash is the sign of the low
+frequency DCT coefficients of a small greyscale thumbnail relative to their
+median, so visually similar images have hashes a small Hamming distance apart.
+Requires Pillow and numpy (pip install gphotos-sync[similar]).
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import Logging
+from . import Utils
+from .LocalData import LocalData
+import logging
+
+try:
+    import numpy
+    from PIL import Image
+
+    _have_imaging = True
+except ImportError:
+    numpy, Image = None, None
+    _have_imaging = False
+
+log = logging.getLogger(__name__)
+
+# size of the greyscale thumbnail that is transformed
+SAMPLE_SIZE = 32
+# the hash is made from HASH_SIZE x HASH_SIZE low frequency coefficients
+HASH_SIZE = 8
+# images whose hashes differ in at most this many bits are similar
+MAX_DISTANCE = 6
+# number of files passed to a hashing worker process at a time
+HASH_CHUNK = 32
+# chunks queued per worker process
+HASH_PENDING = 4
+
+
+def dct_matrix(size: int, rows: int):
+    """ the first rows of the (unscaled) DCT-II matrix for size samples """
+    k = numpy.arange(rows)[:, None]
+    n = numpy.arange(size)[None, :]
+    return numpy.cos(numpy.pi * (2 * n + 1) * k / (2 * size))
+
+
+def thumbnail(path: str):
+    """ a SAMPLE_SIZE square greyscale thumbnail of an image or None if it
+    cannot be read """
+    try:
+        with Image.open(path) as image:
+            # let the JPEG decoder scale the image down while decoding
+            image.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))
+            image = image.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.LANCZOS)
+            return numpy.asarray(image, dtype=numpy.float64)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        log.debug("cannot hash image %s", path)
+        return None
+
+
+def image_hashes(paths: List[str]) -> List[Optional[int]]:
+    """ the perceptual hashes of a chunk of images, runs in a worker process.
+    The DCTs of all the images in the chunk are calculated together """
+    thumbs = [thumbnail(path) for path in paths]
+    good = [thumb for thumb in thumbs if thumb is not None]
+    hashes: List[Optional[int]] = [None] * len(paths)
+    if not good:
+        return hashes
+
+    dct = dct_matrix(SAMPLE_SIZE, HASH_SIZE)
+    low = (dct @ numpy.stack(good) @ dct.T).reshape(len(good), -1)
+    # the DC term is excluded from the median as it is much larger
+    median = numpy.median(low[:, 1:], axis=1, keepdims=True)
+    packed = numpy.packbits(low > median, axis=1)
+
+    values = iter(int.from_bytes(row.tobytes(), "big") for row in packed)
+    for i, thumb in enumerate(thumbs):
+        if thumb is not None:
+            hashes[i] = next(values)
+    return hashes
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """ a Burkhard-Keller tree of hashes, for finding all the hashes within
+    a given Hamming distance of another without comparing against them all.
+    Each node is [hash, items, {distance: child}] """
+
+    def __init__(self):
+        self._root: Optional[list] = None
+
+    def add(self, value: int, item: Any):
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """ all (distance, item) within max_distance of value, nearest
+        first """
+        results = []
+        nodes = [self._root] if self._root else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # by the triangle inequality only these subtrees can hold matches
+            for child_distance, child in node[2].items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        return sorted(results)
+
+
+class SimilarImages:
+    """ Matches local image files that the other LocalMatcher stages could not
+    match with downloaded library images that look the same.
+
+    Hashes are cached in the ImageHashes table along with the size and
+    modification time of the file, so only new or changed images are hashed
+    on subsequent runs.
+    """
+
+    def __init__(self, root_folder: Path, db: LocalData):
+        self._root_folder = root_folder
+        self._db = db
+
+    def match(self) -> int:
+        """ record matches for unmatched local images in LocalFiles and
+        return the number of matches made """
+        local = [
+            (local_id, str(Path(path) / file_name))
+            for local_id, path, file_name in self._db.get_unmatched_local_images()
+        ]
+        library = [
+            (remote_id, str(self._root_folder / path / file_name))
+            for remote_id, path, file_name in self._db.get_unmatched_library_images()
+        ]
+        hashes = self.get_hashes([path for _, path in local + library])
+
+        tree = BKTree()
+        for index, (remote_id, path) in enumerate(library):
+            if hashes.get(path) is not None:
+                tree.add(hashes[path], (index, remote_id))
+
+        # each library item matches at most one local file, the nearest
+        # unused one wins
+        used: Set[str] = set()
+        matches = []
+        for local_id, path in local:
+            if hashes.get(path) is None:
+                continue
+            for _, (_, remote_id) in tree.search(hashes[path], MAX_DISTANCE):
+                if remote_id not in used:
+                    used.add(remote_id)
+                    matches.append((remote_id, local_id))
+                    break
+        self._db.put_local_matches(matches)
+        return len(matches)
+
+    def get_hashes(self, paths: List[str]) -> Dict[str, Optional[int]]:
+        """ the hashes of a list of image files, from the cache or calculated
+        in a process pool """
+        cached = self._db.get_image_hashes()
+        hashes: Dict[str, Optional[int]] = {}
+        todo = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if cached.get(path, (None, None, None))[:2] == key:
+                hashes[path] = cached[path][2]
+            else:
+                todo.append((path,) + key)
+
+        if not todo:
+            return hashes
+        if not _have_imaging:
+            log.warning(
+                "%d images cannot be compared, install Pillow and numpy", len(todo)
+            )
+            return hashes
+
+        log.warning("calculating perceptual hashes of %d images ...", len(todo))
+        workers = os.cpu_count() or 1
+        chunks = list(Utils.chunks(todo, HASH_CHUNK))
+        with Logging.process_pool(workers) as pool:
+            results = Utils.pool_map(
+                pool,
+                image_hashes,
+                ([path for path, _, _ in chunk] for chunk in chunks),
+                workers * HASH_PENDING,
+            )
+            for chunk, chunk_hashes in zip(chunks, results):
+                rows = [
+                    (path, size, mtime, image_hash)
+                    for (path, size, mtime), image_hash in zip(chunk, chunk_hashes)
+                ]
+                self._db.put_image_hashes(rows)
+                hashes.update((row[0], row[3]) for row in rows)
+        return hashes
@@ -1,6 +1,10 @@
+from collections import deque
+from concurrent.futures import Executor
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from typing import Any, Callable, Iterable, Iterator, List
 from os import utime
 import re
 
@@ -88,3 +92,28 @@ def string_to_date(date_string: str) -> datetime:
             log.warning("WARNING: time string %s illegal", date_string)
 
     return result
+
+
+def chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    """ split an iterable into lists of up to size items """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def pool_map(
+    executor: Executor, function: Callable, items: Iterable, max_pending: int
+) -> Iterator[Any]:
+    """ like executor.map but consumes items lazily, keeping at most
+    max_pending calls outstanding, so that a huge or slow to generate
+    iterable does not have to be read into memory first.
+    Results are yielded in the same order as items """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
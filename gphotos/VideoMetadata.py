@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""
+Extraction of the creation date of local video files. The date is read
+directly from the 'mvhd' atom of MP4/MOV (ISO base media) files and only
+other formats fall back to an ffprobe subprocess. Results are cached for the
+life of the process, keyed by path, size and modification time.
+"""
+
+import concurrent.futures as futures
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from json import loads
+from pathlib import Path
+from subprocess import run, CalledProcessError, PIPE
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+from . import Utils
+import logging
+
+log = logging.getLogger(__name__)
+
+# command to extract creation date from video files
+FF_PROBE = [
+    "ffprobe",
+    "-v",
+    "quiet",
+    "-print_format",
+    "json",
+    "-show_entries",
+    "stream=index,codec_type:stream_tags=creation_time:format_" "tags=creation_time",
+]
+
+# file types that are ISO base media files with a 'moov' atom
+MP4_SUFFIXES = {".mp4", ".m4v", ".mov", ".qt", ".3gp", ".3g2"}
+# mvhd times are seconds since midnight, January 1, 1904 UTC
+MP4_EPOCH = datetime(1904, 1, 1)
+# some writers store seconds since 1970 instead. Like ffprobe, treat times
+# before 1970 in the MP4 epoch as seconds since 1970
+UNIX_EPOCH = datetime(1970, 1, 1)
+UNIX_EPOCH_MP4_SECONDS = int((UNIX_EPOCH - MP4_EPOCH).total_seconds())
+# stop looking for the moov atom after this many top level atoms
+MP4_MAX_ATOMS = 64
+
+# the most ffprobe subprocesses to run at once (per process)
+MAX_PROBES = 4
+
+_cache: Dict[Tuple[str, int, int], Optional[datetime]] = {}
+_cache_lock = threading.Lock()
+_probe_slots = threading.BoundedSemaphore(MAX_PROBES)
+_ffprobe_installed: Optional[bool] = None
+
+
+def ffprobe_installed() -> bool:
+    """ look for ffprobe on the path, only once per process """
+    global _ffprobe_installed
+    if _ffprobe_installed is None:
+        _ffprobe_installed = shutil.which(FF_PROBE[0]) is not None
+        if not _ffprobe_installed:
+            log.info("ffprobe is not installed, video dates may be inaccurate")
+    return _ffprobe_installed
+
+
+def find_atom(
+    f: BinaryIO, start: int, end: int, kind: bytes
+) -> Optional[Tuple[int, int]]:
+    """ find an atom of type kind between offsets start and end of an
+    ISO base media file and return the offsets of its contents """
+    offset = start
+    for _ in range(MP4_MAX_ATOMS):
+        if offset + 8 > end:
+            break
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        size = int.from_bytes(header[:4], "big")
+        content = offset + 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), "big")
+            content += 8
+        elif size == 0:
+            # the atom extends to the end of the file
+            size = end - offset
+        if size < content - offset:
+            break
+        if header[4:] == kind:
+            return content, min(offset + size, end)
+        offset += size
+    return None
+
+
+def mvhd_creation_time(path: Path) -> Optional[datetime]:
+    """ read the creation time from the movie header ('mvhd') atom of an
+    MP4/MOV file. Returns None if there is no usable creation time """
+    try:
+        with path.open("rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            moov = find_atom(f, 0, end, b"moov")
+            mvhd = find_atom(f, *moov, b"mvhd") if moov else None
+            if not mvhd:
+                return None
+            f.seek(mvhd[0])
+            version = f.read(4)[:1]
+            if version == b"\x01":
+                created = int.from_bytes(f.read(8), "big")
+            else:
+                created = int.from_bytes(f.read(4), "big")
+    except OSError:
+        return None
+    if not created:
+        return None
+    if created < UNIX_EPOCH_MP4_SECONDS:
+        return UNIX_EPOCH + timedelta(seconds=created)
+    return MP4_EPOCH + timedelta(seconds=created)
+
+
+def ffprobe_creation_time(path: Path) -> Optional[datetime]:
+    global _ffprobe_installed
+    if not ffprobe_installed():
+        return None
+    try:
+        with _probe_slots:
+            result = run(FF_PROBE + [str(path)], stdout=PIPE, check=True)
+        json = loads(str(result.stdout.decode("utf-8")))
+        return Utils.string_to_date(json["format"]["tags"]["creation_time"])
+    except FileNotFoundError:
+        # ffprobe has been removed since it was detected
+        _ffprobe_installed = False
+    except CalledProcessError:
+        pass
+    except KeyError:
+        # ffprobe worked but there is no creation time in the JSON
+        pass
+    return None
+
+
+def creation_time(path: Path) -> Optional[datetime]:
+    """ the creation time recorded in a video file's metadata, or None """
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+
+    created = None
+    if path.suffix.lower() in MP4_SUFFIXES:
+        created = mvhd_creation_time(path)
+    if created is None:
+        created = ffprobe_creation_time(path)
+
+    with _cache_lock:
+        _cache[key] = created
+    return created
+
+
+def prefetch(paths: Iterable[Path]):
+    """ extract the creation times of a batch of videos concurrently so that
+    subsequent calls to creation_time are served from the cache """
+    paths = list(paths)
+    if len(paths) > 1:
+        with futures.ThreadPoolExecutor(max_workers=MAX_PROBES) as pool:
+            # errors are ignored here, they are raised by the later call
+            futures.wait([pool.submit(creation_time, path) for path in paths])
@@ -1,3 +1,5 @@
+import threading
+
 from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
 from pathlib import Path
@@ -15,6 +17,30 @@ authorization_base_url = "https://accounts.google.com/o/oauth2/v2/auth"
 token_uri = "https://www.googleapis.com/oauth2/v4/token"
 
 
+class SharedOAuth2Session(OAuth2Session):
+    """ An OAuth2Session that can be shared between threads (the album
+    indexing threads all use the same session). When the token expires only
+    the first thread refreshes it, the others wait and then use the new token.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._refresh_lock = threading.Lock()
+        # the access token that each thread sent with its last request
+        self._sent = threading.local()
+
+    def request(self, *args, **kwargs):
+        self._sent.access_token = self.access_token
+        return super().request(*args, **kwargs)
+
+    def refresh_token(self, token_url, **kwargs):
+        with self._refresh_lock:
+            if self.access_token != getattr(self._sent, "access_token", None):
+                # another thread refreshed the token while this one waited
+                return self.token
+            return super().refresh_token(token_url, **kwargs)
+
+
 class Authorize:
     def __init__(
         self,
@@ -40,6 +66,7 @@ class Authorize:
         self.token_file: Path = token_file
         self.session = None
         self.token = None
+        self._token_lock = threading.Lock()
         try:
             with secrets_file.open("r") as stream:
                 all_json = load(stream)
@@ -66,7 +93,7 @@ class Authorize:
         return token
 
     def save_token(self, token: str):
-        with self.token_file.open("w") as stream:
+        with self._token_lock, self.token_file.open("w") as stream:
             dump(token, stream)
         self.token_file.chmod(0o600)
 
@@ -76,7 +103,7 @@ class Authorize:
         token = self.load_token()
 
         if token:
-            self.session = OAuth2Session(
+            self.session = SharedOAuth2Session(
                 self.client_id,
                 token=token,
                 auto_refresh_url=self.token_uri,
@@ -84,7 +111,7 @@ class Authorize:
                 token_updater=self.save_token,
             )
         else:
-            self.session = OAuth2Session(
+            self.session = SharedOAuth2Session(
                 self.client_id,
                 scope=self.scope,
                 redirect_uri=self.redirect_uri,
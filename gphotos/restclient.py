@@ -1,9 +1,12 @@
 from json import dumps
+from time import perf_counter
 from typing import Dict, List, Union, Any
 from requests import Session
-from requests.exceptions import BaseHTTPError
+from requests.exceptions import BaseHTTPError, RequestException
 import logging
 
+from . import Metrics
+
 JSONValue = Union[str, int, float, bool, None, Dict[str, Any], List[Any]]
 JSONType = Union[Dict[str, JSONValue], List[JSONValue]]
 
@@ -59,6 +62,7 @@ class Method:
     """
 
     def __init__(self, service: RestClient, **k_args: Dict[str, str]):
+        self.id: str = None
         self.path: str = None
         self.httpMethod: str = None
         self.service: RestClient = service
@@ -91,9 +95,17 @@ class Method:
             query_args,
             body,
         )
-        result = self.service.auth_session.request(
-            self.httpMethod, data=body, url=path, timeout=10, params=query_args
-        )
+        start = perf_counter()
+        try:
+            result = self.service.auth_session.request(
+                self.httpMethod, data=body, url=path, timeout=10, params=query_args
+            )
+        except RequestException:
+            Metrics.API_REQUESTS.inc(self.id, "error")
+            raise
+        finally:
+            Metrics.API_SECONDS.observe(perf_counter() - start, self.id)
+        Metrics.API_REQUESTS.inc(self.id, str(result.status_code))
         log.trace("\nRESPONSE: %s\n%s", result.status_code, str(result.content))
 
         try:
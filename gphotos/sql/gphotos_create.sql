@@ -9,7 +9,8 @@ create table Albums
 	StartDate INT,
 	EndDate INT,
 	SyncDate INT,
-  Downloaded INT DEFAULT 0
+  Downloaded INT DEFAULT 0,
+  Fingerprint TEXT
 )
 ;
 DROP INDEX IF EXISTS Albums_RemoteId_uindex;
@@ -41,6 +42,7 @@ create table LocalFiles
 	MimeType TEXT,
 	Description TEXT,
 	FileSize INT,
+	FileMTime INT,
 	ModifyDate INT,
 	CreateDate INT,
 	SyncDate INT
@@ -52,14 +54,36 @@ DROP INDEX IF EXISTS LocalNameIdx;
 DROP INDEX IF EXISTS LocalCreatedIdx;
 DROP INDEX IF EXISTS LocalMatchIdx;
 DROP INDEX IF EXISTS LocalFiles_Path_FileName_DuplicateNo_uindex;
+DROP INDEX IF EXISTS LocalFiles_Path_FileName_uindex;
 create index LocalRemoteIdIdx	on LocalFiles (RemoteId);
 create index LocalUidIdx	on LocalFiles (Uid);
 create index LocalNameIdx  on LocalFiles (FileName);
 create index LocalCreatedIdx  on LocalFiles (CreateDate);
 create index LocalMatchIdx  on LocalFiles (OriginalFileName, DuplicateNo, Description);
+create unique index LocalFiles_Path_FileName_uindex on LocalFiles (Path, FileName);
 create unique index LocalFiles_Path_FileName_DuplicateNo_uindex
  	on LocalFiles (Path, FileName, DuplicateNo);
 
+drop table if exists FileHashes;
+create table FileHashes
+(
+	FullPath TEXT
+		primary key,
+	FileSize INT,
+	FileMTime INT,
+	Hash TEXT
+);
+
+drop table if exists ImageHashes;
+create table ImageHashes
+(
+	FullPath TEXT
+		primary key,
+	FileSize INT,
+	FileMTime INT,
+	Hash TEXT
+);
+
 drop table if exists SyncFiles;
 create table SyncFiles
 (
@@ -79,7 +103,8 @@ create table SyncFiles
 	CreateDate INT,
 	SyncDate INT,
   Downloaded INT DEFAULT 0,
-  Location Text
+  Location Text,
+  Favourite INT DEFAULT 0
 );
 
 DROP INDEX IF EXISTS RemoteIdIdx;
@@ -90,6 +115,7 @@ DROP INDEX IF EXISTS FileSizeAndSizeIdx;
 DROP INDEX IF EXISTS CreatedIdx;
 DROP INDEX IF EXISTS ModifyDateIdx;
 DROP INDEX IF EXISTS SyncMatchIdx;
+DROP INDEX IF EXISTS FavouriteIdx;
 DROP INDEX IF EXISTS SyncFiles_Path_FileName_DuplicateNo_uindex;
 create unique index RemoteIdIdx	on SyncFiles (RemoteId);
 create index FileNameIdx  on SyncFiles (FileName);
@@ -99,6 +125,7 @@ create index FileSizeAndSizeIdx  on SyncFiles (FileName, FileSize);
 create index CreatedIdx  on SyncFiles (CreateDate);
 create index ModifyDateIdx  on SyncFiles (ModifyDate);
 create index SyncMatchIdx  on SyncFiles (OrigFileName, DuplicateNo, Description);
+create index FavouriteIdx  on SyncFiles (Favourite, CreateDate);
 create unique index SyncFiles_Path_FileName_DuplicateNo_uindex
  	on SyncFiles (Path, FileName, DuplicateNo);
 
@@ -108,8 +135,8 @@ create table AlbumFiles
 (
 	Id INTEGER
 		primary key,
-	AlbumRec INT,
-	DriveRec INT,
+	AlbumRec TEXT,
+	DriveRec TEXT,
 	Position INT,
 	foreign key (AlbumRec) references Albums (RemoteId)
 			on delete cascade,
@@ -119,6 +146,29 @@ create table AlbumFiles
 DROP INDEX IF EXISTS AlbumFiles_AlbumRec_DriveRec_uindex;
 create unique index AlbumFiles_AlbumRec_DriveRec_uindex
 	on AlbumFiles (AlbumRec, DriveRec);
+DROP INDEX IF EXISTS AlbumFiles_DriveRec_index;
+create index AlbumFiles_DriveRec_index
+	on AlbumFiles (DriveRec);
+DROP INDEX IF EXISTS AlbumFiles_AlbumRec_Position_index;
+create index AlbumFiles_AlbumRec_Position_index
+	on AlbumFiles (AlbumRec, Position);
+
+drop table if exists DownloadQueue;
+create table DownloadQueue
+(
+	RemoteId TEXT
+		primary key,
+	State INT DEFAULT 0,
+	Url TEXT,
+	UrlExpiry INT,
+	Attempts INT DEFAULT 0,
+	LastError TEXT,
+	NextAttempt INT DEFAULT 0
+)
+;
+DROP INDEX IF EXISTS DownloadQueue_State_index;
+create index DownloadQueue_State_index
+	on DownloadQueue (State);
 
 drop table if exists Globals;
 CREATE TABLE Globals
@@ -127,7 +177,9 @@ CREATE TABLE Globals
   Version TEXT,
   Albums INTEGER,
   Files INTEGER,
-  LastIndex INT -- Date of last sync
+  LastIndex INT, -- Date of last sync
+  FsId TEXT, -- device and mount point of the root folder
+  FsProbes TEXT -- results of filesystem checks on FsId as JSON
 );
 CREATE UNIQUE INDEX Globals_Id_uindex ON Globals (Id);
 
@@ -18,6 +18,12 @@ develop_reqs = [
     "mock",
 ]
 
+# for --compare-similar
+similar_reqs = [
+    "Pillow",
+    "numpy",
+]
+
 if os.name == "nt":
     install_reqs.append("pywin32")
 
@@ -35,7 +41,7 @@ setup(
     entry_points={"console_scripts": ["gphotos-sync = gphotos.Main:main"]},
     long_description=long_description,
     install_requires=install_reqs,
-    extras_require={"dev": develop_reqs},
+    extras_require={"dev": develop_reqs, "similar": similar_reqs},
     package_data={"": ["gphotos/sql/gphotos_create.sql", "LICENSE"]},
     include_package_data=True,
     author="Giles Knap",
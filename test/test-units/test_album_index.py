@@ -0,0 +1,196 @@
+import shutil
+import tempfile
+from pathlib import Path
+from time import sleep
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import pytest
+
+from gphotos.GoogleAlbumsSync import GoogleAlbumsSync
+from gphotos.LocalData import LocalData
+
+from test.test_settings import make_settings
+
+
+class Response:
+    def __init__(self, json):
+        self._json = json
+
+    def json(self):
+        return self._json
+
+
+def media_json(album: int, item: int):
+    return {
+        "id": "media{}-{}".format(album, item),
+        "filename": "photo{}-{}.jpg".format(album, item),
+        "mimeType": "image/jpeg",
+        "mediaMetadata": {"creationTime": "2020-01-{:02d}T00:00:00Z".format(item + 1)},
+    }
+
+
+class FakeApi:
+    """ albums 0..ALBUMS-1 where album n has n + 1 items, returned one item
+    per page. Earlier albums respond more slowly to shuffle completion """
+
+    ALBUMS = 6
+
+    def __init__(self):
+        self.albums = Mock()
+        self.albums.list.execute = self.list_albums
+        self.sharedAlbums = Mock()
+        self.sharedAlbums.list.execute.return_value = Response({})
+        self.mediaItems = Mock()
+        self.mediaItems.search.execute = self.search
+        self.searches = []
+        # albums whose items are returned in reverse order
+        self.reversed = set()
+        # albums with fewer items than usual
+        self.sizes = {}
+
+    def size(self, album: int) -> int:
+        return self.sizes.get(album, album + 1)
+
+    def list_albums(self, pageSize, pageToken=None):
+        return Response(
+            {
+                "albums": [
+                    {
+                        "id": "album{}".format(n),
+                        "title": "Album {}".format(n),
+                        "mediaItemsCount": str(self.size(n)),
+                    }
+                    for n in range(self.ALBUMS)
+                ]
+            }
+        )
+
+    def search(self, body):
+        album = int(body["albumId"][len("album") :])
+        item = int(body["pageToken"] or 0)
+        self.searches.append(album)
+        sleep(0.01 * (self.ALBUMS - album))
+        last = self.size(album) - 1
+        served = last - item if album in self.reversed else item
+        page = {"mediaItems": [media_json(album, served)]}
+        if item < last:
+            page["nextPageToken"] = str(item + 1)
+        return Response(page)
+
+
+class TestAlbumIndex(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.db = LocalData(self.root)
+
+    def tearDown(self):
+        self.db.con.close()
+        shutil.rmtree(str(self.root))
+
+    def album_files(self, album_id: str):
+        self.db.cur.execute(
+            "SELECT DriveRec FROM AlbumFiles WHERE AlbumRec=? ORDER BY Position;",
+            (album_id,),
+        )
+        return [row[0] for row in self.db.cur.fetchall()]
+
+    def test_parallel_index(self):
+        settings = make_settings()
+        settings.max_threads = 3
+        sync = GoogleAlbumsSync(FakeApi(), self.root, self.db, False, settings)
+        sync.index_album_media()
+        self.db.store()
+
+        for n in range(FakeApi.ALBUMS):
+            album_id = "album{}".format(n)
+            self.db.cur.execute(
+                "SELECT AlbumName, StartDate, EndDate FROM Albums WHERE RemoteId=?;",
+                (album_id,),
+            )
+            self.assertEqual(
+                (
+                    "Album {}".format(n),
+                    "2020-01-01 00:00:00",
+                    "2020-01-{:02d} 00:00:00".format(n + 1),
+                ),
+                tuple(self.db.cur.fetchone()),
+            )
+
+            self.db.cur.execute(
+                "SELECT DriveRec, Position FROM AlbumFiles WHERE AlbumRec=? "
+                "ORDER BY Position;",
+                (album_id,),
+            )
+            self.assertEqual(
+                [("media{}-{}".format(n, i), i) for i in range(n + 1)],
+                [tuple(row) for row in self.db.cur.fetchall()],
+            )
+
+        # album files stream in album and position order
+        self.assertEqual(
+            [
+                ("album{}".format(n), "photo{}-{}.jpg".format(n, i))
+                for n in range(FakeApi.ALBUMS)
+                for i in range(n + 1)
+            ],
+            [(row[5], row[1]) for row in self.db.get_album_files(download_again=True)],
+        )
+
+    @patch("gphotos.GoogleAlbumsSync.PAGE_SIZE", 2)
+    def test_album_files_batches(self):
+        put_album_files = Mock(wraps=self.db.put_album_files)
+        self.db.put_album_files = put_album_files
+        sync = GoogleAlbumsSync(FakeApi(), self.root, self.db, False, make_settings())
+        sync.index_album_media()
+
+        # album 5 has 6 items which are written 2 at a time
+        batches = [
+            list(args[1])
+            for args, _ in put_album_files.call_args_list
+            if args[0] == "album5"
+        ]
+        self.assertEqual([2, 2, 2], [len(batch) for batch in batches])
+        self.assertEqual(
+            ["media5-{}".format(i) for i in range(6)], self.album_files("album5")
+        )
+
+    def test_unchanged_albums(self):
+        api = FakeApi()
+        sync = GoogleAlbumsSync(api, self.root, self.db, False, make_settings())
+        sync.index_album_media()
+        all_pages = sum(n + 1 for n in range(FakeApi.ALBUMS))
+        self.assertEqual(all_pages, len(api.searches))
+
+        # unchanged albums only cost a request for their first page
+        api.searches.clear()
+        sync.index_album_media()
+        self.assertEqual(FakeApi.ALBUMS, len(api.searches))
+
+        # reordering is detected even though the item count is the same
+        api.searches.clear()
+        api.reversed.add(3)
+        sync.index_album_media()
+        self.assertEqual(FakeApi.ALBUMS + 3, len(api.searches))
+        self.assertEqual(
+            ["media3-{}".format(i) for i in (3, 2, 1, 0)], self.album_files("album3")
+        )
+
+        # items removed from an album are removed from the db
+        api.sizes[4] = 2
+        sync.index_album_media()
+        self.assertEqual(["media4-0", "media4-1"], self.album_files("album4"))
+
+        # --flush-index fetches everything again
+        api.searches.clear()
+        sync.flush = True
+        sync.index_album_media()
+        self.assertEqual(all_pages - 3, len(api.searches))
+
+    def test_replace_rollback(self):
+        self.db.put_album_files("album", [("media0", 0), ("media1", 1)])
+        with pytest.raises(RuntimeError):
+            with self.db.replace_album_files("album"):
+                self.db.put_album_files("album", [("media2", 0)])
+                raise RuntimeError("failed while writing an album")
+        self.assertEqual(["media0", "media1"], self.album_files("album"))
@@ -0,0 +1,82 @@
+from datetime import datetime, time
+from unittest import TestCase
+
+import pytest
+
+from gphotos.BandwidthLimiter import (
+    BandwidthLimiter,
+    BandwidthWindow,
+    parse_rate,
+    parse_schedule,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    def wait(self, seconds: float):
+        self.now += seconds
+
+
+class TestBandwidth(TestCase):
+    def test_parse(self):
+        self.assertEqual(500, parse_rate("500"))
+        self.assertEqual(500 * 1024, parse_rate("500K"))
+        self.assertEqual(5 * 1024 ** 2, parse_rate("5M"))
+        self.assertEqual(int(1.5 * 1024 ** 3), parse_rate("1.5g"))
+        with pytest.raises(ValueError):
+            parse_rate("fast")
+
+        schedule = parse_schedule("5M@08:00-18:00, 1M@22:00-6:00")
+        self.assertEqual(
+            [
+                BandwidthWindow(time(8), time(18), 5 * 1024 ** 2),
+                BandwidthWindow(time(22), time(6), 1024 ** 2),
+            ],
+            schedule,
+        )
+        with pytest.raises(ValueError):
+            parse_schedule("5M 08:00-18:00")
+
+    def test_schedule(self):
+        limiter = BandwidthLimiter(0, parse_schedule("5M@08:00-18:00,1M@22:00-06:00"))
+        self.assertEqual(5 * 1024 ** 2, limiter.scheduled_rate(datetime(2020, 1, 1, 8)))
+        self.assertEqual(0, limiter.scheduled_rate(datetime(2020, 1, 1, 18)))
+        self.assertEqual(1024 ** 2, limiter.scheduled_rate(datetime(2020, 1, 1, 23)))
+        self.assertEqual(1024 ** 2, limiter.scheduled_rate(datetime(2020, 1, 1, 5)))
+        self.assertEqual(0, limiter.scheduled_rate(datetime(2020, 1, 1, 7)))
+
+    def test_pacing(self):
+        fake = FakeClock()
+        limiter = BandwidthLimiter(1000, clock=fake.clock, wait=fake.wait)
+        self.assertEqual(100, limiter.chunk_size(1024 * 1024))
+
+        # instantaneous reads are spread out at the limited rate
+        for _ in range(50):
+            limiter.consume(100)
+        self.assertAlmostEqual(5.0, fake.now)
+
+        # after an idle period there is no burst beyond the current read
+        fake.now += 60
+        start = fake.now
+        for _ in range(10):
+            limiter.consume(100)
+        self.assertAlmostEqual(0.9, fake.now - start)
+
+        # reads slower than the limit are not delayed
+        fake.now += 1
+        start = fake.now
+        limiter.consume(100)
+        self.assertEqual(start, fake.now)
+
+    def test_unlimited(self):
+        fake = FakeClock()
+        limiter = BandwidthLimiter(clock=fake.clock, wait=fake.wait)
+        self.assertFalse(limiter.enabled)
+        self.assertEqual(1024, limiter.chunk_size(1024))
+        limiter.consume(10 ** 9)
+        self.assertEqual(0, fake.now)
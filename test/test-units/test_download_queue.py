@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+
+from gphotos.GooglePhotosRow import GooglePhotosRow
+from gphotos.LocalData import LocalData, QueueState
+
+
+class TestDownloadQueue(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.db = LocalData(self.root)
+        for i in range(3):
+            row = GooglePhotosRow.make(
+                RemoteId="id{}".format(i),
+                Path="photos/2020/01",
+                FileName="file{}.jpg".format(i),
+                OrigFileName="file{}.jpg".format(i),
+                DuplicateNo=0,
+                MimeType="image/jpeg",
+                ModifyDate=datetime(2020, 1, 1 + i),
+                CreateDate=datetime(2020, 1, 1 + i),
+                Downloaded=0,
+            )
+            self.db.put_row(row)
+
+    def tearDown(self):
+        self.db.con.close()
+        shutil.rmtree(str(self.root))
+
+    def queued_ids(self, now=1000):
+        return sorted(m.id for m, _, _ in self.db.get_download_queue(now))
+
+    def state(self, remote_id):
+        self.db.cur.execute(
+            "SELECT State, Attempts, NextAttempt FROM DownloadQueue "
+            "WHERE RemoteId=?",
+            (remote_id,),
+        )
+        return tuple(self.db.cur.fetchone())
+
+    def test_queue_states(self):
+        self.db.queue_downloads()
+        self.assertEqual(["id0", "id1", "id2"], self.queued_ids())
+
+        self.db.queue_resolved("id0", "http://url0", 5000)
+        self.db.queue_in_flight("id1")
+        self.db.put_downloaded("id2")
+        self.db.queue_done("id2")
+        urls = {m.id: (url, exp) for m, url, exp in self.db.get_download_queue(0)}
+        self.assertEqual({"id0": ("http://url0", 5000)}, urls)
+
+        # a restart returns in flight items to the queue, keeping urls
+        self.db.queue_downloads()
+        self.assertEqual(["id0", "id1"], self.queued_ids())
+        self.assertEqual(QueueState.RESOLVED, self.state("id0")[0])
+        self.assertEqual(QueueState.PENDING, self.state("id1")[0])
+
+        # --retry-download re-queues completed items
+        self.db.queue_downloads(retry_download=True)
+        self.assertEqual(["id0", "id1", "id2"], self.queued_ids())
+
+    def test_queue_backoff(self):
+        self.db.queue_downloads()
+        self.db.queue_failed("id0", "boom", 1000)
+        self.assertEqual(
+            (QueueState.FAILED, 1, 1000 + LocalData.RETRY_BACKOFF), self.state("id0")
+        )
+        self.db.queue_failed("id0", "boom", 1000)
+        self.assertEqual(
+            (QueueState.FAILED, 2, 1000 + 2 * LocalData.RETRY_BACKOFF),
+            self.state("id0"),
+        )
+
+        # not retried until the backoff has expired
+        self.assertEqual(["id1", "id2"], self.queued_ids(now=1000))
+        now = 1000 + 2 * LocalData.RETRY_BACKOFF
+        self.assertEqual(["id0", "id1", "id2"], self.queued_ids(now=now))
+
+    def test_queue_order(self):
+        self.db.queue_downloads()
+        self.db.put_favourites(["id1"])
+        self.db.put_album_files("album", [("id0", 0)])
+
+        def ordered(order):
+            return [m.id for m, _, _ in self.db.get_download_queue(0, order=order)]
+
+        self.assertEqual(["id2", "id1", "id0"], ordered(["newest"]))
+        self.assertEqual(["id1", "id2", "id0"], ordered(["favourites", "newest"]))
+        self.assertEqual(
+            ["id0", "id1", "id2"], ordered(["albums", "favourites", "newest"])
+        )
@@ -0,0 +1,165 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from time import perf_counter
+from unittest import TestCase, skipUnless
+from unittest.mock import Mock
+
+from gphotos.BandwidthLimiter import BandwidthLimiter
+from gphotos.DatabaseMedia import DatabaseMedia
+from gphotos.GooglePhotosDownload import GooglePhotosDownload
+from test.test_settings import make_settings
+
+# size of the payload served by the local server, a few copy buffers
+PAYLOAD_SIZE = 3 * GooglePhotosDownload.CHUNK_SIZE + 123
+# size of the payload for the microbenchmark
+BENCHMARK_SIZE = 64 * 1024 * 1024
+# set this environment variable to run the microbenchmark. The results are
+# logged at WARNING, e.g. view them with pytest -o log_cli=true
+BENCHMARK = "GPHOTOS_BENCHMARK"
+
+log = logging.getLogger(__name__)
+
+
+class PayloadHandler(BaseHTTPRequestHandler):
+    payload: bytes = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadSpeed(TestCase):
+    """
+    Tests of the streaming copy in do_download_file against a local http
+    server, with an optional microbenchmark.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        PayloadHandler.payload = os.urandom(PAYLOAD_SIZE)
+        cls.server = HTTPServer(("127.0.0.1", 0), PayloadHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = "http://127.0.0.1:{}/item".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        (self.root / "photos").mkdir()
+        self.down = GooglePhotosDownload(None, self.root, None, make_settings())
+
+    def tearDown(self):
+        self.down.download_pool.shutdown()
+        shutil.rmtree(str(self.root))
+
+    def media_item(self, name: str) -> DatabaseMedia:
+        now = datetime.now()
+        return DatabaseMedia(
+            _relative_folder=Path("photos"),
+            _filename=name,
+            _mime_type="image/jpeg",
+            _date=now,
+            _create_date=now,
+        )
+
+    def time_download(self, name: str) -> float:
+        start = perf_counter()
+        self.down.do_download_file(self.base_url, self.media_item(name))
+        elapsed = perf_counter() - start
+        data = (self.root / "photos" / name).read_bytes()
+        self.assertEqual(PayloadHandler.payload, data)
+        return elapsed
+
+    def test_download_copy(self):
+        """ the downloaded file has the content that was served """
+        self.time_download("copied.jpg")
+
+    @skipUnless(os.environ.get(BENCHMARK), "set {} to run".format(BENCHMARK))
+    def test_download_benchmark(self):
+        payload = PayloadHandler.payload
+        PayloadHandler.payload = os.urandom(BENCHMARK_SIZE)
+        try:
+            buffered = self.time_download("buffered.jpg")
+
+            # compare with the previous implementation using shutil.copyfileobj
+            def copy_response(response, temp_file):
+                shutil.copyfileobj(response.raw, temp_file)
+
+            self.down.copy_response = copy_response
+            copied = self.time_download("copyfileobj.jpg")
+        finally:
+            PayloadHandler.payload = payload
+
+        log.warning(
+            "%d MB download: readinto %.3fs, copyfileobj %.3fs",
+            BENCHMARK_SIZE // (1024 * 1024),
+            buffered,
+            copied,
+        )
+
+    def test_short_content(self):
+        """ preallocated space is trimmed if fewer bytes arrive """
+
+        class Response:
+            headers = {"Content-Length": "1000"}
+
+            class raw:
+                data = [b"x" * 10]
+
+                @classmethod
+                def readinto(cls, buffer):
+                    if not cls.data:
+                        return 0
+                    chunk = cls.data.pop()
+                    buffer[: len(chunk)] = chunk
+                    return len(chunk)
+
+        with tempfile.NamedTemporaryFile(dir=str(self.root)) as temp_file:
+            written = self.down.copy_response(Response, temp_file)
+            temp_file.flush()
+            self.assertEqual(10, written)
+            self.assertEqual(10, os.stat(temp_file.name).st_size)
+
+    def test_durable_download(self):
+        """ durable mode only renames and flags files when a batch commits """
+        self.down.durable_downloads = True
+        self.down._db = Mock()
+        media_item = self.media_item("durable.jpg")
+        local_file = self.root / "photos" / "durable.jpg"
+
+        t_path = self.down.do_download_file(self.base_url, media_item)
+        self.assertTrue(t_path.exists())
+        self.assertFalse(local_file.exists())
+
+        self.down.durable_batch.append((t_path, media_item))
+        self.down.commit_durable_batch()
+        self.assertFalse(t_path.exists())
+        self.assertEqual(PayloadHandler.payload, local_file.read_bytes())
+        self.down._db.put_downloaded.assert_called_once_with(media_item.id)
+        self.down._db.store.assert_called_once_with()
+        self.assertEqual(1, self.down.files_downloaded)
+
+    def test_bandwidth_limit(self):
+        """ the copy loop is paced by the bandwidth limiter """
+        waited = []
+        rate = PAYLOAD_SIZE // 2
+        self.down.bandwidth = BandwidthLimiter(
+            rate, clock=lambda: sum(waited), wait=waited.append
+        )
+        self.time_download("limited.jpg")
+        self.assertAlmostEqual(2.0, sum(waited), places=1)
@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from gphotos import Checks
+from gphotos import Utils
+from gphotos.LocalData import LocalData
+from gphotos.Main import GooglePhotosSyncMain
+
+
+class TestFsChecks(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.gp = GooglePhotosSyncMain()
+        self.gp.data_store = LocalData(self.root)
+        self.args = self.gp.parser.parse_args([str(self.root)])
+
+    def tearDown(self):
+        self.gp.data_store.con.close()
+        shutil.rmtree(str(self.root))
+
+    def test_probes_saved(self):
+        probe = Checks.probe_filesystem
+        with patch("gphotos.Checks.probe_filesystem", side_effect=probe) as probed:
+            self.gp.fs_checks(self.root, self.args)
+            self.assertEqual(1, probed.call_count)
+            probes = self.gp.data_store.get_fs_probes(Checks.filesystem_id(self.root))
+            self.assertEqual(probe(self.root), probes)
+
+            # the next run restores the saved results
+            with patch("gphotos.Checks.MAX_PATH_LENGTH", 0), patch(
+                "gphotos.Utils.MINIMUM_DATE", None
+            ):
+                self.gp.fs_checks(self.root, self.args)
+                self.assertEqual(1, probed.call_count)
+                self.assertEqual(probes["max_path_length"], Checks.MAX_PATH_LENGTH)
+                self.assertEqual(
+                    probes["minimum_date"], Utils.date_to_string(Utils.MINIMUM_DATE)
+                )
+
+            # a different filesystem is probed again
+            with patch("gphotos.Checks.filesystem_id", return_value="1:/mnt"):
+                self.gp.fs_checks(self.root, self.args)
+            self.assertEqual(2, probed.call_count)
+            self.assertIsNone(
+                self.gp.data_store.get_fs_probes(Checks.filesystem_id(self.root))
+            )
+
+    def test_no_symlinks(self):
+        with patch("gphotos.Checks.symlinks_supported", return_value=False):
+            args = self.gp.fs_checks(self.root, self.args)
+        self.assertTrue(args.skip_albums)
+        # the saved result is used without another check
+        args = self.gp.parser.parse_args([str(self.root)])
+        self.assertTrue(self.gp.fs_checks(self.root, args).skip_albums)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+
+from gphotos.LinkTree import LinkSpec, LinkTree
+
+
+class TestLinkTree(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.photos = self.root / "photos"
+        self.photos.mkdir()
+        self.links = self.root / "albums"
+        self.names = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+        for name in self.names:
+            (self.photos / name).write_text(name)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.root))
+
+    def specs(self, album: str, names):
+        return [
+            LinkSpec(
+                self.links / album / "{:04d}_{}".format(i, name),
+                self.photos / name,
+                datetime(2020, 1, 1),
+            )
+            for i, name in enumerate(names)
+        ]
+
+    def contents(self):
+        result = {}
+        for folder, _, files in os.walk(str(self.links)):
+            for name in files:
+                path = os.path.join(folder, name)
+                rel = os.path.relpath(path, str(self.links))
+                with open(path) as f:
+                    result[rel] = f.read()
+        return result
+
+    def reconcile(self, specs, hardlinks=False) -> LinkTree:
+        tree = LinkTree(self.links, hardlinks)
+        tree.reconcile(specs)
+        expected = {
+            os.path.relpath(str(s.link), str(self.links)): s.target.name for s in specs
+        }
+        self.assertEqual(expected, self.contents())
+        return tree
+
+    def check_reconcile(self, hardlinks: bool):
+        tree = self.reconcile(self.specs("one", self.names[:3]), hardlinks)
+        self.assertEqual(3, tree.created)
+
+        # a second run with no changes does nothing
+        tree = self.reconcile(self.specs("one", self.names[:3]), hardlinks)
+        self.assertEqual(
+            (0, 0, 0, 3), (tree.created, tree.renamed, tree.removed, tree.unchanged)
+        )
+
+        # an insert at the start of the album renames the later links
+        tree = self.reconcile(self.specs("one", ["d.jpg"] + self.names[:3]), hardlinks)
+        self.assertEqual(
+            (1, 3, 0, 0), (tree.created, tree.renamed, tree.removed, tree.unchanged)
+        )
+
+        # swapping positions is a cycle of renames
+        names = ["d.jpg", "b.jpg", "a.jpg", "c.jpg"]
+        tree = self.reconcile(self.specs("one", names), hardlinks)
+        self.assertEqual(
+            (0, 2, 0, 2), (tree.created, tree.renamed, tree.removed, tree.unchanged)
+        )
+
+        # removed albums are deleted along with their folder
+        tree = self.reconcile(self.specs("two", ["a.jpg"]), hardlinks)
+        self.assertEqual(
+            (1, 0, 4, 0), (tree.created, tree.renamed, tree.removed, tree.unchanged)
+        )
+        self.assertFalse((self.links / "one").exists())
+
+    def test_symlinks(self):
+        self.check_reconcile(hardlinks=False)
+        link = self.links / "two" / "0000_a.jpg"
+        self.assertTrue(link.is_symlink())
+        self.assertEqual(datetime(2020, 1, 1).timestamp(), os.lstat(str(link)).st_mtime)
+
+    def test_hardlinks(self):
+        self.check_reconcile(hardlinks=True)
+        link = self.links / "two" / "0000_a.jpg"
+        self.assertTrue(os.path.samefile(str(link), str(self.photos / "a.jpg")))
@@ -0,0 +1,201 @@
+import os
+import random
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from gphotos.ContentMatcher import ContentMatcher
+from gphotos.LocalData import LocalData
+from gphotos.LocalMatcher import LocalMatcher
+
+# the correlated sub-query implementation that LocalMatcher replaced
+REFERENCE_MATCH = [
+    """
+UPDATE LocalFiles
+set RemoteId = NULL  ;
+""",
+    """
+UPDATE LocalFiles
+set RemoteId = (SELECT RemoteId
+                FROM SyncFiles
+                WHERE LocalFiles.OriginalFileName == SyncFiles.OrigFileName
+                  AND (LocalFiles.Uid == SyncFiles.Uid AND
+                       LocalFiles.CreateDate = SyncFiles.CreateDate)
+                  OR (LocalFiles.Uid == SyncFiles.Uid AND
+                  length(LocalFiles.Uid) == 32)
+)
+WHERE LocalFiles.Uid notnull and LocalFiles.Uid != 'not_supported'
+;
+""",
+    """
+with pre_match(RemoteId) as
+   (SELECT RemoteId from LocalFiles where RemoteId notnull)
+UPDATE LocalFiles
+set RemoteId = (SELECT RemoteId
+            FROM SyncFiles
+            WHERE LocalFiles.OriginalFileName == SyncFiles.OrigFileName
+              AND LocalFiles.CreateDate = SyncFiles.CreateDate
+            AND SyncFiles.RemoteId NOT IN (select RemoteId from pre_match)
+)
+WHERE LocalFiles.RemoteId isnull
+;
+""",
+    """
+with pre_match(RemoteId) as
+   (SELECT RemoteId from LocalFiles where RemoteId notnull)
+UPDATE LocalFiles
+set RemoteId = (SELECT RemoteId
+            FROM SyncFiles
+            WHERE LocalFiles.OriginalFileName == SyncFiles.OrigFileName
+            AND SyncFiles.RemoteId NOT IN (select RemoteId from pre_match)
+)
+WHERE LocalFiles.RemoteId isnull
+;
+""",
+]
+
+
+class TestLocalMatch(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.db = LocalData(self.root)
+
+    def tearDown(self):
+        self.db.con.close()
+        shutil.rmtree(str(self.root))
+
+    def local_matches(self):
+        self.db.cur.execute("SELECT Id, RemoteId FROM LocalFiles ORDER BY Id;")
+        return [tuple(row) for row in self.db.cur.fetchall()]
+
+    def test_stages(self):
+        rows = [
+            # RemoteId, OrigFileName, Uid, CreateDate
+            ("r1", "a.jpg", "u1", "2020-01-01 00:00:00"),
+            ("r2", "b.jpg", "x" * 32, "2020-01-02 00:00:00"),
+            ("r3", "c.jpg", "none", "2020-01-03 00:00:00"),
+            ("r4", "c.jpg", "none", "2020-01-04 00:00:00"),
+            ("r5", "d.jpg", "none", "2020-01-05 00:00:00"),
+        ]
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, OrigFileName, Uid, CreateDate) "
+            "VALUES (?,?,?,?);",
+            rows,
+        )
+        local = [
+            ("a.jpg", "u1", "2020-01-01 00:00:00"),  # uid
+            ("renamed.jpg", "x" * 32, "2019-01-01 00:00:00"),  # uid
+            ("c.jpg", "not_supported", "2020-01-04 00:00:00"),  # name_and_date
+            ("c.jpg", "none", "2021-01-01 00:00:00"),  # name, r4 excluded
+            ("d.jpg", None, None),  # name
+            ("e.jpg", "none", "2020-01-05 00:00:00"),  # missing
+        ]
+        self.db.cur.executemany(
+            "INSERT INTO LocalFiles (Path, FileName, OriginalFileName, Uid, "
+            "CreateDate) VALUES ('local', ?, ?, ?, ?);",
+            [
+                (name + str(i), name, uid, date)
+                for i, (name, uid, date) in enumerate(local)
+            ],
+        )
+        counts = LocalMatcher(self.db).match()
+        self.assertEqual({"uid": 2, "name_and_date": 1, "name": 2}, counts)
+        self.assertEqual(
+            ["r1", "r2", "r4", "r3", "r5", None],
+            [remote_id for _, remote_id in self.local_matches()],
+        )
+
+    def test_reference_equivalence(self):
+        """ gives the same results as the original queries on random data """
+        rnd = random.Random(1)
+        names = ["img{}.jpg".format(i) for i in range(30)] + [None]
+        uids = ["none", "no_uid_in_exif", "not_supported", None]
+        uids += ["{:032d}".format(i) for i in range(10)]
+        uids += ["u{}".format(i) for i in range(10)]
+        dates = ["2020-01-{:02d} 00:00:00".format(d) for d in range(1, 6)] + [None]
+
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, OrigFileName, Uid, CreateDate) "
+            "VALUES (?,?,?,?);",
+            [
+                (
+                    "r{}".format(i),
+                    rnd.choice(names),
+                    rnd.choice(uids),
+                    rnd.choice(dates),
+                )
+                for i in range(400)
+            ],
+        )
+        self.db.cur.executemany(
+            "INSERT INTO LocalFiles (Path, FileName, OriginalFileName, Uid, "
+            "CreateDate) VALUES ('local', ?, ?, ?, ?);",
+            [
+                (str(i), rnd.choice(names), rnd.choice(uids), rnd.choice(dates))
+                for i in range(400)
+            ],
+        )
+
+        for query in REFERENCE_MATCH:
+            self.db.cur.execute(query)
+        expected = self.local_matches()
+
+        counts = LocalMatcher(self.db).match()
+        self.assertEqual(expected, self.local_matches())
+        self.assertEqual(
+            sum(1 for _, remote_id in expected if remote_id), sum(counts.values())
+        )
+
+    def test_content_stage(self):
+        photos = self.root / "photos"
+        local = self.root / "local"
+        photos.mkdir()
+        local.mkdir()
+        library = [("r1", "a.jpg", b"aaaa"), ("r2", "b.jpg", b"bbbb")]
+        for remote_id, name, data in library:
+            (photos / name).write_bytes(data)
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, Path, FileName, OrigFileName, "
+            "Downloaded) VALUES (?, 'photos', ?, ?, 1);",
+            [(remote_id, name, name) for remote_id, name, _ in library],
+        )
+        # same name but not the same contents, the same contents with
+        # another name, a copy of that and a file no library file matches
+        files = [
+            ("a.jpg", b"bbbb"),
+            ("renamed.jpg", b"aaaa"),
+            ("copy.jpg", b"aaaa"),
+            ("other.jpg", b"other contents"),
+        ]
+        for name, data in files:
+            (local / name).write_bytes(data)
+            stat = (local / name).stat()
+            self.db.cur.execute(
+                "INSERT INTO LocalFiles (Path, FileName, OriginalFileName, "
+                "FileSize, FileMTime) VALUES (?, ?, ?, ?, ?);",
+                (str(local), name, name, stat.st_size, stat.st_mtime_ns),
+            )
+
+        counts = LocalMatcher(self.db, ContentMatcher(self.root, self.db)).match()
+        self.assertEqual(
+            {"content": 3, "uid": 0, "name_and_date": 0, "name": 0}, counts
+        )
+        self.assertEqual(
+            ["r2", "r1", "r1", None],
+            [remote_id for _, remote_id in self.local_matches()],
+        )
+        # other.jpg has a size that no library file has so was never read
+        hashes = self.db.get_file_hashes()
+        self.assertEqual(5, len(hashes))
+        self.assertNotIn(str(local / "other.jpg"), hashes)
+
+        # a changed file is hashed again
+        (photos / "a.jpg").write_bytes(b"cccc")
+        os.utime(str(photos / "a.jpg"), ns=(1, 1))
+        counts = LocalMatcher(self.db, ContentMatcher(self.root, self.db)).match()
+        self.assertEqual(1, counts["content"])
+        self.assertEqual(
+            ["r2", None, None, None],
+            [remote_id for _, remote_id in self.local_matches()],
+        )
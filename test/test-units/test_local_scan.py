@@ -1,6 +1,16 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+import exif
 from unittest import TestCase
 from pathlib import Path
-from gphotos.LocalFilesMedia import LocalFilesMedia
+from gphotos.LocalData import LocalData
+from gphotos.LocalFilesMedia import LocalFilesMedia, exif_header
+from gphotos.LocalFilesScan import LocalFilesScan
 
 test_data = Path(__file__).absolute().parent.parent / "test-data"
 
@@ -22,3 +32,175 @@ class TestLocalScan(TestCase):
         self.assertEqual(lf.duplicate_number, 0)
 
         assert str(lf.filename) == ps
+
+    def test_exif_header(self):
+        """ the header only EXIF reader agrees with parsing the whole file """
+
+        def tags(image: exif.Image):
+            values = []
+            for tag in (
+                "datetime_original",
+                "datetime",
+                "image_unique_id",
+                "image_description",
+                "make",
+                "model",
+            ):
+                try:
+                    values.append(getattr(image, tag))
+                except (AttributeError, KeyError, ValueError):
+                    values.append(None)
+            return values
+
+        for path in sorted(test_data.glob("*.jpg")):
+            with path.open("rb") as image_file:
+                header = exif_header(image_file)
+                read = image_file.tell()
+                image_file.seek(0)
+                expected = tags(exif.Image(image_file))
+            self.assertEqual(expected, tags(exif.Image(BytesIO(header))), path.name)
+            self.assertLessEqual(read, 70 * 1024, path.name)
+
+        # not a JPEG
+        self.assertEqual(b"", exif_header(BytesIO(b"GIF89a" + bytes(100))))
+
+    def test_scan_local_files(self):
+        root = Path(tempfile.mkdtemp())
+        try:
+            # a nested copy of the test data with a symlink that is skipped
+            scan_folder = root / "compare"
+            shutil.copytree(str(test_data), str(scan_folder / "nested"))
+            shutil.copy(str(test_data / "PIC00002.jpg"), str(scan_folder))
+            (scan_folder / "link.jpg").symlink_to(test_data / "PIC00002.jpg")
+
+            db = LocalData(root)
+            scan = LocalFilesScan(root, scan_folder, db)
+            scan.scan_local_files()
+            db.store()
+
+            expected = {}
+            for path in scan_folder.glob("**/*.jpg"):
+                if not path.is_symlink():
+                    media = LocalFilesMedia(path)
+                    expected[str(path)] = (media.create_date, media.uid, media.size)
+            self.assertEqual(6, scan.count)
+
+            db.cur.execute(
+                "SELECT Path, FileName, CreateDate, Uid, FileSize FROM LocalFiles;"
+            )
+            scanned = {
+                str(Path(row[0]) / row[1]): (str(row[2]), row[3], row[4])
+                for row in db.cur.fetchall()
+            }
+            self.assertEqual(
+                {k: (str(d), u, s) for k, (d, u, s) in expected.items()}, scanned
+            )
+
+            # a rescan only indexes new or changed files and drops vanished ones
+            scan = LocalFilesScan(root, scan_folder, db)
+            scan.scan_local_files()
+            self.assertEqual((0, 6), (scan.count, scan.unchanged))
+
+            changed = scan_folder / "nested" / "PIC00002.jpg"
+            os.utime(str(changed), (0, 0))
+            (scan_folder / "PIC00002.jpg").unlink()
+            scan = LocalFilesScan(root, scan_folder, db)
+            scan.scan_local_files()
+            self.assertEqual(1, scan.count)
+            self.assertEqual(
+                sorted(k for k in scanned if not k.endswith("compare/PIC00002.jpg")),
+                sorted(
+                    str(Path(p) / f)
+                    for p, files in db.get_local_file_stats().items()
+                    for f in files
+                ),
+            )
+            db.con.close()
+        finally:
+            shutil.rmtree(str(root))
+
+    def test_comparison_output(self):
+        root = Path(tempfile.mkdtemp())
+        try:
+            scan_folder = root / "compare"
+            (scan_folder / "sub").mkdir(parents=True)
+            (root / "photos").mkdir()
+            for name in ["a.jpg", "b.jpg"]:
+                (root / "photos" / name).write_bytes(b"library")
+            for name in ["x.jpg", "a.jpg", "sub/a.jpg"]:
+                (scan_folder / name).write_bytes(b"local")
+
+            db = LocalData(root)
+            db.cur.executemany(
+                "INSERT INTO SyncFiles (RemoteId, Path, FileName, OrigFileName, "
+                "Downloaded) VALUES (?, 'photos', ?, ?, 1);",
+                [("r1", "a.jpg", "a.jpg"), ("r2", "b.jpg", "b.jpg")],
+            )
+            db.cur.executemany(
+                "INSERT INTO LocalFiles (Path, FileName, OriginalFileName) "
+                "VALUES (?, ?, ?);",
+                [
+                    (str(scan_folder), "x.jpg", "x.jpg"),
+                    (str(scan_folder), "a.jpg", "a.jpg"),
+                    (str(scan_folder / "sub"), "a.jpg", "a.jpg"),
+                ],
+            )
+
+            comparison = root / "comparison"
+            scan = LocalFilesScan(root, scan_folder, db)
+            scan.find_missing_gphotos()
+            links = {
+                str(p.relative_to(comparison)): p.resolve()
+                for p in comparison.glob("**/*.jpg")
+            }
+            self.assertEqual(
+                {
+                    "missing_files/x.jpg": scan_folder / "x.jpg",
+                    "extra_files/photos/b.jpg": root / "photos" / "b.jpg",
+                    "duplicates/00000_001_a.jpg": scan_folder / "a.jpg",
+                    "duplicates/00001_001_a.jpg": scan_folder / "sub" / "a.jpg",
+                },
+                links,
+            )
+
+            # the comparison links point at absolute paths
+            self.assertEqual(
+                str(scan_folder / "x.jpg"),
+                os.readlink(str(comparison / "missing_files" / "x.jpg")),
+            )
+
+            # a second comparison leaves unchanged links alone and removes
+            # the ones that no longer apply
+            stale = comparison / "missing_files" / "gone.jpg"
+            stale.symlink_to(scan_folder / "gone.jpg")
+            inode = os.lstat(str(comparison / "missing_files" / "x.jpg")).st_ino
+            scan.find_missing_gphotos()
+            self.assertEqual(
+                inode, os.lstat(str(comparison / "missing_files" / "x.jpg")).st_ino
+            )
+            self.assertFalse(os.path.lexists(str(stale)))
+
+            # the report replaces the comparison folder
+            shutil.rmtree(str(comparison))
+            for report in [root / "report.csv", root / "report.jsonl"]:
+                LocalFilesScan(
+                    root, scan_folder, db, report=report
+                ).find_missing_gphotos()
+                self.assertFalse(comparison.exists())
+                lines = report.read_text().splitlines()
+                if report.suffix == ".csv":
+                    rows = list(csv.DictReader(lines))
+                else:
+                    rows = [json.loads(line) for line in lines]
+                self.assertEqual(
+                    [
+                        ("missing", None, str(scan_folder / "x.jpg")),
+                        ("extra", "r2", str(root / "photos" / "b.jpg")),
+                        ("duplicate", "r1", str(scan_folder / "a.jpg")),
+                        ("duplicate", "r1", str(scan_folder / "sub" / "a.jpg")),
+                    ],
+                    [(r["type"], r["remote_id"] or None, r["path"]) for r in rows],
+                )
+            db.con.close()
+        finally:
+            shutil.rmtree(str(root))
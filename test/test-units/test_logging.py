@@ -0,0 +1,124 @@
+import logging
+import queue
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase
+
+from gphotos import Logging
+from gphotos.Logging import DroppingQueueHandler, LogQueueListener, setup_logging
+
+log = logging.getLogger("gphotos.test_logging")
+
+# number of items in the simulated index loop
+LOOP_ITEMS = 200
+# longest time the blocked log file waits to become writable
+WRITABLE_TIMEOUT = 10
+
+
+def log_from_worker(name: str) -> str:
+    """ runs in a process pool worker """
+    try:
+        raise ValueError("bad file")
+    except ValueError:
+        log.error("could not read %s", name, exc_info=True)
+    return name
+
+
+class BlockedHandler(logging.Handler):
+    """ a log file that cannot be written until writable is set """
+
+    def __init__(self):
+        super().__init__()
+        self.writable = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.writable.wait(WRITABLE_TIMEOUT)
+        self.messages.append(self.format(record))
+
+
+class TestLogging(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.level = logging.getLogger().level
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self.level)
+        shutil.rmtree(str(self.root))
+
+    def test_log_file_levels(self):
+        listener = setup_logging("warning", None, self.root, "info")
+        self.assertEqual(logging.INFO, logging.getLogger().level)
+        log.debug("not written %s", "debug")
+        log.info("written %s", "info")
+        log.warning("written %s", "warning")
+        listener.stop()
+        self.assertNotIn(listener.queue_handler, logging.getLogger().handlers)
+
+        lines = (self.root / "gphotos.log").read_text().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].endswith("written info"))
+        self.assertTrue(lines[1].endswith("written warning"))
+
+    def test_message_resolved_when_logged(self):
+        listener = setup_logging("warning", None, self.root)
+        args = {"state": "queued"}
+        log.info("item %s", args)
+        args["state"] = "changed"
+        listener.stop()
+
+        lines = (self.root / "gphotos.log").read_text().splitlines()
+        self.assertTrue(lines[-1].endswith("item {'state': 'queued'}"))
+
+    def test_pool_worker_logging(self):
+        listener = setup_logging("critical", None, self.root)
+        log.error("from the parent")
+        with Logging.process_pool(1) as pool:
+            self.assertEqual("a.jpg", pool.submit(log_from_worker, "a.jpg").result())
+        listener.stop()
+        self.assertIsNone(Logging._listener)
+
+        text = (self.root / "gphotos.log").read_text()
+        self.assertIn("from the parent", text)
+        self.assertIn("could not read a.jpg", text)
+        self.assertIn("ValueError: bad file", text)
+
+    def test_drop_policy(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for i in range(4):
+            handler.handle(log.makeRecord(log.name, logging.INFO, "", 0, i, (), None))
+        self.assertEqual(2, handler.dropped)
+
+        # a warning waits for space in the queue instead of being dropped
+        warning = log.makeRecord(log.name, logging.WARNING, "", 0, "w", (), None)
+        writer = threading.Thread(target=handler.handle, args=(warning,))
+        writer.start()
+        writer.join(0.1)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual("0", handler.queue.get().msg)
+        writer.join()
+        self.assertEqual(["1", "w"], [handler.queue.get().msg for _ in range(2)])
+        self.assertEqual(2, handler.dropped)
+
+    def test_index_loop_overhead(self):
+        """ an index loop logging every item must not wait for the log file """
+        blocked = BlockedHandler()
+        queue_handler = DroppingQueueHandler(queue.Queue(LOOP_ITEMS))
+        listener = LogQueueListener(queue_handler, blocked)
+        logging.getLogger().addHandler(queue_handler)
+        logging.getLogger().setLevel(logging.DEBUG)
+        listener.start()
+        try:
+            for i in range(LOOP_ITEMS):
+                log.info("Indexed %d %s", i, Path("photos") / "2020" / "01")
+            # the loop has finished while the log file is still blocked
+            self.assertEqual([], blocked.messages)
+        finally:
+            blocked.writable.set()
+            listener.stop()
+
+        self.assertEqual(0, queue_handler.dropped)
+        self.assertEqual(LOOP_ITEMS, len(blocked.messages))
+        self.assertEqual("Indexed 199 photos/2020/01", blocked.messages[-1])
@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from urllib.request import urlopen
+
+from requests.exceptions import ConnectionError
+
+from gphotos import Metrics
+from gphotos.LocalData import LocalData
+from gphotos.Main import GooglePhotosSyncMain
+from gphotos.MetricsServer import CONTENT_TYPE, MetricsServer
+from gphotos.restclient import Method
+
+
+class FakeSession:
+    """ returns the given status codes or raises ConnectionError for None """
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+
+    def request(self, *args, **kwargs):
+        status = self.statuses.pop(0)
+        if status is None:
+            raise ConnectionError("no route")
+        return SimpleNamespace(
+            status_code=status, content=b"", raise_for_status=lambda: None
+        )
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        Metrics.REGISTRY.reset()
+
+    def tearDown(self):
+        Metrics.REGISTRY.reset()
+        shutil.rmtree(str(self.root))
+
+    def test_render(self):
+        registry = Metrics.Registry()
+        counter = registry.counter("test_total", "a counter", ["name"])
+        gauge = registry.gauge("test_depth", "a gauge")
+        histogram = registry.histogram(
+            "test_seconds", "a histogram", ["kind"], buckets=(0.5, 1)
+        )
+        counter.inc('say "hi"\\')
+        counter.inc("b", amount=2.5)
+        gauge.set_function(lambda: 7)
+        for value in (0.1, 0.5, 0.75, 3):
+            histogram.observe(value, "x")
+
+        self.assertEqual(
+            [
+                "# HELP test_total a counter",
+                "# TYPE test_total counter",
+                'test_total{name="b"} 2.5',
+                'test_total{name="say \\"hi\\"\\\\"} 1',
+                "# HELP test_depth a gauge",
+                "# TYPE test_depth gauge",
+                "test_depth 7",
+                "# HELP test_seconds a histogram",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{kind="x",le="0.5"} 2',
+                'test_seconds_bucket{kind="x",le="1"} 3',
+                'test_seconds_bucket{kind="x",le="+Inf"} 4',
+                'test_seconds_sum{kind="x"} 4.35',
+                'test_seconds_count{kind="x"} 4',
+            ],
+            registry.render().splitlines(),
+        )
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_exporters(self):
+        Metrics.DOWNLOADS.inc("ok")
+        textfile = self.root / "gphotos.prom"
+        Metrics.REGISTRY.write_textfile(textfile)
+        self.assertIn('gphotos_downloads_total{result="ok"} 1', textfile.read_text())
+        self.assertEqual([textfile], list(self.root.iterdir()))
+
+        server = MetricsServer("127.0.0.1", 0).start()
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+            with urlopen(url) as response:
+                self.assertEqual(CONTENT_TYPE, response.headers["Content-Type"])
+                self.assertEqual(Metrics.REGISTRY.render(), response.read().decode())
+        finally:
+            server.shutdown()
+
+    def test_instrumentation(self):
+        db = LocalData(self.root)
+        commits = Metrics.DB_COMMIT_SECONDS.get()
+        db.store()
+        self.assertEqual(commits + 1, Metrics.DB_COMMIT_SECONDS.get())
+        db.con.close()
+
+        service = SimpleNamespace(
+            base_url="https://example.com/", auth_session=FakeSession(200, None)
+        )
+        method = Method(service, id="photos.list", path="list", httpMethod="GET")
+        method.execute()
+        with self.assertRaises(ConnectionError):
+            method.execute()
+        self.assertEqual(1, Metrics.API_REQUESTS.get("photos.list", "200"))
+        self.assertEqual(1, Metrics.API_REQUESTS.get("photos.list", "error"))
+        self.assertEqual(2, Metrics.API_SECONDS.get("photos.list"))
+
+    def test_run_summary(self):
+        gp = GooglePhotosSyncMain()
+        textfile = self.root / "gphotos.prom"
+        args = gp.parser.parse_args(
+            [str(self.root), "--metrics-textfile", str(textfile)]
+        )
+        gp.stop_metrics(args, None, datetime(2020, 1, 1), True)
+        lines = textfile.read_text().splitlines()
+        self.assertIn("gphotos_last_run_success 1", lines)
+        self.assertGreater(Metrics.RUN_SECONDS.get(), 0)
@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from gphotos.GooglePhotosIndex import GooglePhotosIndex
+from gphotos.LocalData import LocalData
+from gphotos.LocalFilesMedia import LocalFilesMedia
+from test.test_settings import make_settings
+
+test_data = Path(__file__).absolute().parent.parent / "test-data"
+
+
+class TestPhotosIndex(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.db = LocalData(self.root)
+        self.index = GooglePhotosIndex(None, self.root, self.db, make_settings())
+
+    def tearDown(self):
+        self.db.con.close()
+        shutil.rmtree(str(self.root))
+
+    def test_check_for_removed(self):
+        folder = self.root / "photos" / "2020" / "01"
+        folder.mkdir(parents=True)
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, Path, FileName) VALUES (?, ?, ?);",
+            [("r1", str(Path("photos") / "2020" / "01"), "kept.jpg")],
+        )
+        for name in ["kept.jpg", "deleted.jpg", ".hidden", "gphotos.trace"]:
+            (folder / name).write_bytes(b"x")
+        (self.root / "photos" / "deleted too.jpg").write_bytes(b"x")
+        expected = [folder / "deleted.jpg", self.root / "photos" / "deleted too.jpg"]
+
+        self.assertEqual(expected, self.index.check_for_removed(dry_run=True))
+        self.assertTrue(all(path.exists() for path in expected))
+
+        self.assertEqual(expected, self.index.check_for_removed())
+        self.assertFalse(any(path.exists() for path in expected))
+        self.assertEqual(
+            [".hidden", "gphotos.trace", "kept.jpg"],
+            sorted(path.name for path in folder.iterdir()),
+        )
+        self.assertEqual([], self.index.check_for_removed())
+
+    def test_get_extra_meta(self):
+        folder = self.root / "photos"
+        shutil.copytree(str(test_data), str(folder))
+        names = sorted(path.name for path in folder.glob("*.jpg"))
+        rows = [("r{}".format(i), "photos", name, 1) for i, name in enumerate(names)]
+        rows.append(("missing", "photos", "not_downloaded.jpg", 0))
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, Path, FileName, Downloaded) "
+            "VALUES (?, ?, ?, ?);",
+            rows,
+        )
+
+        self.index.get_extra_meta()
+
+        self.db.cur.execute(
+            "SELECT FileName, Uid, CreateDate, FileSize, Downloaded FROM SyncFiles "
+            "ORDER BY Id;"
+        )
+        expected = []
+        for name in names:
+            media = LocalFilesMedia(folder / name)
+            expected.append((name, media.uid, str(media.create_date), media.size, 1))
+        expected.append(("not_downloaded.jpg", None, None, None, 0))
+        self.assertEqual(expected, [tuple(row) for row in self.db.cur.fetchall()])
@@ -0,0 +1,114 @@
+import random
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+import gphotos.SimilarImages as SimilarImages
+from gphotos.LocalData import LocalData
+from gphotos.SimilarImages import BKTree, hamming
+
+test_data = Path(__file__).absolute().parent.parent / "test-data"
+
+
+class TestSimilarImages(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.db = LocalData(self.root)
+
+    def tearDown(self):
+        self.db.con.close()
+        shutil.rmtree(str(self.root))
+
+    def test_bk_tree(self):
+        """ the tree finds the same hashes as comparing against them all """
+        rnd = random.Random(1)
+        hashes = [rnd.getrandbits(64) for _ in range(500)]
+        # some near copies
+        hashes += [h ^ (1 << rnd.randrange(64)) for h in hashes[:50]]
+        tree = BKTree()
+        for i, h in enumerate(hashes):
+            tree.add(h, i)
+
+        for target in hashes[:20] + [rnd.getrandbits(64) for _ in range(20)]:
+            for distance in (0, 3, 20):
+                expected = sorted(
+                    (hamming(target, h), i)
+                    for i, h in enumerate(hashes)
+                    if hamming(target, h) <= distance
+                )
+                self.assertEqual(expected, tree.search(target, distance))
+
+    def add_file(self, folder: Path, name: str, image_hash: int) -> Path:
+        """ make a file and put its hash in the cache """
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / name
+        path.write_bytes(name.encode())
+        stat = path.stat()
+        self.db.put_image_hashes(
+            [(str(path), stat.st_size, stat.st_mtime_ns, image_hash)]
+        )
+        return path
+
+    def test_match_cached(self):
+        near = 0xFFFF0000FFFF0000
+        photos = self.root / "photos"
+        local = self.root / "local"
+        self.db.cur.executemany(
+            "INSERT INTO SyncFiles (RemoteId, Path, FileName, MimeType, Downloaded) "
+            "VALUES (?, 'photos', ?, 'image/jpeg', 1);",
+            [("r1", "a.jpg"), ("r2", "b.jpg"), ("r3", "c.jpg")],
+        )
+        self.add_file(photos, "a.jpg", near)
+        self.add_file(photos, "b.jpg", near ^ 0b1)
+        self.add_file(photos, "c.jpg", 0)
+        self.db.cur.executemany(
+            "INSERT INTO LocalFiles (RemoteId, Path, FileName, MimeType) "
+            "VALUES (?, ?, ?, 'image/jpeg');",
+            [
+                (None, str(local), "copy1.jpg"),
+                (None, str(local), "copy2.jpg"),
+                (None, str(local), "copy3.jpg"),
+                (None, str(local), "other.jpg"),
+                ("r3", str(local), "c.jpg"),
+            ],
+        )
+        # copy1 is nearest to r2, copy2 gets r1 which is next nearest
+        self.add_file(local, "copy1.jpg", near ^ 0b11)
+        self.add_file(local, "copy2.jpg", near ^ 0b11)
+        # nothing unused is near enough
+        self.add_file(local, "copy3.jpg", near ^ 0b11)
+        self.add_file(local, "other.jpg", 0x0F0F0F0F0F0F0F0F)
+
+        count = SimilarImages.SimilarImages(self.root, self.db).match()
+        self.assertEqual(2, count)
+        self.db.cur.execute("SELECT FileName, RemoteId FROM LocalFiles ORDER BY Id;")
+        self.assertEqual(
+            [
+                ("copy1.jpg", "r2"),
+                ("copy2.jpg", "r1"),
+                ("copy3.jpg", None),
+                ("other.jpg", None),
+                ("c.jpg", "r3"),
+            ],
+            [tuple(row) for row in self.db.cur.fetchall()],
+        )
+
+    @skipUnless(SimilarImages._have_imaging, "needs Pillow and numpy")
+    def test_image_hashes(self):
+        from PIL import Image
+
+        original = test_data / "20180126_185832.jpg"
+        small = self.root / "small.jpg"
+        with Image.open(str(original)) as image:
+            small_size = (image.width // 4, image.height // 4)
+            image.resize(small_size).save(str(small), quality=60)
+        other = test_data / "1987-JohnWoodAndGiles.jpg"
+        missing = self.root / "missing.jpg"
+
+        h1, h2, h3, h4 = SimilarImages.image_hashes(
+            [str(original), str(small), str(other), str(missing)]
+        )
+        self.assertLessEqual(hamming(h1, h2), SimilarImages.MAX_DISTANCE)
+        self.assertGreater(hamming(h1, h3), SimilarImages.MAX_DISTANCE)
+        self.assertIsNone(h4)
@@ -0,0 +1,65 @@
+import logging
+import os
+import subprocess
+import sys
+from typing import Dict
+from unittest import TestCase, skipUnless
+
+# dependencies of the sync subsystems that must not be imported until needed
+LAZY_MODULES = [
+    "requests",
+    "requests_oauthlib",
+    "exif",
+    "psutil",
+    "appdirs",
+    "http.server",
+]
+# target for importing the entry point module, in microseconds. gphotos-sync
+# is launched many times a day per account so this matters
+IMPORT_BUDGET_US = 250000
+# set this environment variable to run the import time benchmark. The
+# results are logged at WARNING, e.g. view them with pytest -o log_cli=true
+BENCHMARK = "GPHOTOS_BENCHMARK"
+
+log = logging.getLogger(__name__)
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """ the cumulative import time in microseconds of every module imported
+    by module, measured in a fresh interpreter with python -X importtime """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup(TestCase):
+    def test_lazy_imports(self):
+        times = import_times("gphotos.Main")
+        self.assertIn("gphotos.Main", times)
+        for lazy in LAZY_MODULES + ["pkg_resources"]:
+            self.assertNotIn(lazy, times, "{} imported at startup".format(lazy))
+
+    @skipUnless(os.environ.get(BENCHMARK), "set {} to run".format(BENCHMARK))
+    def test_import_time(self):
+        # take the best of a few runs to allow for a busy machine
+        runs = [import_times("gphotos.Main") for _ in range(5)]
+        best = min(times["gphotos.Main"] for times in runs)
+        slowest = sorted(runs[0].items(), key=lambda item: -item[1])[1:6]
+        log.warning(
+            "import gphotos.Main: best %dus of %d runs (target %dus), "
+            "slowest imports: %s",
+            best,
+            len(runs),
+            IMPORT_BUDGET_US,
+            ", ".join("{} {}us".format(name, us) for name, us in slowest),
+        )
+        self.assertLess(best, IMPORT_BUDGET_US)
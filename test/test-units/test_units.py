@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from unittest import TestCase
@@ -54,6 +56,44 @@ class TestUnits(TestCase):
         # .2 timeout by 5 retries = 1 sec
         self.assertGreater(elapsed.seconds, 1)
 
+    def test_shared_token_refresh(self):
+        def refresh(session, token_url, **kwargs):
+            time.sleep(0.1)
+            session.token = {
+                "access_token": "new",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+            }
+            return session.token
+
+        updates = []
+        session = auth.SharedOAuth2Session(
+            "client",
+            token={"access_token": "old", "token_type": "Bearer", "expires_in": -10},
+            auto_refresh_url="https://example.com/token",
+            token_updater=updates.append,
+        )
+        with patch(
+            "gphotos.authorize.OAuth2Session.refresh_token",
+            autospec=True,
+            side_effect=refresh,
+        ) as refreshed, patch("requests.Session.request") as request:
+            threads = [
+                threading.Thread(target=session.get, args=("https://example.com",))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # the expired token is only refreshed once
+        self.assertEqual(1, refreshed.call_count)
+        self.assertEqual(4, request.call_count)
+        for call in request.call_args_list:
+            self.assertEqual("Bearer new", call[1]["headers"]["Authorization"])
+        self.assertTrue(all(token["access_token"] == "new" for token in updates))
+
     def test_jpg_description(self):
         p = test_data / "IMG_20190102_112832.jpg"
         lfm = LocalFilesMedia(p)
@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from gphotos import VideoMetadata
+from gphotos.LocalFilesMedia import LocalFilesMedia
+
+
+def atom(kind: bytes, content: bytes) -> bytes:
+    return (len(content) + 8).to_bytes(4, "big") + kind + content
+
+
+def mp4(
+    created: datetime, version: int = 0, epoch: datetime = VideoMetadata.MP4_EPOCH
+) -> bytes:
+    seconds = int((created - epoch).total_seconds())
+    width = 8 if version else 4
+    mvhd = bytes([version, 0, 0, 0]) + seconds.to_bytes(width, "big") * 2
+    mvhd += bytes(100)
+    return (
+        atom(b"ftyp", b"isom\x00\x00\x02\x00isomiso2mp41")
+        + atom(b"free", bytes(16))
+        + atom(b"mdat", bytes(1000))
+        + atom(b"moov", atom(b"mvhd", mvhd) + atom(b"trak", bytes(50)))
+    )
+
+
+class TestVideoMeta(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        VideoMetadata._cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.root))
+
+    def test_mvhd(self):
+        created = datetime(2020, 1, 2, 3, 4, 5)
+        for version, name in ((0, "v0.mp4"), (1, "v1.MOV")):
+            video = self.root / name
+            video.write_bytes(mp4(created, version))
+            self.assertEqual(created, VideoMetadata.mvhd_creation_time(video))
+
+            media = LocalFilesMedia(video)
+            self.assertTrue(media.got_meta)
+            self.assertEqual(created, media.create_date)
+
+        # written with seconds since 1970 instead of 1904
+        video = self.root / "unix.mp4"
+        video.write_bytes(mp4(created, epoch=VideoMetadata.UNIX_EPOCH))
+        self.assertEqual(created, VideoMetadata.mvhd_creation_time(video))
+
+        # no moov atom
+        video = self.root / "truncated.mp4"
+        video.write_bytes(mp4(created)[:100])
+        self.assertIsNone(VideoMetadata.mvhd_creation_time(video))
+
+    @patch("gphotos.VideoMetadata._ffprobe_installed", None)
+    def test_missing_ffprobe(self):
+        videos = [self.root / "clip{}.avi".format(i) for i in range(4)]
+        for video in videos:
+            video.write_bytes(bytes(1000))
+        with patch("shutil.which", return_value=None) as which:
+            VideoMetadata.prefetch(videos[:2])
+            for video in videos:
+                media = LocalFilesMedia(video)
+                self.assertFalse(media.got_meta)
+        # ffprobe is only looked for once
+        which.assert_called_once_with("ffprobe")
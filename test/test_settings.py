@@ -0,0 +1,34 @@
+"""Settings for unit tests that construct the sync classes directly"""
+
+from pathlib import Path
+
+from gphotos.Settings import Settings
+
+
+def make_settings() -> Settings:
+    return Settings(
+        start_date=None,
+        end_date=None,
+        use_start_date=False,
+        photos_path=Path("photos"),
+        use_flat_path=False,
+        albums_path=Path("albums"),
+        album_index=True,
+        omit_album_date=False,
+        album=None,
+        shared_albums=True,
+        favourites_only=False,
+        include_video=True,
+        archived=False,
+        use_hardlinks=False,
+        retry_download=False,
+        rescan=False,
+        max_retries=5,
+        max_threads=2,
+        durable_downloads=False,
+        download_order=[],
+        max_bandwidth=0,
+        bandwidth_schedule=[],
+        case_insensitive_fs=False,
+        progress=False,
+    )